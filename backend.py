@@ -0,0 +1,1068 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.backend
+
+The things that actually answer a Solver's queries. A Backend takes a
+Query and returns a pair of (status, model): status is 'sat', 'unsat',
+one of the ways of giving up in incomplete, or the error the solver
+reported. model is a mapping from symbol names to Constants for a
+satisfiable query that asked for one.
+
+ProcessBackend runs a fresh solver process for every query, and
+SessionBackend keeps one incremental process per thread (see
+smt.session). Z3Backend calls z3 in-process through its Python
+bindings, when they are installed, so there are no processes or text
+in the way. FakeBackend is a deterministic stand-in for tests that
+never runs a real solver. PortfolioBackend races several others.
+
+Every backend can also minimize(), maximize() or enumerate() the
+values of a term under a query. These narrow the query down step by
+step through a Search. The base one sends the whole query again for
+every step, while SessionBackend works inside one scope of its session
+and Z3Backend inside one z3 solver, so each step only costs the new
+constraint.
+
+query_async() is the same for asyncio: ProcessBackend (and so
+SessionBackend, whose sessions belong to threads) talks to a one-shot
+solver process through asyncio pipes, while the others run query() on
+the event loop's executor.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import os
+import random
+import subprocess
+import threading
+import time
+
+import smt.bitvector as bv
+import smt.boolean as bl
+import smt.utils
+from smt.cache import WeakCache
+from smt.enums import *
+from smt.model import Model, _constant, _read, parse_model, tokenize
+from smt.path import assertions, declarations
+from smt.session import Session
+from smt.utils import *
+
+try:
+    import z3
+except ImportError:
+    z3 = None
+
+
+# the statuses for a query the solver gave up on
+incomplete = frozenset(['unknown', 'timeout', 'memout', 'cancelled'])
+
+
+class Query(object):
+    """The conjunction of groups (a list of sequences of expressions,
+    outermost first, as for Session.query()) and optionally expr. smt2
+    is the text of the query as one script, or a function that builds
+    it; it is only built for backends that need it, and built from the
+    expressions if it isn't given.
+
+    The solver should give up after timeout seconds, or once it needs
+    more than memory megabytes. A query can also be cancelled from
+    another thread while a backend works on it; backends register what
+    to do about that with on_cancel().
+
+    The time spent building the text and reading a model back, and the
+    size of the text, are recorded in metrics (see smt.metrics) if it
+    is given.
+    """
+
+    def __init__(self, groups, expr=None, model=False, smt2=None, timeout=None, memory=None,
+                 metrics=None):
+        self.groups = groups
+        self.expr = expr
+        self.model = model
+        self.timeout = timeout
+        self.memory = memory
+        self.metrics = metrics
+        self.cancelled = False
+        self.expired = False
+        self._smt2 = smt2
+        self._symbols = None
+        self._copied = False
+        self._lock = threading.Lock()
+        self._cancellers = []
+
+    def smt2(self):
+        with self._lock:
+            if self._smt2 is None or callable(self._smt2):
+                started = time.perf_counter()
+                self._smt2 = self._build()
+                if self.metrics is not None and not self._copied:
+                    self.metrics.observe('serialize', time.perf_counter() - started)
+                    self.metrics.observe('query.bytes', len(self._smt2))
+            return self._smt2
+
+    def _build(self):
+        if self._smt2 is None:
+            smt2 = '(set-logic QF_BV)\n'
+            smt2 += declarations(sorted(self.symbols(), key=lambda symbol: symbol.name))
+            smt2 += assertions(self.exprs())
+            smt2 += '(check-sat)\n'
+            if self.model:
+                smt2 += '(get-model)\n'
+            return smt2
+        return self._smt2()
+
+    def copy(self):
+        """The same query, cancelled separately from this one."""
+
+        output = Query(self.groups, self.expr, self.model, self.smt2, self.timeout, self.memory,
+                       self.metrics)
+        output._symbols = self._symbols
+        # the text is measured once, by this query
+        output._copied = True
+        return output
+
+    def on_cancel(self, function):
+        """Call function if the query is cancelled, or straight away if
+        it already has been. Returns function, to pass to done().
+        """
+
+        with self._lock:
+            if not self.cancelled:
+                self._cancellers.append(function)
+                return function
+        function()
+        return function
+
+    def done(self, function):
+        """Forget a function given to on_cancel()."""
+
+        with self._lock:
+            if function in self._cancellers:
+                self._cancellers.remove(function)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cancellers, self._cancellers = self._cancellers, []
+        for function in cancellers:
+            function()
+
+    def exprs(self):
+        output = []
+        for group in self.groups:
+            output.extend(group)
+        if self.expr is not None:
+            output.append(self.expr)
+        return output
+
+    def symbols(self):
+        if self._symbols is None:
+            symbols = set()
+            for e in self.exprs():
+                symbols.update(e.symbols())
+            self._symbols = symbols
+        return self._symbols
+
+
+class AdaptiveTimeout(object):
+    """A timeout (for Solver.timeout) that follows the solve times seen
+    so far: factor times the given quantile of the last history of
+    them, kept between minimum and maximum. It is maximum until warmup
+    times have been seen.
+    """
+
+    def __init__(self, minimum=0.1, maximum=60.0, factor=4.0, quantile=0.95, history=256, warmup=16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.quantile = quantile
+        self.warmup = warmup
+        self._times = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if len(self._times) < self.warmup:
+                return self.maximum
+            times = sorted(self._times)
+        value = times[min(len(times) - 1, int(len(times) * self.quantile))] * self.factor
+        return min(self.maximum, max(self.minimum, value))
+
+    def record(self, elapsed, status):
+        # a query that ran out of time would have taken at least as
+        # long, so it still pushes the timeout up
+        if status != 'cancelled':
+            with self._lock:
+                self._times.append(elapsed)
+
+
+def parse_output(output, query):
+    """The (status, model) pair for the raw text output of a solver."""
+
+    status = output.split('\n', 1)[0].strip()
+    if status.startswith('(error') and 'out of memory' in status:
+        status = 'memout'
+    elif status == 'unknown' and query.expired:
+        status = 'timeout'
+    model = None
+    if status == 'sat' and query.model:
+        started = time.perf_counter()
+        model = parse_model(output, set(symbol.name for symbol in query.symbols()))
+        if query.metrics is not None:
+            query.metrics.observe('parse', time.perf_counter() - started)
+    return status, model
+
+
+def _watchdog(query, function, grace):
+    """Call function if query is still going grace seconds after its
+    timeout, for a solver that doesn't give up on time by itself.
+    Returns the timer to cancel, or None.
+    """
+
+    if query.timeout is None:
+        return None
+
+    def expire():
+        query.expired = True
+        function()
+
+    timer = threading.Timer(query.timeout + grace, expire)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class Search(object):
+    """A query narrowed down one step at a time, to find the values of
+    term under it. check() answers (status, value) for the query with
+    one more constraint, value being that of term in the model found;
+    add() adds a constraint for good. Bounds on term are cheapest when
+    written on self.term, which may be a stand-in for it.
+
+    This one sends backend the whole query for every check.
+    """
+
+    def __init__(self, backend, query, term):
+        self.backend = backend
+        self.query = query
+        self.term = term
+        self._added = []
+
+    def check(self, constraint=None):
+        group = list(self._added)
+        if constraint is not None:
+            group.append(constraint)
+        query = Query(self.query.groups + [group], self.query.expr, True, None,
+                      self.query.timeout, self.query.memory, self.query.metrics)
+
+        stop = self.query.on_cancel(query.cancel)
+        try:
+            status, model = self.backend.query(query)
+        finally:
+            self.query.done(stop)
+        if status != 'sat':
+            return status, None
+
+        # the solver leaves out symbols whose value doesn't matter
+        assignment = dict()
+        for symbol in self.term.symbols():
+            assignment[symbol.name] = 0
+        if model is not None:
+            assignment.update(model)
+        return status, self.term.evaluate(assignment)
+
+    def add(self, constraint):
+        self._added.append(constraint)
+
+    def close(self):
+        pass
+
+
+class Backend(object):
+
+    # whether answers can be kept in the persistent Solver.store
+    persistent = True
+
+    # how long past its timeout a query is left before it is killed
+    grace = 1.0
+
+    def query(self, query):
+        raise NotImplementedError()
+
+    def search(self, query, term):
+        """A Search for the values of term under query."""
+
+        return Search(self, query, term)
+
+    def _search(self, query, term, function):
+        if query.cancelled:
+            return 'cancelled', None
+        search = self.search(query, term)
+        try:
+            return function(search)
+        finally:
+            search.close()
+
+    def minimize(self, query, term):
+        """(status, value) for the least unsigned value of term under
+        query; value is None unless status is 'sat'.
+        """
+
+        return self._search(query, term, lambda search: _optimize(search, term.size, False))
+
+    def maximize(self, query, term):
+        """As minimize(), for the greatest value."""
+
+        return self._search(query, term, lambda search: _optimize(search, term.size, True))
+
+    def enumerate(self, query, term, limit):
+        """(status, values) for up to limit distinct values of term
+        under query; status is 'unsat' if there aren't any.
+        """
+
+        return self._search(query, term, lambda search: _enumerate(search, term.size, limit))
+
+    async def query_async(self, query):
+        future = asyncio.get_event_loop().run_in_executor(None, self.query, query)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            query.cancel()
+            raise
+
+    def close(self):
+        pass
+
+
+def _optimize(search, size, maximize):
+    """Find the least (or greatest) value of search.term. Each model
+    found moves the best value so far, and each step halves the range
+    still to be ruled out, so this takes at most size + 1 checks.
+    """
+
+    status, best = search.check()
+    if status != 'sat':
+        return status, None
+
+    # the values in [low, high] that are better than best are those
+    # that haven't been ruled out yet
+    low, high = 0, carry_bit(size) - 1
+    while (best < high) if maximize else (best > low):
+        if maximize:
+            middle = (best + high + 2) // 2
+            status, value = search.check(search.term >= middle)
+        else:
+            middle = (low + best - 1) // 2
+            status, value = search.check(search.term <= middle)
+
+        if status == 'sat':
+            best = value
+        elif status == 'unsat':
+            if maximize:
+                high = middle - 1
+            else:
+                low = middle + 1
+        else:
+            return status, None
+
+    return 'sat', best
+
+
+def _enumerate(search, size, limit):
+    """Find up to limit values of search.term, blocking each one in
+    turn; one check per value, and one more to find there are no more
+    unless every value of size bits has been seen (showing that is a
+    pigeonhole problem, which solvers are very slow at).
+    """
+
+    values = []
+    while len(values) < min(limit, carry_bit(size)):
+        status, value = search.check()
+        if status == 'unsat':
+            break
+        elif status != 'sat':
+            return status, None
+        values.append(value)
+        search.add(search.term != value)
+
+    if not values:
+        return 'unsat', values
+    return 'sat', values
+
+
+class ProcessBackend(Backend):
+    """A new solver process for every query, fed through a pipe. The
+    logic, a tactic to check with instead of the default, and options
+    to set (a dict, such as {'smt.random_seed': 7}) can be given.
+    """
+
+    command = ['z3', '-smt2', '-in']
+
+    def __init__(self, command=None, logic=None, tactic=None, options=None):
+        if command is not None:
+            self.command = command
+        self.logic = logic
+        self.tactic = tactic
+        self.options = options or dict()
+
+    def run(self, smt2, query=None):
+        process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+        if query is None:
+            output, _ = process.communicate(smt2)
+            return output
+
+        limit = None
+        if query.timeout is not None:
+            limit = query.timeout + self.grace
+
+        kill = query.on_cancel(process.kill)
+        try:
+            output, _ = process.communicate(smt2, timeout=limit)
+        except subprocess.TimeoutExpired:
+            query.expired = True
+            process.kill()
+            process.communicate()
+            return 'timeout\n'
+        finally:
+            query.done(kill)
+        if query.cancelled:
+            return 'cancelled\n'
+        return output
+
+    def script(self, query):
+        """The text to send the solver for query."""
+
+        smt2 = query.smt2()
+        if self.logic is not None:
+            smt2 = smt2.replace('(set-logic QF_BV)', '(set-logic {0})'.format(self.logic), 1)
+        if self.tactic is not None:
+            smt2 = smt2.replace('(check-sat)', '(check-sat-using {0})'.format(self.tactic), 1)
+
+        preamble = ''
+        for name, value in sorted(self.options.items()):
+            preamble += '(set-option :{0} {1})\n'.format(name, value)
+        if query.timeout is not None:
+            preamble += '(set-option :timeout {0})\n'.format(max(1, int(query.timeout * 1000)))
+        if query.memory is not None:
+            preamble += '(set-option :memory_max_size {0})\n'.format(int(query.memory))
+        return preamble + smt2
+
+    async def run_async(self, smt2, query):
+        process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+
+        limit = None
+        if query.timeout is not None:
+            limit = query.timeout + self.grace
+
+        loop = asyncio.get_event_loop()
+
+        def kill():
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+
+        # cancelling can come from any thread
+        stop = query.on_cancel(lambda: loop.call_soon_threadsafe(kill))
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(smt2.encode('utf8')), limit)
+        except asyncio.TimeoutError:
+            query.expired = True
+            kill()
+            await process.wait()
+            return 'timeout\n'
+        except asyncio.CancelledError:
+            kill()
+            await process.wait()
+            raise
+        finally:
+            query.done(stop)
+        if query.cancelled:
+            return 'cancelled\n'
+        return output.decode('utf8').replace('\r\n', '\n')
+
+    def _answer(self, output, query, started):
+        status, model = parse_output(output, query)
+        if status == 'unknown' and query.timeout is not None and time.time() - started >= query.timeout:
+            status = 'timeout'
+        return status, model
+
+    def query(self, query):
+        started = time.time()
+        return self._answer(self.run(self.script(query), query), query, started)
+
+    async def query_async(self, query):
+        started = time.time()
+        return self._answer(await self.run_async(self.script(query), query), query, started)
+
+
+class SessionBackend(ProcessBackend):
+    """A persistent incremental solver process for each thread, falling
+    back to a one-shot process for a query whenever a session can't be
+    started or dies.
+    """
+
+    def __init__(self, command=None):
+        ProcessBackend.__init__(self, command)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            try:
+                session = Session(self.command)
+            except (OSError, SessionError):
+                return None
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def query(self, query):
+        session = self._session()
+        if session is not None:
+            started = time.time()
+            kill = query.on_cancel(session.kill)
+            timer = _watchdog(query, session.kill, self.grace)
+            try:
+                output = session.query(query.groups, query.expr, query.model,
+                                       query.timeout, query.memory)
+                return self._answer(output, query, started)
+            except SessionError:
+                # the process died; this query goes one-shot and the
+                # next one will try to start a fresh session.
+                self._lost(session)
+                if query.cancelled:
+                    return 'cancelled', None
+                elif query.expired:
+                    return 'timeout', None
+            finally:
+                query.done(kill)
+                if timer is not None:
+                    timer.cancel()
+
+        return ProcessBackend.query(self, query)
+
+    def _lost(self, session):
+        if getattr(self._local, 'session', None) is session:
+            self._local.session = None
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+
+    def search(self, query, term):
+        session = self._session()
+        if session is None:
+            return Search(self, query, term)
+        return SessionSearch(self, query, term, session)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self._local = threading.local()
+
+
+_searches = itertools.count()
+
+
+class SessionSearch(Search):
+    """A Search inside one scope of a session. The term is given a name
+    there once, so each check only sends a bound on that name; if the
+    session dies, the search carries on one query at a time.
+    """
+
+    def __init__(self, backend, query, term, session):
+        Search.__init__(self, backend, query, term)
+        self.term = bv.Symbol(term.size, '_search{0}'.format(next(_searches)))
+        self._session = session
+        self._stop = query.on_cancel(session.kill)
+
+        exprs = [self.term == term]
+        if query.expr is not None:
+            exprs.append(query.expr)
+        try:
+            session.begin(query.groups, exprs)
+        except SessionError:
+            self._lost()
+        # only needed if the rest of the search goes one-shot
+        self._added.append(exprs[0])
+
+    def _lost(self):
+        self.backend._lost(self._session)
+        self._session = None
+
+    def check(self, constraint=None):
+        if self._session is None:
+            return Search.check(self, constraint)
+
+        started = time.time()
+        timer = _watchdog(self.query, self._session.kill, self.backend.grace)
+        try:
+            output = self._session.check_value(
+                [constraint] if constraint is not None else [], self.term,
+                self.query.timeout, self.query.memory)
+        except SessionError:
+            self._lost()
+            if self.query.cancelled:
+                return 'cancelled', None
+            elif self.query.expired:
+                return 'timeout', None
+            return Search.check(self, constraint)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        status, _ = self.backend._answer(output, self.query, started)
+        if status != 'sat':
+            return status, None
+        tokens = tokenize(output.split('\n', 1)[1])
+        values = _read(tokens, next(tokens))
+        return status, _constant(self.term.size, values[0][1]).value
+
+    def add(self, constraint):
+        Search.add(self, constraint)
+        if self._session is not None:
+            try:
+                self._session.add([constraint])
+            except SessionError:
+                self._lost()
+
+    def close(self):
+        self.query.done(self._stop)
+        if self._session is not None:
+            try:
+                self._session.end()
+            except SessionError:
+                self._lost()
+
+
+if z3 is not None:
+    _z3_functions = {
+        'bvand': lambda a, b: a & b,
+        'bvor': lambda a, b: a | b,
+        'bvnand': lambda a, b: ~(a & b),
+        'bvnor': lambda a, b: ~(a | b),
+        'bvxor': lambda a, b: a ^ b,
+        'bvxnor': lambda a, b: ~(a ^ b),
+        'bvadd': lambda a, b: a + b,
+        'bvmul': lambda a, b: a * b,
+        'bvudiv': z3.UDiv,
+        'bvurem': z3.URem,
+        'bvsub': lambda a, b: a - b,
+        'bvsdiv': lambda a, b: a / b,
+        'bvsrem': z3.SRem,
+        'bvsmod': lambda a, b: a % b,
+        'bvshl': lambda a, b: a << b,
+        'bvlshr': z3.LShR,
+        'bvashr': lambda a, b: a >> b,
+        'ext_rotate_left': z3.RotateLeft,
+        'ext_rotate_right': z3.RotateRight,
+        'bvult': z3.ULT,
+        'bvule': z3.ULE,
+        'bvugt': z3.UGT,
+        'bvuge': z3.UGE,
+        'bvslt': lambda a, b: a < b,
+        'bvsle': lambda a, b: a <= b,
+        'bvsgt': lambda a, b: a > b,
+        'bvsge': lambda a, b: a >= b,
+        '=': lambda a, b: a == b,
+        'and': lambda a, b: z3.And(a, b),
+        'or': lambda a, b: z3.Or(a, b),
+        'xor': z3.Xor,
+        '=>': z3.Implies,
+    }
+
+
+def _z3_unary(e, values, context):
+    if e.op == UnaryOperator.Negate and isinstance(e, bv.UnaryOperation):
+        return -values[0]
+    elif e.op == UnaryOperator.Not and isinstance(e, bv.BooleanUnaryOperation):
+        return ~values[0]
+    elif e.op == UnaryOperator.Not and isinstance(e, bl.UnaryOperation):
+        return z3.Not(values[0])
+    raise InvalidExpression(e)
+
+
+def _z3_binary(e, values, context):
+    return _z3_functions[e.operators[e.op]](values[0], values[1])
+
+
+def _z3_concatenation(e, values, context):
+    if len(values) == 1:
+        return values[0]
+    return z3.Concat(*values)
+
+
+def _z3_extension(e, values, context):
+    if e.kind == ExtensionKind.Sign:
+        return z3.SignExt(e.extension_size, values[0])
+    return z3.ZeroExt(e.extension_size, values[0])
+
+
+# how to build the z3 AST for each class, given its children's
+_z3_builders = {
+    bv.Constant: lambda e, values, context: z3.BitVecVal(e.value, e.size, context),
+    bv.Symbol: lambda e, values, context: z3.BitVec(e.name, e.size, context),
+    bl.Constant: lambda e, values, context: z3.BoolVal(bool(e.value), context),
+    bl.Symbol: lambda e, values, context: z3.Bool(e.name, context),
+    bv.UnaryOperation: _z3_unary,
+    bv.BooleanUnaryOperation: _z3_unary,
+    bl.UnaryOperation: _z3_unary,
+    bv.BinaryOperation: _z3_binary,
+    bv.BooleanBinaryOperation: _z3_binary,
+    bl.BinaryOperation: _z3_binary,
+    bv.Concatenation: _z3_concatenation,
+    bv.Repetition: lambda e, values, context: z3.RepeatBitVec(e.count, values[0]),
+    bv.Extraction: lambda e, values, context: z3.Extract(e.end - 1, e.start, values[0]),
+    bv.Extension: _z3_extension,
+    bv.IfThenElse: lambda e, values, context: z3.If(values[0], values[1], values[2], context),
+    bl.IfThenElse: lambda e, values, context: z3.If(values[0], values[1], values[2], context),
+}
+
+
+class _Z3Cache(WeakCache):
+    """The z3 ASTs for one thread's context. Only that thread may touch
+    anything in the context, so the ASTs of expressions that die in
+    other threads are held until it calls release().
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._owner = threading.get_ident()
+        self._dead = []
+        WeakCache.__init__(self, *args, **kwargs)
+
+    def _expire(self, key):
+        if threading.get_ident() != self._owner:
+            value = self._values.get(key)
+            if value is not None:
+                self._dead.append(value)
+        WeakCache._expire(self, key)
+
+    def release(self):
+        # popped one at a time, as other threads may be adding to it
+        while self._dead:
+            self._dead.pop()
+
+
+class Z3Backend(Backend):
+    """In-process solving through the z3 Python bindings. Each thread
+    has its own z3 context, with the translation of every expression
+    remembered for as long as the expression is alive (up to
+    max_entries per thread). logic, tactic and options are as for
+    ProcessBackend.
+    """
+
+    def __init__(self, logic='QF_BV', tactic=None, options=None, max_entries=1 << 20):
+        if z3 is None:
+            raise ImportError('the z3 python bindings are not installed')
+        self.logic = logic
+        self.tactic = tactic
+        self.options = options or dict()
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _context(self):
+        context = getattr(self._local, 'context', None)
+        if context is None:
+            context = z3.Context()
+            self._local.context = context
+            self._local.asts = _Z3Cache(max_entries=self.max_entries)
+        self._local.asts.release()
+        return context, self._local.asts
+
+    def translate(self, expr):
+        """The z3 AST for expr, in this thread's context."""
+
+        context, asts = self._context()
+
+        def build(e, values):
+            ast = _z3_builders[type(e)](e, values, context)
+            asts[e] = ast
+            return ast
+
+        return smt.utils._postorder(expr, build, asts.get)
+
+    def solver(self, query):
+        """A z3 solver for query, with all of its expressions added."""
+
+        context, asts = self._context()
+        if self.tactic is not None:
+            solver = z3.Tactic(self.tactic, ctx=context).solver()
+        else:
+            solver = z3.SolverFor(self.logic, ctx=context)
+        for name, value in self.options.items():
+            solver.set(name, value)
+        if query.timeout is not None:
+            solver.set('timeout', max(1, int(query.timeout * 1000)))
+        if query.memory is not None:
+            solver.set('max_memory', int(query.memory))
+        for e in query.exprs():
+            solver.add(self.translate(e))
+        return solver
+
+    def check(self, solver, query):
+        """The status from checking solver, which is working on query."""
+
+        context, asts = self._context()
+        interrupt = query.on_cancel(context.interrupt)
+        timer = _watchdog(query, context.interrupt, self.grace)
+        try:
+            result = solver.check()
+        finally:
+            query.done(interrupt)
+            if timer is not None:
+                timer.cancel()
+        if query.cancelled:
+            return 'cancelled'
+        elif result == z3.unknown:
+            reason = solver.reason_unknown()
+            if query.expired or reason == 'timeout':
+                return 'timeout'
+            elif 'memory' in reason:
+                return 'memout'
+        if result == z3.unsat:
+            return 'unsat'
+        elif result != z3.sat:
+            return str(result)
+        return 'sat'
+
+    def search(self, query, term):
+        return Z3Search(self, query, term)
+
+    def query(self, query):
+        solver = self.solver(query)
+        status = self.check(solver, query)
+        if status != 'sat' or not query.model:
+            return status, None
+
+        names = set(symbol.name for symbol in query.symbols())
+        z3_model = solver.model()
+        model = Model()
+        for declaration in z3_model.decls():
+            name = declaration.name()
+            if name not in names or declaration.arity() != 0:
+                continue
+            value = z3_model[declaration]
+            if z3.is_bv_value(value):
+                model[name] = bv.Constant(value.size(), value.as_long())
+            elif z3.is_true(value) or z3.is_false(value):
+                model[name] = bl.Constant(z3.is_true(value))
+        return 'sat', model
+
+
+class Z3Search(Search):
+    """A Search inside one z3 solver, with each check in its own scope."""
+
+    def __init__(self, backend, query, term):
+        Search.__init__(self, backend, query, term)
+        self._solver = backend.solver(query)
+        self._term = backend.translate(term)
+
+    def check(self, constraint=None):
+        self._solver.push()
+        try:
+            if constraint is not None:
+                self._solver.add(self.backend.translate(constraint))
+            status = self.backend.check(self._solver, self.query)
+            if status != 'sat':
+                return status, None
+            value = self._solver.model().eval(self._term, model_completion=True)
+            return status, value.as_long()
+        finally:
+            self._solver.pop()
+
+    def add(self, constraint):
+        self._solver.add(self.backend.translate(constraint))
+
+
+class FakeBackend(Backend):
+    """A deterministic pure-python stand-in for a solver, for tests.
+    It tries every assignment to the symbols of a query if there are
+    at most exhaustive_bits of them, so that its unsat answers are
+    right; otherwise it tries samples assignments drawn from a fixed
+    seed, and answers unknown if none of them works.
+    """
+
+    persistent = False
+
+    def __init__(self, exhaustive_bits=16, samples=4096, seed=0):
+        self.exhaustive_bits = exhaustive_bits
+        self.samples = samples
+        self.seed = seed
+
+    def _assignments(self, sizes):
+        total = sum(sizes)
+        if total <= self.exhaustive_bits:
+            for value in range(1 << total):
+                values = []
+                for size in sizes:
+                    values.append(value & (carry_bit(size) - 1))
+                    value >>= size
+                yield values
+            return
+
+        yield [0] * len(sizes)
+        yield [carry_bit(size) - 1 for size in sizes]
+        r = random.Random(self.seed)
+        for i in range(self.samples):
+            yield [r.getrandbits(size) for size in sizes]
+
+    def query(self, query):
+        exprs = query.exprs()
+        symbols = sorted(query.symbols(), key=lambda symbol: symbol.name)
+        sizes = [symbol.size if isinstance(symbol, bv.Expression) else 1 for symbol in symbols]
+
+        deadline = None
+        if query.timeout is not None:
+            deadline = time.time() + query.timeout
+
+        for values in self._assignments(sizes):
+            if query.cancelled:
+                return 'cancelled', None
+            elif deadline is not None and time.time() > deadline:
+                return 'timeout', None
+            assignment = dict()
+            for symbol, value in zip(symbols, values):
+                assignment[symbol.name] = value
+            if all(e.evaluate(assignment) for e in exprs):
+                model = None
+                if query.model:
+                    model = Model()
+                    for symbol, value in zip(symbols, values):
+                        if isinstance(symbol, bv.Expression):
+                            model[symbol.name] = bv.Constant(symbol.size, value)
+                        else:
+                            model[symbol.name] = bl.Constant(bool(value))
+                return 'sat', model
+
+        if sum(sizes) <= self.exhaustive_bits:
+            return 'unsat', None
+        return 'unknown', None
+
+
+class PortfolioBackend(Backend):
+    """Races several backends (such as solvers with different tactics,
+    logics, random seeds or binaries) on every query, taking the first
+    sat or unsat answer and cancelling the rest.
+
+    wins counts how often each member answered first. With width set,
+    only that many members race, those that have won most often, and
+    the rest are only tried if none of them gives an answer.
+    """
+
+    def __init__(self, members, width=None):
+        self.members = list(members)
+        self.width = width
+        self.wins = [0] * len(self.members)
+        self.persistent = all(member.persistent for member in self.members)
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.members) * (os.cpu_count() or 1))
+        # the copies of queries the members are working on
+        self._running = set()
+
+    def stats(self):
+        """Pairs of (member, wins), most wins first."""
+
+        with self._lock:
+            return [(self.members[i], self.wins[i]) for i in self._order()]
+
+    def _order(self):
+        # favour the members that have won before, in the order they
+        # were given otherwise
+        return sorted(range(len(self.members)), key=lambda i: -self.wins[i])
+
+    def _race(self, indices, query):
+        queries = dict((i, query.copy()) for i in indices)
+        with self._lock:
+            self._running.update(queries.values())
+
+        def cancel():
+            for q in queries.values():
+                q.cancel()
+
+        stop = query.on_cancel(cancel)
+        futures = dict()
+        for i in indices:
+            futures[self._pool.submit(self.members[i].query, queries[i])] = i
+
+        answer = None
+        error = None
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        status, model = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if status in ('sat', 'unsat'):
+                        with self._lock:
+                            self.wins[futures[future]] += 1
+                        return status, model
+                    answer = answer or (status, model)
+        finally:
+            query.done(stop)
+            cancel()
+            with self._lock:
+                self._running.difference_update(queries.values())
+
+        if answer is None and error is not None:
+            raise error
+        return answer
+
+    def query(self, query):
+        with self._lock:
+            order = self._order()
+        if self.width is None:
+            groups = [order]
+        else:
+            groups = [order[:self.width], order[self.width:]]
+
+        answer = None
+        for indices in groups:
+            if not indices:
+                continue
+            answer = self._race(indices, query)
+            if answer[0] in ('sat', 'unsat') or query.cancelled:
+                break
+        return answer
+
+    def close(self):
+        """Cancel what the members are working on, wait for them to
+        stop, and close them.
+        """
+
+        with self._lock:
+            running = list(self._running)
+        for query in running:
+            query.cancel()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for member in self.members:
+            member.close()
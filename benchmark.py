@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.benchmark
+
+Synthetic workloads shaped like symbolic execution, timed so changes
+to the expression classes or the solver can be compared:
+
+    fork_chain      a long path of fork()s, a branch condition added
+                    and checked at each one
+    memory          words stored and loaded a byte at a time, with
+                    concatenate() and extract()
+    accumulator     a checksum over a buffer, a long chain of adds and
+                    xors into one value
+    ite_tree        a wide nest of if_then_else()s, as for a jump table
+
+For each, construction of the nodes, their SMT2 as the solver is sent
+it (shared subterms as define-funs, since the accumulator's expanded
+tree is exponential in its length), fingerprinting every node (which
+is what __hash__ returns, worked out as the node is built),
+symbols(), and check()/model() end to end are timed. Solving uses
+FakeBackend and a fresh set of caches, so it never runs a real solver
+and gives the same answers every time; it is run cold and then again
+warm, and the cache hits and misses of each are kept.
+
+    python -m smt.benchmark [--scale N] [--repeat N] [--output results.json]
+    python -m smt.benchmark --compare before.json after.json
+
+Results are JSON, and --compare prints the ratio of the median times
+of two runs.
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import smt.bitvector as bv
+import smt.simplify
+import smt.utils
+from smt.backend import FakeBackend
+from smt.metrics import Metrics
+from smt.solver import Solver
+
+
+# bumped whenever a workload changes, so results from different
+# versions of one aren't compared
+version = 2
+
+
+def _fork_chain(scale, r):
+    """The branch conditions down a path depth long, over a few input
+    words, as (symbols, conditions).
+    """
+
+    symbols = [bv.Symbol(32, 'input_{0}'.format(i)) for i in range(4)]
+    conditions = []
+    for i in range(64 * scale):
+        x = symbols[r.randrange(len(symbols))]
+        value = (x + r.getrandbits(32)) ^ r.getrandbits(32)
+        conditions.append(value != r.getrandbits(32))
+    return symbols, conditions
+
+
+def _memory(scale, r):
+    """Loads from a memory of symbolic words stored a byte at a time,
+    including loads that straddle two of them.
+    """
+
+    words = [bv.Symbol(32, 'word_{0}'.format(i)) for i in range(16 * scale)]
+    memory = []
+    for word in words:
+        for i in range(4):
+            memory.append(word.extract(start=8 * i, end=8 * (i + 1)))
+
+    loads = []
+    for _ in range(64 * scale):
+        address = r.randrange(len(memory) - 4)
+        load = memory[address]
+        for i in range(1, 4):
+            load = memory[address + i].concatenate(load)
+        loads.append(load)
+    return words, loads
+
+
+def _accumulator(scale, r):
+    """A djb2-style checksum of a symbolic buffer, unrolled."""
+
+    data = [bv.Symbol(8, 'data_{0}'.format(i)) for i in range(128 * scale)]
+    acc = bv.Constant(32, 5381)
+    for byte in data:
+        acc = (acc + (acc << 5)) ^ byte.zero_extend_to(32)
+    return data, [acc]
+
+
+def _ite_tree(scale, r):
+    """A jump table: the target chosen by a symbolic index byte."""
+
+    index = bv.Symbol(8, 'index')
+    offset = index.zero_extend_to(32)
+    target = bv.Constant(32, 0)
+    for i in range(min(128 * scale, 256)):
+        target = bv.if_then_else(offset == i, bv.Constant(32, r.getrandbits(32)), target)
+    return [index], [target]
+
+
+def _solve_fork_chain(solver, symbols, exprs, r):
+    for condition in exprs:
+        taken, _ = solver.fork()
+        if taken.check(condition):
+            taken.add(condition)
+        solver = taken
+    solver.model()
+
+
+# the queries are kept to what FakeBackend can answer quickly: anything
+# over its exhaustive_bits has to be found by sampling, so they only pin
+# down a few bits of a wide value.
+
+def _solve_values(solver, symbols, exprs, r):
+    for expr in exprs:
+        solver.check(expr.extract(size=4) == r.getrandbits(4))
+        solver.check(expr != r.getrandbits(expr.size))
+    solver.model(exprs[-1] != 0)
+
+
+def _solve_ite_tree(solver, symbols, exprs, r):
+    index, = symbols
+    target, = exprs
+    for i in range(0, 128, 8):
+        solver.check(target == r.getrandbits(32))
+        solver.model(index == i)
+
+
+workloads = {
+    'fork_chain': (_fork_chain, _solve_fork_chain),
+    'memory': (_memory, _solve_values),
+    'accumulator': (_accumulator, _solve_values),
+    'ite_tree': (_ite_tree, _solve_ite_tree),
+}
+
+
+def _nodes(exprs):
+    seen = set()
+    output = []
+    stack = list(exprs)
+    while stack:
+        e = stack.pop()
+        if id(e) not in seen:
+            seen.add(id(e))
+            output.append(e)
+            stack.extend(e.children())
+    return output
+
+
+def _isolated():
+    """Give Solver fresh caches and a FakeBackend for a while, so no
+    run sees what another one cached.
+    """
+
+    return Solver.configured(fresh=True, store=None, backend=FakeBackend(), recorder=None)
+
+
+def _summary(times):
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'max': max(times),
+        'repeat': len(times),
+    }
+
+
+def _timed(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def _cache_counters(metrics):
+    counters = metrics.snapshot()['counters']
+    return dict((name, count) for name, count in sorted(counters.items())
+                if name.startswith(('hit.', 'miss.')) or name == 'queries')
+
+
+def run_workload(name, scale=1, repeat=5, seed=0):
+    """Time one workload, returning a dict of the median (and other)
+    times of each stage in seconds, the size of what it builds, and
+    the cache counters of the cold and warm solves.
+    """
+
+    build, solve = workloads[name]
+
+    def fresh():
+        return build(scale, random.Random(seed))
+
+    stages = dict((stage, []) for stage in ('construct', 'smt2', 'fingerprint', 'symbols',
+                                            'solve_cold', 'solve_warm'))
+    for _ in range(repeat):
+        stages['construct'].append(_timed(fresh))
+
+        symbols, exprs = fresh()
+        stages['smt2'].append(_timed(lambda: smt.utils.serialise(exprs)))
+
+        symbols, exprs = fresh()
+        nodes = _nodes(exprs)
+        stages['fingerprint'].append(_timed(lambda: [smt.utils._fingerprint(e) for e in nodes]))
+
+        symbols, exprs = fresh()
+        stages['symbols'].append(_timed(lambda: [e.symbols() for e in exprs]))
+
+        symbols, exprs = fresh()
+        cold, warm = Metrics(), Metrics()
+        with _isolated():
+            stages['solve_cold'].append(_timed(lambda: solve(
+                Solver(metrics=cold), symbols, exprs, random.Random(seed))))
+            stages['solve_warm'].append(_timed(lambda: solve(
+                Solver(metrics=warm), symbols, exprs, random.Random(seed))))
+
+    symbols, exprs = fresh()
+    definitions, terms = smt.utils.serialise(exprs)
+    return {
+        'times': dict((stage, _summary(times)) for stage, times in stages.items()),
+        'nodes': len(_nodes(exprs)),
+        'smt2_bytes': sum(len(line) for line in definitions + terms),
+        'cache': {'cold': _cache_counters(cold), 'warm': _cache_counters(warm)},
+    }
+
+
+def run(names=None, scale=1, repeat=5, seed=0, interning=False, simplify=False):
+    """Run the named workloads (all of them by default), returning the
+    results with enough about the run to compare it to others.
+    """
+
+    if names is None:
+        names = sorted(workloads)
+
+    smt.utils.set_interning(interning)
+    smt.simplify.set_simplify(simplify)
+    try:
+        results = dict((name, run_workload(name, scale, repeat, seed)) for name in names)
+    finally:
+        smt.utils.set_interning(False)
+        smt.simplify.set_simplify(False)
+
+    return {
+        'version': version,
+        'config': {
+            'scale': scale,
+            'repeat': repeat,
+            'seed': seed,
+            'interning': interning,
+            'simplify': simplify,
+        },
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'workloads': results,
+    }
+
+
+def compare(before, after):
+    """(workload, stage, before, after, ratio) for the median times of
+    each stage in both runs; a ratio below 1 is an improvement.
+    """
+
+    output = []
+    for name in sorted(set(before['workloads']) & set(after['workloads'])):
+        old = before['workloads'][name]['times']
+        new = after['workloads'][name]['times']
+        for stage in sorted(set(old) & set(new)):
+            a, b = old[stage]['median'], new[stage]['median']
+            output.append((name, stage, a, b, b / a if a else None))
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smt.benchmark', description=__doc__.split('\n\n')[1])
+    parser.add_argument('workloads', nargs='*',
+                        help='the workloads to run, of {0} (default all)'.format(', '.join(sorted(workloads))))
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interning', action='store_true')
+    parser.add_argument('--simplify', action='store_true')
+    parser.add_argument('--output', help='write the results here rather than to stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two sets of results instead of running')
+    args = parser.parse_args(argv)
+    for name in args.workloads:
+        if name not in workloads:
+            parser.error('unknown workload {0}'.format(name))
+
+    if args.compare:
+        results = []
+        for path in args.compare:
+            with open(path) as f:
+                results.append(json.load(f))
+        if results[0]['version'] != results[1]['version']:
+            sys.stderr.write('warning: the workloads differ between these runs\n')
+        for name, stage, a, b, ratio in compare(*results):
+            print('{0:<12} {1:<11} {2:>12.6f} {3:>12.6f} {4:>8}'.format(
+                name, stage, a, b, '-' if ratio is None else '{0:.3f}x'.format(ratio)))
+        return 0
+
+    results = run(args.workloads or None, args.scale, args.repeat, args.seed,
+                  args.interning, args.simplify)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,16 +25,17 @@ from smt.enums import *
 from smt.utils import *
 
 
-class Expression(object):
+class Expression(object, metaclass=ExpressionType):
     
-    __slots__ = ['size', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'smt2_cache', 'symbols_cache', 'fingerprint', '__weakref__']
     
     symbolic = True
     
     def __init__(self, size):
         self.size = size
         self.smt2_cache = None
-        self.hash_cache = None
+        self.symbols_cache = None
+        self.fingerprint = None
         
     def __str__(self):
         if self.symbolic:
@@ -44,161 +45,206 @@ class Expression(object):
             
     def smt2(self):
         if self.smt2_cache is None:
-            self.smt2_cache = self._smt2()
+            self.smt2_cache = render_expression(self)
         return self.smt2_cache
 
+    def symbols(self):
+        """The (frozen) set of symbols used in this expression, worked
+        out once and kept on every node.
+        """
+
+        if self.symbols_cache is None:
+            self.symbols_cache = expression_symbols(self)
+        return self.symbols_cache
+
+    def sort(self):
+        return '(_ BitVec {0})'.format(self.size)
+
     def __hash__(self):
-        if self.hash_cache is None:
-            self.hash_cache = string_hash(self.smt2())
-        return self.hash_cache
+        return self.fingerprint
 
-    def __lt__(self, other):
+    def identical(self, other):
+        """True if other is structurally the same expression; == can't
+        be used for this, since it builds a new expression.
+        """
+
+        return self is other or (type(self) is type(other) and self.fingerprint == other.fingerprint)
+
+    def children(self):
+        return ()
+
+    def evaluate(self, assignment):
+        """The concrete (unsigned) value of this expression when every
+        symbol takes the value given for its name in assignment. Values
+        can be ints, bools or Constants.
+        """
+
+        return evaluate_expression(self, assignment)
+
+    def evaluate_batch(self, assignment):
+        """Evaluate this expression over many inputs at once; assignment
+        maps each symbol (or its name) to an array of values, and the
+        result is a numpy array with one (unsigned) value per index.
+        Arrays hold uint64 for expressions of up to 64 bits, and python
+        ints beyond that.
+        """
+
+        return evaluate_expression_batch(self, assignment)
+
+    def _operand(self, other):
+        if isinstance(other, int):
+            return Constant(self.size, other)
+        return other
+
+    def _binary(self, op, other):
+        other = self._operand(other)
         if isinstance(self, Constant) and isinstance(other, Constant):
-            return bl.Constant(self.value < other.value)
-        elif isinstance(self, Constant) and isinstance(other, int):
-            return bl.Constant(self.value < other)
-        elif isinstance(other, int):
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedLessThan, Constant(self.size, other))
+            size = max(self.size, other.size)
+            return Constant(size, BinaryOperation.semantics[op](self.value, other.value, size))
         else:
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedLessThan, other)
+            return BinaryOperation(self, op, other)
 
-    def __le__(self, other):
+    def _reflected(self, op, other):
+        return Constant(self.size, other)._binary(op, self)
+
+    def _compare(self, op, other):
+        other = self._operand(other)
         if isinstance(self, Constant) and isinstance(other, Constant):
-            return bl.Constant(self.value <= other.value)
-        elif isinstance(self, Constant) and isinstance(other, int):
-            return bl.Constant(self.value <= other)
-        elif isinstance(other, int):
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedLessThanOrEqual, Constant(self.size, other))
+            size = max(self.size, other.size)
+            return bl.Constant(BooleanBinaryOperation.semantics[op](self.value, other.value, size))
         else:
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedLessThanOrEqual, other)
+            return BooleanBinaryOperation(self, op, other)
+
+    def __lt__(self, other):
+        return self._compare(BinaryOperator.UnsignedLessThan, other)
+
+    def __le__(self, other):
+        return self._compare(BinaryOperator.UnsignedLessThanOrEqual, other)
 
     def __eq__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return bl.Constant(self.value == other.value)
-        elif isinstance(self, Constant) and isinstance(other, int):
-            return bl.Constant(self.value == other)
-        elif isinstance(other, int):
-            return BooleanBinaryOperation(self, BinaryOperator.Equal, Constant(self.size, other))
-        else:
-            return BooleanBinaryOperation(self, BinaryOperator.Equal, other)
+        return self._compare(BinaryOperator.Equal, other)
 
     def __ne__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return bl.Constant(self.value != other.value)
-        elif isinstance(self, Constant) and isinstance(other, int):
-            return bl.Constant(self.value != other)
+        equal = self._compare(BinaryOperator.Equal, other)
+        if isinstance(equal, bl.Constant):
+            return bl.Constant(not equal.value)
         else:
-            equal = (self == other)
             return bl.UnaryOperation(UnaryOperator.Not, equal)
 
     def __gt__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return bl.Constant(self.value > other.value)
-        elif isinstance(self, Constant) and isinstance(other, int):
-            return bl.Constant(self.value > other)
-        elif isinstance(other, int):
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedGreaterThan, Constant(self.size, other))
-        else:
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedGreaterThan, other)
+        return self._compare(BinaryOperator.UnsignedGreaterThan, other)
 
     def __ge__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return bl.Constant(self.value >= other.value)
-        elif isinstance(self, Constant) and isinstance(other, int):
-            return bl.Constant(self.value >= other)
-        elif isinstance(other, int):
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedGreaterThanOrEqual, Constant(self.size, other))
-        else:
-            return BooleanBinaryOperation(self, BinaryOperator.UnsignedGreaterThanOrEqual, other)
+        return self._compare(BinaryOperator.UnsignedGreaterThanOrEqual, other)
+
+    def signed_less_than(self, other):
+        return self._compare(BinaryOperator.SignedLessThan, other)
+
+    def signed_less_than_or_equal(self, other):
+        return self._compare(BinaryOperator.SignedLessThanOrEqual, other)
+
+    def signed_greater_than(self, other):
+        return self._compare(BinaryOperator.SignedGreaterThan, other)
+
+    def signed_greater_than_or_equal(self, other):
+        return self._compare(BinaryOperator.SignedGreaterThanOrEqual, other)
 
     def __add__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value + other.value) 
-        else:
-            return BinaryOperation(self, BinaryOperator.Add, other)
+        return self._binary(BinaryOperator.Add, other)
+
+    def __radd__(self, other):
+        return self._reflected(BinaryOperator.Add, other)
 
     def __sub__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value - other.value) 
-        else:
-            return BinaryOperation(self, BinaryOperator.Subtract, other)
+        return self._binary(BinaryOperator.Subtract, other)
+
+    def __rsub__(self, other):
+        return self._reflected(BinaryOperator.Subtract, other)
 
     def __mul__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value * other.value) 
-        else:
-            return BinaryOperation(self, BinaryOperator.Multiply, other)
+        return self._binary(BinaryOperator.Multiply, other)
+
+    def __rmul__(self, other):
+        return self._reflected(BinaryOperator.Multiply, other)
 
     def __floordiv__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value // other.value)
-        else:
-            return BinaryOperation(self, BinaryOperator.UnsignedDivide, other)
+        return self._binary(BinaryOperator.UnsignedDivide, other)
+
+    def __rfloordiv__(self, other):
+        return self._reflected(BinaryOperator.UnsignedDivide, other)
 
     def __mod__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value % other.value) 
-        else:
-            return BinaryOperation(self, BinaryOperator.UnsignedRemainder, other)
+        return self._binary(BinaryOperator.UnsignedRemainder, other)
+
+    def __rmod__(self, other):
+        return self._reflected(BinaryOperator.UnsignedRemainder, other)
+
+    def signed_divide(self, other):
+        return self._binary(BinaryOperator.SignedDivide, other)
+
+    def signed_remainder(self, other):
+        return self._binary(BinaryOperator.SignedRemainder, other)
+
+    def signed_modulo(self, other):
+        return self._binary(BinaryOperator.SignedModulo, other)
 
     def __lshift__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value << other.value) 
-        else:
-            return BinaryOperation(self, BinaryOperator.ShiftLeft, other)
+        return self._binary(BinaryOperator.ShiftLeft, other)
+
+    def __rlshift__(self, other):
+        return self._reflected(BinaryOperator.ShiftLeft, other)
             
     def __rshift__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            # force value to be unsigned
-            value = self.value % carry_bit(self.size)
-            # now check the sign bit
-            if value & sign_bit(self.size):
-                value = -carry_bit(self.size) + value
+        return self._binary(BinaryOperator.ArithmeticShiftRight, other)
 
-            return Constant(max(self.size, other.size), value >> other.value)
-        else:
-            return BinaryOperation(self, BinaryOperator.ArithmeticShiftRight, other)
+    def __rrshift__(self, other):
+        return self._reflected(BinaryOperator.ArithmeticShiftRight, other)
+
+    def arithmetic_shift_right(self, other):
+        return self._binary(BinaryOperator.ArithmeticShiftRight, other)
+
+    def logical_shift_right(self, other):
+        return self._binary(BinaryOperator.LogicalShiftRight, other)
+
+    def rotate_left(self, other):
+        return self._binary(BinaryOperator.RotateLeft, other)
+
+    def rotate_right(self, other):
+        return self._binary(BinaryOperator.RotateRight, other)
 
     def __and__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value & other.value)
-        else:
-            return BinaryOperation(self, BinaryOperator.And, other)
+        return self._binary(BinaryOperator.And, other)
+
+    def __rand__(self, other):
+        return self._reflected(BinaryOperator.And, other)
 
     def __xor__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value ^ other.value)
-        else:
-            return BinaryOperation(self, BinaryOperator.Xor, other)
+        return self._binary(BinaryOperator.Xor, other)
+
+    def __rxor__(self, other):
+        return self._reflected(BinaryOperator.Xor, other)
 
     def __or__(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value | other.value)
-        else:
-            return BinaryOperation(self, BinaryOperator.Or, other)
+        return self._binary(BinaryOperator.Or, other)
+
+    def __ror__(self, other):
+        return self._reflected(BinaryOperator.Or, other)
     
     def __neg__(self):
         if isinstance(self, Constant):
-            return bl.Constant(-self.value) 
+            return Constant(self.size, -self.value)
         else:
             return UnaryOperation(UnaryOperator.Negate, self)
 
-    def logical_shift_right(self, other):
-        if isinstance(self, Constant) and isinstance(other, Constant):
-            return Constant(max(self.size, other.size), self.value >> other.value)
-        else:
-            return BinaryOperation(self, BinaryOperator.LogicalShiftRight, other)
-            
     def extract(self, size=None, start=None, end=None):
         assert size is not None or (start is not None and end is not None)
 
         if isinstance(self, Constant):
             if size is not None:
-                end = self.size
+                start = 0
             else:
                 size = end - start
-            value = self.value >> (self.size - end)
-            return Constant(size, value)
+            return Constant(size, self.value >> start)
 
         else:
             # simplify the case of extracting all of something
@@ -293,6 +339,156 @@ def if_then_else(predicate, if_case, else_case):
     else:
         return IfThenElse(predicate, if_case, else_case)
 
+def _udiv(a, b, size):
+    if b == 0:
+        return carry_bit(size) - 1
+    return a // b
+
+def _urem(a, b, size):
+    if b == 0:
+        return a
+    return a % b
+
+def _sdiv(a, b, size):
+    a = to_signed(a, size)
+    b = to_signed(b, size)
+    if b == 0:
+        return -1 if a >= 0 else 1
+    quotient = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        quotient = -quotient
+    return quotient
+
+def _srem(a, b, size):
+    a = to_signed(a, size)
+    b = to_signed(b, size)
+    if b == 0:
+        return a
+    remainder = abs(a) % abs(b)
+    if a < 0:
+        remainder = -remainder
+    return remainder
+
+def _smod(a, b, size):
+    a = to_signed(a, size)
+    b = to_signed(b, size)
+    if b == 0:
+        return a
+    # python's modulo already takes the sign of the divisor
+    return a % b
+
+def _shl(a, b, size):
+    if b >= size:
+        return 0
+    return a << b
+
+def _ashr(a, b, size):
+    return to_signed(a, size) >> min(b, size)
+
+def _rol(a, b, size):
+    b %= size
+    return (a << b) | (a >> (size - b))
+
+def _ror(a, b, size):
+    b %= size
+    return (a >> b) | (a << (size - b))
+
+def _np_cast(values, size):
+    """Convert an array of unsigned values to the representation used
+    for expressions of bit-size 'size', truncating as necessary.
+    """
+
+    if not isinstance(values, numpy.ndarray):
+        # left to itself numpy makes floats of ints too big for an
+        # int64, so lists are taken as python ints and reduced first
+        values = numpy.array(values, dtype=object)
+    if size <= 64:
+        if values.dtype == object:
+            values = (values % carry_bit(size)).astype(numpy.uint64)
+        else:
+            values = values.astype(numpy.uint64)
+        return _np_mask(values, size)
+    return values.astype(object) % carry_bit(size)
+
+def _np_mask(values, size):
+    if size < 64:
+        return values & numpy.uint64(carry_bit(size) - 1)
+    elif size == 64:
+        return values
+    return values % carry_bit(size)
+
+def _np_signed(values, size):
+    if size == 64:
+        return values.view(numpy.int64)
+    elif size < 64:
+        sign = sign_bit(size)
+        return (values.astype(numpy.int64) ^ sign) - sign
+    return numpy.frompyfunc(lambda value: to_signed(value, size), 1, 1)(values)
+
+def _np_unsigned(values, size):
+    if values.dtype == object or size > 64:
+        return _np_cast(values.astype(object) % carry_bit(size), size)
+    return _np_cast(values.astype(numpy.int64).view(numpy.uint64), size)
+
+def _np_wide_signed(values, size):
+    # signed division can overflow an int64, so do 64-bit ones in
+    # python ints.
+    values = _np_signed(values, size)
+    if size >= 64:
+        values = values.astype(object)
+    return values
+
+def _np_udiv(a, b, size):
+    zero = (b == 0)
+    return numpy.where(zero, carry_bit(size) - 1, a // numpy.where(zero, 1, b))
+
+def _np_urem(a, b, size):
+    zero = (b == 0)
+    return numpy.where(zero, a, a % numpy.where(zero, 1, b))
+
+def _np_sdiv(a, b, size):
+    a = _np_wide_signed(a, size)
+    b = _np_wide_signed(b, size)
+    zero = (b == 0)
+    quotient = abs(a) // abs(numpy.where(zero, 1, b))
+    quotient = numpy.where((a < 0) != (b < 0), -quotient, quotient)
+    quotient = numpy.where(zero, numpy.where(a >= 0, -1, 1), quotient)
+    return _np_unsigned(quotient, size)
+
+def _np_srem(a, b, size):
+    a = _np_wide_signed(a, size)
+    b = _np_wide_signed(b, size)
+    zero = (b == 0)
+    remainder = abs(a) % abs(numpy.where(zero, 1, b))
+    remainder = numpy.where(a < 0, -remainder, remainder)
+    return _np_unsigned(numpy.where(zero, a, remainder), size)
+
+def _np_smod(a, b, size):
+    a = _np_wide_signed(a, size)
+    b = _np_wide_signed(b, size)
+    zero = (b == 0)
+    return _np_unsigned(numpy.where(zero, a, a % numpy.where(zero, 1, b)), size)
+
+def _np_shl(a, b, size):
+    return numpy.where(b >= size, 0, a << numpy.minimum(b, size - 1))
+
+def _np_lshr(a, b, size):
+    return numpy.where(b >= size, 0, a >> numpy.minimum(b, size - 1))
+
+def _np_ashr(a, b, size):
+    amount = numpy.minimum(b, size - 1)
+    if size <= 64:
+        amount = amount.astype(numpy.int64)
+    return _np_unsigned(_np_signed(a, size) >> amount, size)
+
+def _np_rol(a, b, size):
+    b = b % size
+    return numpy.where(b == 0, a, (a << b) | (a >> (size - b)))
+
+def _np_ror(a, b, size):
+    b = b % size
+    return numpy.where(b == 0, a, (a >> b) | (a << (size - b)))
+
 def concatenate(elements):
     # first preprocess any contained concatenations
     final_elements = []
@@ -324,7 +520,7 @@ def concatenate(elements):
     
 class Constant(Expression):
     
-    __slots__ = ['size', 'value', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'value', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     symbolic = False
     
@@ -339,13 +535,21 @@ class Constant(Expression):
     def _smt2(self):
         return ('#x{0:0' + str(self.size // 4) + 'x}').format(self.value % carry_bit(self.size))
 
+    def _evaluate(self, assignment, values):
+        return self.value
+
+    def _evaluate_batch(self, assignment, values, count):
+        if self.size <= 64:
+            return numpy.full(count, self.value, dtype=numpy.uint64)
+        return numpy.full(count, self.value, dtype=object)
+
     def symbols(self):
-        return set()
+        return frozenset()
 
 
 class Symbol(Expression):
     
-    __slots__ = ['size', 'name', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'name', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, size, name):
         Expression.__init__(self, size)
@@ -353,50 +557,80 @@ class Symbol(Expression):
 
     def _smt2(self):
         return self.name
+
+    def _evaluate(self, assignment, values):
+        value = assignment[self.name]
+        if isinstance(value, (Constant, bl.Constant)):
+            value = value.value
+        return int(value) % carry_bit(self.size)
+
+    def _evaluate_batch(self, assignment, values, count):
+        return _np_cast(assignment[self.name], self.size)
     
     def symbols(self):
-        return set([self])
+        # not cached, which would make a reference cycle
+        return frozenset([self])
 
 
 class UnaryOperation(Expression):
     
-    __slots__ = ['size', 'op', 'value', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'op', 'value', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, op, value):
         Expression.__init__(self, value.size)
         self.op = op
         self.value = value
 
-    def _smt2(self):
+    def _format(self, values):
         if self.op != UnaryOperator.Negate:
             raise InvalidExpression(self)
-        return '(bvneg {0})'.format(self.value.smt2())
-    
-    def symbols(self):
-        return self.value.symbols()
+        return '(bvneg {0})'.format(values[0])
+
+    def children(self):
+        return (self.value,)
+
+    def _evaluate(self, assignment, values):
+        if self.op != UnaryOperator.Negate:
+            raise InvalidExpression(self)
+        return -values[0] % carry_bit(self.size)
+
+    def _evaluate_batch(self, assignment, values, count):
+        if self.op != UnaryOperator.Negate:
+            raise InvalidExpression(self)
+        return _np_mask(0 - values[0], self.size)
 
 
 class BooleanUnaryOperation(bl.Expression):
     
-    __slots__ = ['op', 'value', 'smt2_cache', 'hash_cache']
+    __slots__ = ['op', 'value', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, op, value):
         bl.Expression.__init__(self)
         self.op = op
         self.value = value
 
-    def _smt2(self):
+    def _format(self, values):
         if self.op != UnaryOperator.Not:
             raise InvalidExpression(self)
-        return '(bvnot {0})'.format(self.value.smt2())
-        
-    def symbols(self):
-        return self.value.symbols()
+        return '(bvnot {0})'.format(values[0])
+
+    def children(self):
+        return (self.value,)
+
+    def _evaluate(self, assignment, values):
+        if self.op != UnaryOperator.Not:
+            raise InvalidExpression(self)
+        return ~values[0] % carry_bit(self.value.size)
+
+    def _evaluate_batch(self, assignment, values, count):
+        if self.op != UnaryOperator.Not:
+            raise InvalidExpression(self)
+        return _np_mask(~values[0], self.value.size)
 
 
 class BinaryOperation(Expression):
     
-    __slots__ = ['size', 'lhs', 'op', 'rhs', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'lhs', 'op', 'rhs', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     operators = {
         BinaryOperator.And:'bvand',
@@ -416,8 +650,52 @@ class BinaryOperation(Expression):
         BinaryOperator.ShiftLeft:'bvshl',
         BinaryOperator.LogicalShiftRight:'bvlshr',
         BinaryOperator.ArithmeticShiftRight:'bvashr',
-        BinaryOperator.RotateLeft:'bvrol',
-        BinaryOperator.RotateRight:'bvror'
+        BinaryOperator.RotateLeft:'ext_rotate_left',
+        BinaryOperator.RotateRight:'ext_rotate_right'
+    }
+
+    semantics = {
+        BinaryOperator.And:lambda a, b, size: a & b,
+        BinaryOperator.Or:lambda a, b, size: a | b,
+        BinaryOperator.Nand:lambda a, b, size: ~(a & b),
+        BinaryOperator.Nor:lambda a, b, size: ~(a | b),
+        BinaryOperator.Xor:lambda a, b, size: a ^ b,
+        BinaryOperator.Xnor:lambda a, b, size: ~(a ^ b),
+        BinaryOperator.Add:lambda a, b, size: a + b,
+        BinaryOperator.Multiply:lambda a, b, size: a * b,
+        BinaryOperator.UnsignedDivide:_udiv,
+        BinaryOperator.UnsignedRemainder:_urem,
+        BinaryOperator.Subtract:lambda a, b, size: a - b,
+        BinaryOperator.SignedDivide:_sdiv,
+        BinaryOperator.SignedRemainder:_srem,
+        BinaryOperator.SignedModulo:_smod,
+        BinaryOperator.ShiftLeft:_shl,
+        BinaryOperator.LogicalShiftRight:lambda a, b, size: a >> b,
+        BinaryOperator.ArithmeticShiftRight:_ashr,
+        BinaryOperator.RotateLeft:_rol,
+        BinaryOperator.RotateRight:_ror
+    }
+
+    batch_semantics = {
+        BinaryOperator.And:lambda a, b, size: a & b,
+        BinaryOperator.Or:lambda a, b, size: a | b,
+        BinaryOperator.Nand:lambda a, b, size: ~(a & b),
+        BinaryOperator.Nor:lambda a, b, size: ~(a | b),
+        BinaryOperator.Xor:lambda a, b, size: a ^ b,
+        BinaryOperator.Xnor:lambda a, b, size: ~(a ^ b),
+        BinaryOperator.Add:lambda a, b, size: a + b,
+        BinaryOperator.Multiply:lambda a, b, size: a * b,
+        BinaryOperator.UnsignedDivide:_np_udiv,
+        BinaryOperator.UnsignedRemainder:_np_urem,
+        BinaryOperator.Subtract:lambda a, b, size: a - b,
+        BinaryOperator.SignedDivide:_np_sdiv,
+        BinaryOperator.SignedRemainder:_np_srem,
+        BinaryOperator.SignedModulo:_np_smod,
+        BinaryOperator.ShiftLeft:_np_shl,
+        BinaryOperator.LogicalShiftRight:_np_lshr,
+        BinaryOperator.ArithmeticShiftRight:_np_ashr,
+        BinaryOperator.RotateLeft:_np_rol,
+        BinaryOperator.RotateRight:_np_ror
     }
     
     def __init__(self, lhs, op, rhs):
@@ -427,15 +705,21 @@ class BinaryOperation(Expression):
         self.op = op
         self.rhs = rhs
         
-    def _smt2(self):
-        return '({0} {1} {2})'.format(self.operators[self.op], self.lhs.smt2(), self.rhs.smt2())
-        
-    def symbols(self):
-        return self.lhs.symbols().union(self.rhs.symbols())
+    def _format(self, values):
+        return '({0} {1} {2})'.format(self.operators[self.op], values[0], values[1])
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+    def _evaluate(self, assignment, values):
+        return self.semantics[self.op](values[0], values[1], self.size) % carry_bit(self.size)
+
+    def _evaluate_batch(self, assignment, values, count):
+        return _np_mask(self.batch_semantics[self.op](values[0], values[1], self.size), self.size)
 
 class BooleanBinaryOperation(bl.Expression):
     
-    __slots__ = ['lhs', 'op', 'rhs', 'smt2_cache', 'hash_cache']
+    __slots__ = ['lhs', 'op', 'rhs', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     operators = {
         BinaryOperator.UnsignedLessThan:'bvult',
@@ -449,6 +733,30 @@ class BooleanBinaryOperation(bl.Expression):
         BinaryOperator.SignedGreaterThanOrEqual:'bvsge',
     }
 
+    semantics = {
+        BinaryOperator.UnsignedLessThan:lambda a, b, size: a < b,
+        BinaryOperator.Equal:lambda a, b, size: a == b,
+        BinaryOperator.UnsignedLessThanOrEqual:lambda a, b, size: a <= b,
+        BinaryOperator.UnsignedGreaterThan:lambda a, b, size: a > b,
+        BinaryOperator.UnsignedGreaterThanOrEqual:lambda a, b, size: a >= b,
+        BinaryOperator.SignedLessThan:lambda a, b, size: to_signed(a, size) < to_signed(b, size),
+        BinaryOperator.SignedLessThanOrEqual:lambda a, b, size: to_signed(a, size) <= to_signed(b, size),
+        BinaryOperator.SignedGreaterThan:lambda a, b, size: to_signed(a, size) > to_signed(b, size),
+        BinaryOperator.SignedGreaterThanOrEqual:lambda a, b, size: to_signed(a, size) >= to_signed(b, size),
+    }
+
+    batch_semantics = {
+        BinaryOperator.UnsignedLessThan:lambda a, b, size: a < b,
+        BinaryOperator.Equal:lambda a, b, size: a == b,
+        BinaryOperator.UnsignedLessThanOrEqual:lambda a, b, size: a <= b,
+        BinaryOperator.UnsignedGreaterThan:lambda a, b, size: a > b,
+        BinaryOperator.UnsignedGreaterThanOrEqual:lambda a, b, size: a >= b,
+        BinaryOperator.SignedLessThan:lambda a, b, size: _np_signed(a, size) < _np_signed(b, size),
+        BinaryOperator.SignedLessThanOrEqual:lambda a, b, size: _np_signed(a, size) <= _np_signed(b, size),
+        BinaryOperator.SignedGreaterThan:lambda a, b, size: _np_signed(a, size) > _np_signed(b, size),
+        BinaryOperator.SignedGreaterThanOrEqual:lambda a, b, size: _np_signed(a, size) >= _np_signed(b, size),
+    }
+
     def __init__(self, lhs, op, rhs):
         assert lhs.size == rhs.size
         bl.Expression.__init__(self)
@@ -456,16 +764,22 @@ class BooleanBinaryOperation(bl.Expression):
         self.op = op
         self.rhs = rhs
         
-    def _smt2(self):
-        return '({0} {1} {2})'.format(self.operators[self.op], self.lhs.smt2(), self.rhs.smt2())
-    
-    def symbols(self):
-        return self.lhs.symbols().union(self.rhs.symbols())
+    def _format(self, values):
+        return '({0} {1} {2})'.format(self.operators[self.op], values[0], values[1])
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+    def _evaluate(self, assignment, values):
+        return self.semantics[self.op](values[0], values[1], self.lhs.size)
+
+    def _evaluate_batch(self, assignment, values, count):
+        return numpy.asarray(self.batch_semantics[self.op](values[0], values[1], self.lhs.size), dtype=bool)
 
 
 class Concatenation(Expression):
     
-    __slots__ = ['size', 'elements', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'elements', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, elements):
         size = 0
@@ -475,39 +789,61 @@ class Concatenation(Expression):
             self.elements.append(element)
         Expression.__init__(self, size)
         
-    def _smt2(self):
+    def _format(self, values):
         output = '(concat '
-        for element in self.elements:
-            output += ' ' + element.smt2()
+        for value in values:
+            output += ' ' + value
         output += ')'
         return output
-        
-    def symbols(self):
-        output = set()
-        for element in self.elements:
-            output = output.union(element.symbols())
+
+    def children(self):
+        return tuple(self.elements)
+
+    def _evaluate(self, assignment, values):
+        output = 0
+        for element, value in zip(self.elements, values):
+            output = (output << element.size) | value
+        return output
+
+    def _evaluate_batch(self, assignment, values, count):
+        output = _np_cast(values[0], self.size)
+        for element, value in zip(self.elements[1:], values[1:]):
+            output = (output << element.size) | _np_cast(value, self.size)
         return output
 
 
 class Repetition(Expression):
     
-    __slots__ = ['size', 'value', 'count', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'value', 'count', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, value, count):
         Expression.__init__(self, value.size * count)
         self.value = value
         self.count = count
         
-    def _smt2(self):
-        return '((_ repeat {0}) {1})'.format(self.count, self.value.smt2())
-    
-    def symbols(self):
-        return self.value.symbols()
+    def _format(self, values):
+        return '((_ repeat {0}) {1})'.format(self.count, values[0])
+
+    def children(self):
+        return (self.value,)
+
+    def _evaluate(self, assignment, values):
+        output = 0
+        for i in range(self.count):
+            output = (output << self.value.size) | values[0]
+        return output
+
+    def _evaluate_batch(self, assignment, values, count):
+        value = _np_cast(values[0], self.size)
+        output = value
+        for i in range(1, self.count):
+            output = (output << self.value.size) | value
+        return output
 
 
 class Extraction(Expression):
     
-    __slots__ = ['size', 'value', 'start', 'end', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'value', 'start', 'end', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, value, start=None, end=None, size=None):
         assert size is not None or (start is not None and end is not None)
@@ -520,16 +856,22 @@ class Extraction(Expression):
             self.end = end
         Expression.__init__(self, self.end - self.start)
 
-    def _smt2(self):
-        return '((_ extract {0} {1}) {2})'.format(self.end - 1, self.start, self.value.smt2())
+    def _format(self, values):
+        return '((_ extract {0} {1}) {2})'.format(self.end - 1, self.start, values[0])
 
-    def symbols(self):
-        return self.value.symbols()
+    def children(self):
+        return (self.value,)
+
+    def _evaluate(self, assignment, values):
+        return (values[0] >> self.start) % carry_bit(self.size)
+
+    def _evaluate_batch(self, assignment, values, count):
+        return _np_cast(_np_mask(values[0] >> self.start, self.size), self.size)
 
 
 class Extension(Expression):
     
-    __slots__ = ['size', 'value', 'kind', 'extension_size', 'smt2_cache', 'hash_cache']
+    __slots__ = ['size', 'value', 'kind', 'extension_size', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     kinds = {
         ExtensionKind.Zero:'zero_extend',
@@ -552,16 +894,26 @@ class Extension(Expression):
             assert self.extension_size > 0
             Expression.__init__(self, value.size + extension_size)
         
-    def _smt2(self):
-        return '((_ {0} {1}) {2})'.format(self.kinds[self.kind], self.extension_size, self.value.smt2())
+    def _format(self, values):
+        return '((_ {0} {1}) {2})'.format(self.kinds[self.kind], self.extension_size, values[0])
 
-    def symbols(self):
-        return self.value.symbols()
+    def children(self):
+        return (self.value,)
+
+    def _evaluate(self, assignment, values):
+        if self.kind == ExtensionKind.Sign:
+            return to_signed(values[0], self.value.size) % carry_bit(self.size)
+        return values[0]
+
+    def _evaluate_batch(self, assignment, values, count):
+        if self.kind == ExtensionKind.Sign:
+            return _np_unsigned(_np_signed(values[0], self.value.size), self.size)
+        return _np_cast(values[0], self.size)
 
 
 class IfThenElse(Expression):
     
-    __slots__ = ['predicate', 'if_case', 'else_case', 'smt2_cache', 'hash_cache']
+    __slots__ = ['predicate', 'if_case', 'else_case', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, predicate, if_case, else_case):
         assert if_case.size == else_case.size
@@ -570,8 +922,16 @@ class IfThenElse(Expression):
         self.if_case = if_case
         self.else_case = else_case
     
-    def _smt2(self):
-        return '(ite {0} {1} {2})'.format(self.predicate.smt2(), self.if_case.smt2(), self.else_case.smt2())
-        
-    def symbols(self):
-        return self.predicate.symbols().union(self.if_case.symbols()).union(self.else_case.symbols())
+    def _format(self, values):
+        return '(ite {0} {1} {2})'.format(values[0], values[1], values[2])
+
+    def children(self):
+        return (self.predicate, self.if_case, self.else_case)
+
+    def _evaluate(self, assignment, values):
+        if values[0]:
+            return values[1]
+        return values[2]
+
+    def _evaluate_batch(self, assignment, values, count):
+        return numpy.where(values[0], values[1], values[2])
@@ -24,26 +24,62 @@ from smt.enums import *
 from smt.utils import *
 
 
-class Expression(object):
+class Expression(object, metaclass=ExpressionType):
     
-    __slots__ = ['smt2_cache', 'hash_cache']
+    __slots__ = ['smt2_cache', 'symbols_cache', 'fingerprint', '__weakref__']
     
     symbolic = True
     
     def __init__(self):
         self.smt2_cache = None
-        self.hash_cache = None
+        self.symbols_cache = None
+        self.fingerprint = None
 
     def __hash__(self):
-        if self.hash_cache is None:
-            self.hash_cache = string_hash(self.smt2())
-        return self.hash_cache
+        return self.fingerprint
+
+    def identical(self, other):
+        """True if other is structurally the same expression; == can't
+        be used for this, since it builds a new expression.
+        """
+
+        return self is other or (type(self) is type(other) and self.fingerprint == other.fingerprint)
 
     def smt2(self):
         if self.smt2_cache is None:
-            self.smt2_cache = self._smt2()
+            self.smt2_cache = render_expression(self)
         return self.smt2_cache
 
+    def symbols(self):
+        """The (frozen) set of symbols used in this expression, worked
+        out once and kept on every node.
+        """
+
+        if self.symbols_cache is None:
+            self.symbols_cache = expression_symbols(self)
+        return self.symbols_cache
+
+    def sort(self):
+        return 'Bool'
+
+    def children(self):
+        return ()
+
+    def evaluate(self, assignment):
+        """The concrete truth value of this expression when every symbol
+        takes the value given for its name in assignment.
+        """
+
+        return evaluate_expression(self, assignment)
+
+    def evaluate_batch(self, assignment):
+        """Evaluate this expression over many inputs at once; assignment
+        maps each symbol (or its name) to an array of values, and the
+        result is a numpy array of bools.
+        """
+
+        return evaluate_expression_batch(self, assignment)
+
     def __eq__(self, other):
         if isinstance(self, Constant) and isinstance(other, Constant):
             return Constant(self.value == other.value)
@@ -84,7 +120,7 @@ class Expression(object):
 
 class Constant(Expression):
     
-    __slots__ = ['value', 'smt2_cache', 'hash_cache']
+    __slots__ = ['value', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     symbolic = False
     
@@ -98,13 +134,19 @@ class Constant(Expression):
         else:
             return 'false'
 
+    def _evaluate(self, assignment, values):
+        return bool(self.value)
+
+    def _evaluate_batch(self, assignment, values, count):
+        return numpy.full(count, bool(self.value))
+
     def symbols(self):
-        return set()
+        return frozenset()
 
 
 class Symbol(Expression):
     
-    __slots__ = ['name', 'smt2_cache', 'hash_cache']
+    __slots__ = ['name', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, name):
         Expression.__init__(self)
@@ -112,32 +154,52 @@ class Symbol(Expression):
 
     def _smt2(self):
         return self.name
+
+    def _evaluate(self, assignment, values):
+        value = assignment[self.name]
+        if isinstance(value, Constant):
+            value = value.value
+        return bool(value)
+
+    def _evaluate_batch(self, assignment, values, count):
+        return numpy.asarray(assignment[self.name], dtype=bool)
     
     def symbols(self):
-        return set([self])
+        # not cached, which would make a reference cycle
+        return frozenset([self])
 
 
 class UnaryOperation(Expression):
     
-    __slots__ = ['op', 'value', 'smt2_cache', 'hash_cache']
+    __slots__ = ['op', 'value', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, op, value):
         Expression.__init__(self)
         self.op = op
         self.value = value
 
-    def _smt2(self):
+    def _format(self, values):
         if self.op != UnaryOperator.Not:
             raise InvalidExpression(self)
-        return '(not {0})'.format(self.value.smt2())
-    
-    def symbols(self):
-        return self.value.symbols()
+        return '(not {0})'.format(values[0])
+
+    def children(self):
+        return (self.value,)
+
+    def _evaluate(self, assignment, values):
+        if self.op != UnaryOperator.Not:
+            raise InvalidExpression(self)
+        return not values[0]
+
+    def _evaluate_batch(self, assignment, values, count):
+        if self.op != UnaryOperator.Not:
+            raise InvalidExpression(self)
+        return numpy.logical_not(values[0])
 
 
 class BinaryOperation(Expression):
     
-    __slots__ = ['lhs', 'op', 'rhs', 'smt2_cache', 'hash_cache']
+    __slots__ = ['lhs', 'op', 'rhs', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     operators = {
         BinaryOperator.And:'and',
@@ -146,6 +208,22 @@ class BinaryOperation(Expression):
         BinaryOperator.Implies:'=>',
         BinaryOperator.Equal:'=',
     }
+
+    semantics = {
+        BinaryOperator.And:lambda a, b: a and b,
+        BinaryOperator.Or:lambda a, b: a or b,
+        BinaryOperator.Xor:lambda a, b: a != b,
+        BinaryOperator.Implies:lambda a, b: (not a) or b,
+        BinaryOperator.Equal:lambda a, b: a == b,
+    }
+
+    batch_semantics = {
+        BinaryOperator.And:lambda a, b: numpy.logical_and(a, b),
+        BinaryOperator.Or:lambda a, b: numpy.logical_or(a, b),
+        BinaryOperator.Xor:lambda a, b: numpy.logical_xor(a, b),
+        BinaryOperator.Implies:lambda a, b: numpy.logical_or(numpy.logical_not(a), b),
+        BinaryOperator.Equal:lambda a, b: numpy.equal(a, b),
+    }
     
     def __init__(self, lhs, op, rhs):
         Expression.__init__(self)
@@ -153,16 +231,22 @@ class BinaryOperation(Expression):
         self.op = op
         self.rhs = rhs
         
-    def _smt2(self):
-        return '({0} {1} {2})'.format(self.operators[self.op], self.lhs.smt2(), self.rhs.smt2())
-        
-    def symbols(self):
-        return self.lhs.symbols().union(self.rhs.symbols())
+    def _format(self, values):
+        return '({0} {1} {2})'.format(self.operators[self.op], values[0], values[1])
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+    def _evaluate(self, assignment, values):
+        return self.semantics[self.op](values[0], values[1])
+
+    def _evaluate_batch(self, assignment, values, count):
+        return self.batch_semantics[self.op](values[0], values[1])
 
 
 class IfThenElse(Expression):
     
-    __slots__ = ['predicate', 'if_case', 'else_case', 'smt2_cache', 'hash_cache']
+    __slots__ = ['predicate', 'if_case', 'else_case', 'smt2_cache', 'symbols_cache', 'fingerprint']
     
     def __init__(self, predicate, if_case, else_case):
         Expression.__init__(self)
@@ -170,8 +254,16 @@ class IfThenElse(Expression):
         self.if_case = if_case
         self.else_case = else_case
     
-    def _smt2(self):
-        return '(ite {0} {1} {2})'.format(self.predicate.smt2(), self.if_case.smt2(), self.else_case.smt2())
-        
-    def symbols(self):
-        return self.predicate.symbols().union(self.if_case.symbols()).union(self.else_case.symbols())
+    def _format(self, values):
+        return '(ite {0} {1} {2})'.format(values[0], values[1], values[2])
+
+    def children(self):
+        return (self.predicate, self.if_case, self.else_case)
+
+    def _evaluate(self, assignment, values):
+        if values[0]:
+            return values[1]
+        return values[2]
+
+    def _evaluate_batch(self, assignment, values, count):
+        return numpy.where(values[0], values[1], values[2])
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.cache
+
+Bounded caches used by the solver. Each one has an optional limit on
+the number of entries and on their (approximate) size in bytes, evicts
+either the least recently or least frequently used entry when over
+budget, and counts its hits, misses and evictions.
+
+WeakCache is keyed on expression identity and holds its keys weakly,
+so that caching something about an expression doesn't keep it alive.
+"""
+
+import collections
+import sys
+import threading
+import weakref
+
+
+LRU = 'lru'
+LFU = 'lfu'
+
+
+def approximate_size(value):
+    """Roughly how many bytes value keeps alive, looking inside the
+    containers the solver caches (models and symbol sets) but not
+    following references out of expressions.
+    """
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+    elif isinstance(value, (set, frozenset, list, tuple)):
+        for v in value:
+            size += sys.getsizeof(v)
+    return size
+
+
+class Cache(object):
+
+    def __init__(self, max_entries=None, max_bytes=None, policy=LRU, sizeof=approximate_size):
+        assert policy in (LRU, LFU)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sizeof = sizeof
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._values = dict()
+        self._sizes = dict()
+        self._bytes = 0
+        # LRU: a single ordered dict, oldest first. LFU: one ordered
+        # dict per use count, and the smallest count in use.
+        self._order = collections.OrderedDict()
+        self._counts = dict()
+        self._buckets = dict()
+        self._min_count = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._values),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._values))
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._values:
+                return True
+            self.misses += 1
+            return False
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value = self._values[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            self._touch(key)
+            return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._values:
+                self._remove(key)
+            size = 0
+            if self.max_bytes is not None:
+                size = self.sizeof(value)
+            self._values[key] = value
+            self._sizes[key] = size
+            self._bytes += size
+            self._insert(key)
+            self.trim()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._values:
+                raise KeyError(key)
+            self._remove(key)
+
+    def trim(self):
+        """Evict entries until the cache is within its budgets."""
+
+        with self._lock:
+            while self._values and self._over_budget():
+                self._remove(self._victim())
+                self.evictions += 1
+
+    def _over_budget(self):
+        if self.max_entries is not None and len(self._values) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        return False
+
+    def _insert(self, key):
+        if self.policy == LRU:
+            self._order[key] = None
+        else:
+            self._counts[key] = 1
+            self._buckets.setdefault(1, collections.OrderedDict())[key] = None
+            self._min_count = 1
+
+    def _touch(self, key):
+        if self.policy == LRU:
+            self._order.move_to_end(key)
+        else:
+            count = self._counts[key]
+            bucket = self._buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[count]
+                if self._min_count == count:
+                    self._min_count = count + 1
+            self._counts[key] = count + 1
+            self._buckets.setdefault(count + 1, collections.OrderedDict())[key] = None
+
+    def _victim(self):
+        if self.policy == LRU:
+            return next(iter(self._order))
+        if self._min_count not in self._buckets:
+            self._min_count = min(self._buckets)
+        return next(iter(self._buckets[self._min_count]))
+
+    def _remove(self, key):
+        del self._values[key]
+        self._bytes -= self._sizes.pop(key)
+        if self.policy == LRU:
+            del self._order[key]
+        else:
+            count = self._counts.pop(key)
+            bucket = self._buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[count]
+
+
+class WeakCache(Cache):
+    """A Cache keyed on the identity of its keys, which are only
+    weakly referenced; an entry disappears along with its key.
+    """
+
+    def _clear(self):
+        Cache._clear(self)
+        self._refs = dict()
+
+    def _expire(self, key):
+        with self._lock:
+            self._refs.pop(key, None)
+            if key in self._values:
+                Cache._remove(self, key)
+
+    def __contains__(self, key):
+        return Cache.__contains__(self, id(key))
+
+    def __getitem__(self, key):
+        return Cache.__getitem__(self, id(key))
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            identity = id(key)
+            if identity not in self._refs:
+                expire = weakref.WeakMethod(self._expire)
+                self._refs[identity] = weakref.ref(key, lambda ref: expire() and expire()(identity))
+            Cache.__setitem__(self, identity, value)
+
+    def __delitem__(self, key):
+        Cache.__delitem__(self, id(key))
+
+    def __iter__(self):
+        with self._lock:
+            keys = [self._refs[identity]() for identity in self._values]
+        return iter([key for key in keys if key is not None])
+
+    def _remove(self, key):
+        Cache._remove(self, key)
+        self._refs.pop(key, None)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.counterexample
+
+A cache of solver results keyed on sets of constraints rather than on
+the exact query text. If any subset of a query is known to be
+unsatisfiable then so is the query, and a model for any superset is a
+model for the query. Models for subsets are also worth a try, since
+they often satisfy the extra constraints as well.
+
+Subsets are found with an unlimited branching tree (as in KLEE), and
+supersets by intersecting the sets holding each key of the query,
+rarest key first, so neither means looking at every entry in the
+cache. At most max_entries sets are kept, dropping the oldest first,
+and each search gives up after looking at max_visits nodes or sets, so
+a miss costs no more than that however large the cache grows. Giving
+up early only means asking the solver.
+"""
+
+import collections
+import threading
+from collections.abc import Mapping
+
+import smt.bitvector as bv
+import smt.boolean as bl
+from smt.utils import *
+
+
+def complete(model, exprs):
+    """A copy of model with a value for every symbol used in exprs,
+    filling in those it doesn't mention the same way the solver does.
+    """
+
+    output = dict()
+    for e in exprs:
+        for symbol in e.symbols():
+            if symbol.name in output:
+                continue
+            if symbol.name in model:
+                output[symbol.name] = model[symbol.name]
+            elif isinstance(symbol, bv.Expression):
+                output[symbol.name] = bv.Constant(symbol.size, 0x2323232323232323)
+            else:
+                output[symbol.name] = bl.Constant(True)
+    return output
+
+
+def satisfies(model, exprs):
+    for e in exprs:
+        try:
+            if not e.evaluate(model):
+                return False
+        except (KeyError, InvalidExpression):
+            return False
+    return True
+
+
+class _Node(object):
+
+    __slots__ = ['children', 'value']
+
+    def __init__(self):
+        self.children = dict()
+        self.value = None
+
+
+class CounterexampleCache(object):
+    """Safe to use from any thread."""
+
+    # how many models for subsets of a query to evaluate before giving
+    # up and asking the solver.
+    max_candidates = 16
+
+    def __init__(self, max_entries=1 << 18, max_visits=4096):
+        self.max_entries = max_entries
+        self.max_visits = max_visits
+        self._lock = threading.RLock()
+        self._root = _Node()
+        # set -> value, oldest first
+        self._entries = collections.OrderedDict()
+        # key -> the sets containing it
+        self._containing = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._root = _Node()
+            self._entries = collections.OrderedDict()
+            self._containing = dict()
+
+    def insert(self, keys, value):
+        """Record value for the set of sorted keys; value is False for an
+        unsatisfiable set, or a model (or just True) for a satisfiable
+        one.
+        """
+
+        keys = tuple(keys)
+        with self._lock:
+            node = self._root
+            for key in keys:
+                child = node.children.get(key)
+                if child is None:
+                    child = node.children[key] = _Node()
+                node = child
+
+            if node.value is None:
+                for key in keys:
+                    self._containing.setdefault(key, set()).add(keys)
+            elif value is True:
+                # don't throw away a model we already know
+                return
+            node.value = value
+            self._entries[keys] = value
+
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._remove(self._entries.popitem(last=False)[0])
+
+    def _remove(self, keys):
+        for key in keys:
+            containing = self._containing[key]
+            containing.discard(keys)
+            if not containing:
+                del self._containing[key]
+
+        path = [self._root]
+        for key in keys:
+            path.append(path[-1].children[key])
+        path[-1].value = None
+
+        # prune the nodes left with nothing under them
+        for i in range(len(keys), 0, -1):
+            node = path[i]
+            if node.value is not None or node.children:
+                break
+            del path[i - 1].children[keys[i - 1]]
+
+    def subsets(self, keys):
+        """The values stored for subsets of keys, as many as are found
+        in max_visits nodes.
+        """
+
+        output = []
+        with self._lock:
+            visits = 0
+            stack = [(self._root, 0)]
+            while stack and visits < self.max_visits:
+                node, index = stack.pop()
+                visits += 1
+                if node.value is not None:
+                    output.append(node.value)
+                for i in range(index, len(keys)):
+                    child = node.children.get(keys[i])
+                    if child is not None:
+                        stack.append((child, i + 1))
+        return output
+
+    def supersets(self, keys):
+        """The values stored for supersets of keys, as many as are found
+        in max_visits nodes.
+        """
+
+        output = []
+        with self._lock:
+            containing = []
+            if not keys:
+                candidates = self._entries
+            else:
+                containing = [self._containing.get(key, ()) for key in keys]
+                candidates = min(containing, key=len)
+                containing = [other for other in containing if other is not candidates]
+
+            for i, other in enumerate(candidates):
+                if i == self.max_visits:
+                    break
+                if all(other in c for c in containing):
+                    output.append(self._entries[other])
+        return output
+
+    def lookup(self, keys, exprs, model=False):
+        """Try to answer a query for the conjunction of exprs, whose
+        sorted keys are keys, from the cache. Returns False if it is
+        known to be unsatisfiable, a model (or True, if model is False)
+        if it is known to be satisfiable, and None if the solver has to
+        be asked.
+        """
+
+        candidates = []
+        for value in self.subsets(keys):
+            if value is False:
+                return False
+            elif isinstance(value, Mapping) and len(candidates) < self.max_candidates:
+                candidates.append(value)
+
+        for value in self.supersets(keys):
+            if value is True and not model:
+                return True
+            elif isinstance(value, Mapping):
+                if model:
+                    return complete(value, exprs)
+                return True
+
+        for value in candidates:
+            candidate = complete(value, exprs)
+            if satisfies(candidate, exprs):
+                self.insert(keys, candidate)
+                if model:
+                    return candidate
+                return True
+
+        return None
@@ -0,0 +1,879 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.domain
+
+A cheap abstract interpretation of expressions, for the checks that
+don't need a solver. Every bitvector node gets a Value: the bits known
+to be zero or one, and an unsigned and a signed interval, each kept as
+tight as the others allow. Every boolean node is True, False or None
+for not known.
+
+narrow() turns roots into Facts, the Values (and truths) they force on
+the nodes they compare, and truth() evaluates an expression under them.
+Both are sound but incomplete, so None only means nothing was found.
+"""
+
+import smt.bitvector as bv
+import smt.boolean as bl
+from smt.enums import *
+from smt.utils import *
+
+
+# the most nodes looked at for one expression; past that it is taken
+# as not known, which keeps this cheap next to asking a solver.
+max_nodes = 4096
+
+# how many times narrow() goes over the roots while they are still
+# telling it something new
+passes = 3
+
+# Facts are chained onto the ones they grew from, and copied into one
+# flat mapping every this many links so lookups stay short.
+snapshot_interval = 32
+
+
+class _Empty(Exception):
+    """No value is possible: the constraints contradict each other."""
+
+
+class _TooBig(Exception):
+    pass
+
+
+class Value(object):
+    """What is known about a bitvector of size bits: zeros and ones are
+    masks of the bits known to be 0 and 1, and it lies in [low, high]
+    unsigned and [slow, shigh] signed. Raises _Empty if nothing fits.
+    """
+
+    __slots__ = ['size', 'zeros', 'ones', 'low', 'high', 'slow', 'shigh']
+
+    def __init__(self, size, zeros=0, ones=0, low=0, high=None, slow=None, shigh=None):
+        full = carry_bit(size) - 1
+        half = sign_bit(size)
+        self.size = size
+        self.zeros = zeros & full
+        self.ones = ones & full
+        self.low = max(low, 0)
+        self.high = full if high is None else min(high, full)
+        self.slow = -half if slow is None else max(slow, -half)
+        self.shigh = half - 1 if shigh is None else min(shigh, half - 1)
+        self._reduce()
+
+    def __repr__(self):
+        return '<Value {0} zeros={1:#x} ones={2:#x} [{3:#x}, {4:#x}] s[{5}, {6}]>'.format(
+            self.size, self.zeros, self.ones, self.low, self.high, self.slow, self.shigh)
+
+    def _reduce(self):
+        # each view tightens the other two; a couple of rounds is
+        # nearly always enough.
+        carry = carry_bit(self.size)
+        full = carry - 1
+        half = sign_bit(self.size)
+        for _ in range(4):
+            before = (self.zeros, self.ones, self.low, self.high, self.slow, self.shigh)
+            if self.zeros & self.ones:
+                raise _Empty()
+
+            # bits -> intervals
+            most = full & ~self.zeros
+            self.low = max(self.low, self.ones)
+            self.high = min(self.high, most)
+            if self.ones & half:
+                slow, shigh = self.ones - carry, most - carry
+            elif self.zeros & half:
+                slow, shigh = self.ones, most
+            else:
+                slow, shigh = (self.ones | half) - carry, most & ~half
+            self.slow = max(self.slow, slow)
+            self.shigh = min(self.shigh, shigh)
+
+            # unsigned <-> signed, where neither crosses the sign change
+            if self.high < half:
+                self.slow = max(self.slow, self.low)
+                self.shigh = min(self.shigh, self.high)
+            elif self.low >= half:
+                self.slow = max(self.slow, self.low - carry)
+                self.shigh = min(self.shigh, self.high - carry)
+            if self.slow >= 0:
+                self.low = max(self.low, self.slow)
+                self.high = min(self.high, self.shigh)
+            elif self.shigh < 0:
+                self.low = max(self.low, self.slow + carry)
+                self.high = min(self.high, self.shigh + carry)
+            if self.low > self.high or self.slow > self.shigh:
+                raise _Empty()
+
+            # interval -> bits: everything above the highest bit that
+            # differs between the ends is the same all the way between
+            prefix = full & ~((1 << (self.low ^ self.high).bit_length()) - 1)
+            self.ones |= self.low & prefix
+            self.zeros |= ~self.low & prefix
+
+            if before == (self.zeros, self.ones, self.low, self.high, self.slow, self.shigh):
+                break
+
+        if self.zeros & self.ones:
+            raise _Empty()
+
+    def exact(self):
+        """The value if only one is possible, otherwise None."""
+
+        if self.low == self.high:
+            return self.low
+        return None
+
+    def same(self, other):
+        return (self.zeros == other.zeros and self.ones == other.ones and
+                self.low == other.low and self.high == other.high and
+                self.slow == other.slow and self.shigh == other.shigh)
+
+    def meet(self, other):
+        """What is known when both self and other hold."""
+
+        return Value(self.size, self.zeros | other.zeros, self.ones | other.ones,
+                     max(self.low, other.low), min(self.high, other.high),
+                     max(self.slow, other.slow), min(self.shigh, other.shigh))
+
+    def join(self, other):
+        """What is known when either self or other holds."""
+
+        return Value(self.size, self.zeros & other.zeros, self.ones & other.ones,
+                     min(self.low, other.low), max(self.high, other.high),
+                     min(self.slow, other.slow), max(self.shigh, other.shigh))
+
+
+def constant(size, value):
+    value %= carry_bit(size)
+    return Value(size, ~value, value, value, value)
+
+
+class Facts(object):
+    """What some roots force on the nodes below them, by fingerprint: a
+    Value for bitvectors and a bool for booleans. contradiction is set
+    if the roots can't all be true. New facts are chained onto parent,
+    which is flattened into them every snapshot_interval links unless
+    snapshot is False (for facts that won't be kept).
+    """
+
+    __slots__ = ['parent', 'local', 'depth', 'contradiction']
+
+    def __init__(self, parent=None, snapshot=True):
+        self.parent = None
+        self.local = dict()
+        self.depth = 0
+        self.contradiction = False
+        if parent is not None:
+            self.contradiction = parent.contradiction
+            if snapshot and parent.depth >= snapshot_interval:
+                self.local = parent.flatten()
+            else:
+                self.parent = parent
+                self.depth = parent.depth + 1
+
+    def get(self, key):
+        facts = self
+        while facts is not None:
+            value = facts.local.get(key)
+            if value is not None:
+                return value
+            facts = facts.parent
+        return None
+
+    def set(self, key, value):
+        self.local[key] = value
+
+    def flatten(self):
+        chain = []
+        facts = self
+        while facts is not None:
+            chain.append(facts.local)
+            facts = facts.parent
+
+        output = dict()
+        for local in reversed(chain):
+            output.update(local)
+        return output
+
+
+# forward transfer functions, by class: function(e, child values)
+_forward = dict()
+
+# for bitvector BinaryOperations, by operator: function(a, b, size)
+_binary = dict()
+
+# for comparisons, by operator: function(a, b) -> True, False or None
+_compare = dict()
+
+
+def _register(table, *keys):
+    def register(function):
+        for key in keys:
+            table[key] = function
+        return function
+    return register
+
+
+def _wrapped(low, high, minimum, span):
+    """[low, high] taken modulo span into [minimum, minimum + span), or
+    the whole of that if it wraps around.
+    """
+
+    shift = (low - minimum) // span * span
+    if high - shift < minimum + span:
+        return low - shift, high - shift
+    return minimum, minimum + span - 1
+
+
+def _trailing(value):
+    """How many of the lowest bits are known to be zero."""
+
+    return ((value.zeros + 1) & ~value.zeros).bit_length() - 1
+
+
+def _not(a):
+    full = carry_bit(a.size) - 1
+    return Value(a.size, a.ones, a.zeros, full - a.high, full - a.low, -a.shigh - 1, -a.slow - 1)
+
+
+# bitvector operations
+
+@_register(_forward, bv.Constant)
+def _constant(e, values):
+    return constant(e.size, e.value)
+
+
+@_register(_forward, bv.Symbol)
+def _symbol(e, values):
+    return Value(e.size)
+
+
+@_register(_forward, bv.UnaryOperation)
+def _unary_operation(e, values):
+    if e.op == UnaryOperator.Negate:
+        return _subtract(constant(e.size, 0), values[0], e.size)
+    return Value(e.size)
+
+
+@_register(_forward, bv.BooleanUnaryOperation)
+def _bitwise_not(e, values):
+    if e.op == UnaryOperator.Not:
+        return _not(values[0])
+    return Value(e.value.size)
+
+
+@_register(_forward, bv.BinaryOperation)
+def _binary_operation(e, values):
+    a, b = values
+    x, y = a.exact(), b.exact()
+    if x is not None and y is not None:
+        return constant(e.size, e.semantics[e.op](x, y, e.size))
+
+    function = _binary.get(e.op)
+    if function is None:
+        return Value(e.size)
+    return function(a, b, e.size)
+
+
+@_register(_binary, BinaryOperator.And)
+def _and(a, b, size):
+    return Value(size, a.zeros | b.zeros, a.ones & b.ones, high=min(a.high, b.high))
+
+
+@_register(_binary, BinaryOperator.Or)
+def _or(a, b, size):
+    return Value(size, a.zeros & b.zeros, a.ones | b.ones, low=max(a.low, b.low))
+
+
+@_register(_binary, BinaryOperator.Xor)
+def _xor(a, b, size):
+    return Value(size, (a.zeros & b.zeros) | (a.ones & b.ones),
+                 (a.zeros & b.ones) | (a.ones & b.zeros))
+
+
+@_register(_binary, BinaryOperator.Nand)
+def _nand(a, b, size):
+    return _not(_and(a, b, size))
+
+
+@_register(_binary, BinaryOperator.Nor)
+def _nor(a, b, size):
+    return _not(_or(a, b, size))
+
+
+@_register(_binary, BinaryOperator.Xnor)
+def _xnor(a, b, size):
+    return _not(_xor(a, b, size))
+
+
+@_register(_binary, BinaryOperator.Add)
+def _add(a, b, size, carry=0):
+    # the known bits of a ripple carry adder, from the sums with every
+    # unknown bit clear and with every unknown bit set; where those
+    # agree on the carry into a bit, it is known.
+    full = carry_bit(size) - 1
+    least = a.ones + b.ones + carry
+    most = (full & ~a.zeros) + (full & ~b.zeros) + carry
+    carries = ~(most ^ a.zeros ^ b.zeros) | (least ^ a.ones ^ b.ones)
+    known = (a.zeros | a.ones) & (b.zeros | b.ones) & carries
+
+    low, high = _wrapped(a.low + b.low + carry, a.high + b.high + carry, 0, carry_bit(size))
+    slow, shigh = _wrapped(a.slow + b.slow + carry, a.shigh + b.shigh + carry,
+                           -sign_bit(size), carry_bit(size))
+    return Value(size, ~most & known, least & known, low, high, slow, shigh)
+
+
+@_register(_binary, BinaryOperator.Subtract)
+def _subtract(a, b, size):
+    return _add(a, _not(b), size, 1)
+
+
+@_register(_binary, BinaryOperator.Multiply)
+def _multiply(a, b, size):
+    span = carry_bit(size)
+    low, high = _wrapped(a.low * b.low, a.high * b.high, 0, span)
+    ends = [x * y for x in (a.slow, a.shigh) for y in (b.slow, b.shigh)]
+    slow, shigh = _wrapped(min(ends), max(ends), -sign_bit(size), span)
+    zeros = (1 << (_trailing(a) + _trailing(b))) - 1
+    return Value(size, zeros, 0, low, high, slow, shigh)
+
+
+@_register(_binary, BinaryOperator.UnsignedDivide)
+def _unsigned_divide(a, b, size):
+    if b.low == 0:
+        # dividing by zero gives all ones
+        return Value(size, low=a.low // b.high if b.high else carry_bit(size) - 1)
+    return Value(size, low=a.low // b.high, high=a.high // b.low)
+
+
+@_register(_binary, BinaryOperator.UnsignedRemainder)
+def _unsigned_remainder(a, b, size):
+    if a.high < b.low:
+        return a
+    elif b.low == 0:
+        # the remainder by zero is a
+        return Value(size, high=a.high)
+    return Value(size, high=min(a.high, b.high - 1))
+
+
+@_register(_binary, BinaryOperator.SignedRemainder)
+def _signed_remainder(a, b, size):
+    # no bigger than a and with its sign, and smaller than b unless
+    # that is zero
+    slow, shigh = min(a.slow, 0), max(a.shigh, 0)
+    if b.slow > 0 or b.shigh < 0:
+        limit = max(-b.slow, b.shigh) - 1
+        slow, shigh = max(slow, -limit), min(shigh, limit)
+    return Value(size, slow=slow, shigh=shigh)
+
+
+@_register(_binary, BinaryOperator.SignedModulo)
+def _signed_modulo(a, b, size):
+    # smaller than b and with its sign, unless that is zero
+    if b.slow > 0:
+        return Value(size, slow=0, shigh=b.shigh - 1)
+    elif b.shigh < 0:
+        return Value(size, slow=b.slow + 1, shigh=0)
+    return Value(size)
+
+
+@_register(_binary, BinaryOperator.ShiftLeft)
+def _shift_left(a, b, size):
+    if b.low >= size:
+        return constant(size, 0)
+
+    shift = b.exact()
+    if shift is not None:
+        zeros = (a.zeros << shift) | ((1 << shift) - 1)
+        ones = a.ones << shift
+    else:
+        zeros = (1 << (b.low + _trailing(a))) - 1
+        ones = 0
+    low, high = 0, None
+    if a.high << min(b.high, size) < carry_bit(size):
+        low, high = a.low << b.low, a.high << b.high
+    return Value(size, zeros, ones, low, high)
+
+
+@_register(_binary, BinaryOperator.LogicalShiftRight)
+def _logical_shift_right(a, b, size):
+    if b.low >= size:
+        return constant(size, 0)
+
+    full = carry_bit(size) - 1
+    shift = b.exact()
+    zeros = ones = 0
+    if shift is not None:
+        zeros = (a.zeros >> shift) | (full & ~(full >> shift))
+        ones = a.ones >> shift
+    return Value(size, zeros, ones, a.low >> min(b.high, size), a.high >> b.low)
+
+
+@_register(_binary, BinaryOperator.ArithmeticShiftRight)
+def _arithmetic_shift_right(a, b, size):
+    full = carry_bit(size) - 1
+    half = sign_bit(size)
+    least, most = min(b.low, size - 1), min(b.high, size - 1)
+    zeros = ones = 0
+    if least == most:
+        filled = full & ~(full >> least)
+        zeros = a.zeros >> least
+        ones = a.ones >> least
+        if a.zeros & half:
+            zeros |= filled
+        elif a.ones & half:
+            ones |= filled
+    return Value(size, zeros, ones,
+                 slow=min(a.slow >> least, a.slow >> most),
+                 shigh=max(a.shigh >> least, a.shigh >> most))
+
+
+@_register(_binary, BinaryOperator.RotateLeft)
+def _rotate(a, b, size, left=True):
+    shift = b.exact()
+    if shift is None:
+        return Value(size)
+
+    shift %= size
+    if not left:
+        shift = (size - shift) % size
+    if shift == 0:
+        return a
+    return Value(size, (a.zeros << shift) | (a.zeros >> (size - shift)),
+                 (a.ones << shift) | (a.ones >> (size - shift)))
+
+
+_binary[BinaryOperator.RotateRight] = lambda a, b, size: _rotate(a, b, size, False)
+
+
+@_register(_forward, bv.Concatenation)
+def _concatenation(e, values):
+    zeros = ones = low = high = 0
+    for element, value in zip(e.elements, values):
+        zeros = (zeros << element.size) | value.zeros
+        ones = (ones << element.size) | value.ones
+        low = (low << element.size) | value.low
+        high = (high << element.size) | value.high
+    return Value(e.size, zeros, ones, low, high)
+
+
+@_register(_forward, bv.Repetition)
+def _repetition(e, values):
+    value = values[0]
+    zeros = ones = low = high = 0
+    for _ in range(e.count):
+        zeros = (zeros << value.size) | value.zeros
+        ones = (ones << value.size) | value.ones
+        low = (low << value.size) | value.low
+        high = (high << value.size) | value.high
+    return Value(e.size, zeros, ones, low, high)
+
+
+@_register(_forward, bv.Extraction)
+def _extraction(e, values):
+    value = values[0]
+    low, high = 0, None
+    if value.low >> e.end == value.high >> e.end:
+        # the bits above the extraction are the same throughout, so the
+        # ends stay the ends
+        full = carry_bit(e.size) - 1
+        low, high = (value.low >> e.start) & full, (value.high >> e.start) & full
+    return Value(e.size, value.zeros >> e.start, value.ones >> e.start, low, high)
+
+
+@_register(_forward, bv.Extension)
+def _extension(e, values):
+    value = values[0]
+    extension = (carry_bit(e.extension_size) - 1) << value.size
+    if e.kind == ExtensionKind.Zero:
+        return Value(e.size, value.zeros | extension, value.ones, value.low, value.high)
+
+    zeros, ones = value.zeros, value.ones
+    if zeros & sign_bit(value.size):
+        zeros |= extension
+    elif ones & sign_bit(value.size):
+        ones |= extension
+    return Value(e.size, zeros, ones, slow=value.slow, shigh=value.shigh)
+
+
+@_register(_forward, bv.IfThenElse)
+def _if_then_else(e, values):
+    if values[0] is True:
+        return values[1]
+    elif values[0] is False:
+        return values[2]
+    return values[1].join(values[2])
+
+
+# comparisons
+
+@_register(_forward, bv.BooleanBinaryOperation)
+def _comparison(e, values):
+    return _compare[e.op](values[0], values[1])
+
+
+@_register(_compare, BinaryOperator.Equal)
+def _equal(a, b):
+    if a.low == a.high == b.low == b.high:
+        return True
+    elif (a.zeros & b.ones or a.ones & b.zeros or a.high < b.low or b.high < a.low
+          or a.shigh < b.slow or b.shigh < a.slow):
+        return False
+    return None
+
+
+def _ordered(certain, impossible):
+    if certain:
+        return True
+    elif impossible:
+        return False
+    return None
+
+
+_compare.update({
+    BinaryOperator.UnsignedLessThan:
+        lambda a, b: _ordered(a.high < b.low, a.low >= b.high),
+    BinaryOperator.UnsignedLessThanOrEqual:
+        lambda a, b: _ordered(a.high <= b.low, a.low > b.high),
+    BinaryOperator.UnsignedGreaterThan:
+        lambda a, b: _ordered(a.low > b.high, a.high <= b.low),
+    BinaryOperator.UnsignedGreaterThanOrEqual:
+        lambda a, b: _ordered(a.low >= b.high, a.high < b.low),
+    BinaryOperator.SignedLessThan:
+        lambda a, b: _ordered(a.shigh < b.slow, a.slow >= b.shigh),
+    BinaryOperator.SignedLessThanOrEqual:
+        lambda a, b: _ordered(a.shigh <= b.slow, a.slow > b.shigh),
+    BinaryOperator.SignedGreaterThan:
+        lambda a, b: _ordered(a.slow > b.shigh, a.shigh <= b.slow),
+    BinaryOperator.SignedGreaterThanOrEqual:
+        lambda a, b: _ordered(a.slow >= b.shigh, a.shigh < b.slow),
+})
+
+
+# booleans
+
+@_register(_forward, bl.Constant)
+def _boolean_constant(e, values):
+    return bool(e.value)
+
+
+@_register(_forward, bl.Symbol)
+def _boolean_symbol(e, values):
+    return None
+
+
+@_register(_forward, bl.UnaryOperation)
+def _boolean_unary_operation(e, values):
+    if e.op != UnaryOperator.Not or values[0] is None:
+        return None
+    return not values[0]
+
+
+@_register(_forward, bl.BinaryOperation)
+def _boolean_binary_operation(e, values):
+    a, b = values
+    if e.op == BinaryOperator.And:
+        if a is False or b is False:
+            return False
+        return _ordered(a and b, False)
+    elif e.op == BinaryOperator.Or:
+        if a is True or b is True:
+            return True
+        return _ordered(False, a is False and b is False)
+    elif e.op == BinaryOperator.Implies:
+        if a is False or b is True:
+            return True
+        return _ordered(False, a is True and b is False)
+    elif a is None or b is None:
+        return None
+    return e.semantics[e.op](a, b)
+
+
+@_register(_forward, bl.IfThenElse)
+def _boolean_if_then_else(e, values):
+    if values[0] is True or values[1] == values[2]:
+        return values[1]
+    elif values[0] is False:
+        return values[2]
+    return None
+
+
+def _evaluate(expr, facts, values):
+    """The abstract value of expr under facts (which may be None), with
+    those of the nodes below it put in values by id on the way. Raises
+    _TooBig past max_nodes new nodes, and _Empty if the facts rule out
+    every value of some node.
+    """
+
+    if id(expr) in values:
+        return values[id(expr)]
+
+    count = 0
+    stack = [(expr, False)]
+    while stack:
+        e, expanded = stack.pop()
+        if expanded:
+            value = _forward[type(e)](e, [values[id(c)] for c in e.children()])
+            if facts is not None:
+                fact = facts.get(e.fingerprint)
+                if fact is not None:
+                    value = _meet(value, fact)
+            values[id(e)] = value
+            continue
+        elif id(e) in values:
+            continue
+
+        count += 1
+        if count > max_nodes:
+            raise _TooBig()
+        stack.append((e, True))
+        for c in e.children():
+            if id(c) not in values:
+                stack.append((c, False))
+
+    return values[id(expr)]
+
+
+def _meet(value, fact):
+    if isinstance(fact, Value):
+        return value.meet(fact)
+    elif value is not None and value != fact:
+        raise _Empty()
+    return fact
+
+
+# a comparison known to be true or false, as (operator, swapped) for
+# one of lhs < rhs and lhs <= rhs, or of rhs < lhs and rhs <= lhs when
+# swapped
+_orders = dict()
+for _lt, _le, _gt, _ge in [
+        (BinaryOperator.UnsignedLessThan, BinaryOperator.UnsignedLessThanOrEqual,
+         BinaryOperator.UnsignedGreaterThan, BinaryOperator.UnsignedGreaterThanOrEqual),
+        (BinaryOperator.SignedLessThan, BinaryOperator.SignedLessThanOrEqual,
+         BinaryOperator.SignedGreaterThan, BinaryOperator.SignedGreaterThanOrEqual)]:
+    _orders.update({
+        (_lt, True): (_lt, False), (_lt, False): (_le, True),
+        (_le, True): (_le, False), (_le, False): (_lt, True),
+        (_gt, True): (_lt, True), (_gt, False): (_le, False),
+        (_ge, True): (_le, True), (_ge, False): (_lt, False),
+    })
+
+
+def _refine(expr, value, facts, values):
+    """Narrow what is known about expr to value, and push that down
+    into the nodes below it where that is simple. True if anything new
+    was learned.
+    """
+
+    changed = False
+    stack = [(expr, value)]
+    while stack:
+        e, value = stack.pop()
+        old = _evaluate(e, facts, values)
+        new = old.meet(value)
+        if new.same(old):
+            continue
+        changed = True
+        facts.set(e.fingerprint, new)
+        values[id(e)] = new
+
+        cls = type(e)
+        if cls is bv.Extension:
+            size = e.value.size
+            if e.kind == ExtensionKind.Zero:
+                stack.append((e.value, Value(size, new.zeros, new.ones, new.low, new.high)))
+            else:
+                stack.append((e.value, Value(size, new.zeros, new.ones, slow=new.slow, shigh=new.shigh)))
+        elif cls is bv.Extraction:
+            stack.append((e.value, Value(e.value.size, new.zeros << e.start, new.ones << e.start)))
+        elif cls is bv.Concatenation:
+            offset = e.size
+            for element in e.elements:
+                offset -= element.size
+                stack.append((element, Value(element.size, new.zeros >> offset, new.ones >> offset)))
+        elif cls is bv.BooleanUnaryOperation and e.op == UnaryOperator.Not:
+            stack.append((e.value, _not(new)))
+        elif cls is bv.UnaryOperation and e.op == UnaryOperator.Negate:
+            stack.append((e.value, _subtract(constant(e.size, 0), new, e.size)))
+        elif cls is bv.BinaryOperation and e.op == BinaryOperator.And:
+            # a one needs ones on both sides; a zero where the other
+            # side has a one needs a zero on this one
+            lhs = _evaluate(e.lhs, facts, values)
+            rhs = _evaluate(e.rhs, facts, values)
+            stack.append((e.lhs, Value(e.size, new.zeros & rhs.ones, new.ones)))
+            stack.append((e.rhs, Value(e.size, new.zeros & lhs.ones, new.ones)))
+        elif cls is bv.BinaryOperation and e.op == BinaryOperator.Or:
+            lhs = _evaluate(e.lhs, facts, values)
+            rhs = _evaluate(e.rhs, facts, values)
+            stack.append((e.lhs, Value(e.size, new.zeros, new.ones & rhs.zeros)))
+            stack.append((e.rhs, Value(e.size, new.zeros, new.ones & lhs.zeros)))
+        elif cls is bv.BinaryOperation and e.op in (BinaryOperator.Add, BinaryOperator.Subtract,
+                                                     BinaryOperator.Xor):
+            # with one side known exactly the other follows
+            lhs = _evaluate(e.lhs, facts, values)
+            rhs = _evaluate(e.rhs, facts, values)
+            if rhs.exact() is not None:
+                if e.op == BinaryOperator.Add:
+                    stack.append((e.lhs, _subtract(new, rhs, e.size)))
+                elif e.op == BinaryOperator.Subtract:
+                    stack.append((e.lhs, _add(new, rhs, e.size)))
+                else:
+                    stack.append((e.lhs, _xor(new, rhs, e.size)))
+            elif lhs.exact() is not None:
+                if e.op == BinaryOperator.Add:
+                    stack.append((e.rhs, _subtract(new, lhs, e.size)))
+                elif e.op == BinaryOperator.Subtract:
+                    stack.append((e.rhs, _subtract(lhs, new, e.size)))
+                else:
+                    stack.append((e.rhs, _xor(new, lhs, e.size)))
+
+    return changed
+
+
+def _excluding(value, c):
+    """value, less c where that is one of its ends."""
+
+    size = value.size
+    signed = to_signed(c, size)
+    low, high, slow, shigh = value.low, value.high, value.slow, value.shigh
+    if low == c:
+        low += 1
+    if high == c:
+        high -= 1
+    if slow == signed:
+        slow += 1
+    if shigh == signed:
+        shigh -= 1
+    return Value(size, low=low, high=high, slow=slow, shigh=shigh)
+
+
+def _compared(e, truth, facts, values):
+    """Narrow the sides of the comparison e, given it is truth."""
+
+    a = _evaluate(e.lhs, facts, values)
+    b = _evaluate(e.rhs, facts, values)
+    size = a.size
+    if e.op == BinaryOperator.Equal:
+        if truth:
+            value = a.meet(b)
+            return _refine(e.lhs, value, facts, values) | _refine(e.rhs, value, facts, values)
+
+        changed = False
+        if b.exact() is not None:
+            changed |= _refine(e.lhs, _excluding(a, b.exact()), facts, values)
+        if a.exact() is not None:
+            changed |= _refine(e.rhs, _excluding(b, a.exact()), facts, values)
+        return changed
+
+    op, swapped = _orders[(e.op, truth)]
+    lhs, rhs = e.lhs, e.rhs
+    if swapped:
+        lhs, rhs, a, b = rhs, lhs, b, a
+
+    # lhs < rhs, or lhs <= rhs
+    strict = 1 if op in (BinaryOperator.UnsignedLessThan, BinaryOperator.SignedLessThan) else 0
+    if op in (BinaryOperator.UnsignedLessThan, BinaryOperator.UnsignedLessThanOrEqual):
+        below = Value(size, high=b.high - strict)
+        above = Value(size, low=a.low + strict)
+    else:
+        below = Value(size, shigh=b.shigh - strict)
+        above = Value(size, slow=a.slow + strict)
+    return _refine(lhs, below, facts, values) | _refine(rhs, above, facts, values)
+
+
+def _assume(expr, facts, values):
+    """Record what expr being true says about the nodes in it. True if
+    anything new was learned.
+    """
+
+    changed = False
+    stack = [(expr, True)]
+    while stack:
+        e, truth = stack.pop()
+        value = _evaluate(e, facts, values)
+        if value is not None:
+            if value != truth:
+                raise _Empty()
+        else:
+            changed = True
+            facts.set(e.fingerprint, truth)
+            values[id(e)] = truth
+
+        cls = type(e)
+        if cls is bl.UnaryOperation and e.op == UnaryOperator.Not:
+            stack.append((e.value, not truth))
+        elif cls is bl.BinaryOperation:
+            if e.op == BinaryOperator.And and truth:
+                stack.append((e.lhs, True))
+                stack.append((e.rhs, True))
+            elif e.op == BinaryOperator.Or and not truth:
+                stack.append((e.lhs, False))
+                stack.append((e.rhs, False))
+            elif e.op == BinaryOperator.Implies and not truth:
+                stack.append((e.lhs, True))
+                stack.append((e.rhs, False))
+        elif cls is bv.BooleanBinaryOperation:
+            changed |= _compared(e, truth, facts, values)
+
+    return changed
+
+
+def narrow(facts, roots, snapshot=True):
+    """New Facts that hold where facts (which may be None) do and every
+    one of roots is true.
+    """
+
+    output = Facts(facts, snapshot)
+    if output.contradiction:
+        return output
+
+    roots = list(roots)
+    for _ in range(passes):
+        changed = False
+        values = dict()
+        for root in roots:
+            try:
+                changed |= _assume(root, output, values)
+            except _TooBig:
+                continue
+            except _Empty:
+                output.contradiction = True
+                return output
+        if not changed:
+            break
+    return output
+
+
+def truth(expr, facts=None):
+    """True or False if expr is known to be that wherever facts hold,
+    otherwise None.
+    """
+
+    if facts is not None and facts.contradiction:
+        return False
+
+    try:
+        value = _evaluate(expr, facts, dict())
+    except _Empty:
+        return False
+    except _TooBig:
+        return None
+
+    if value is None and narrow(facts, [expr], False).contradiction:
+        # nothing below it is known, but it can't hold with the facts
+        return False
+    return value
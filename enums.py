@@ -62,3 +62,9 @@ class BinaryOperator(object):
 class ExtensionKind(object):
     Zero = 0
     Sign = 1
+
+
+class Result(object):
+    Unsat = 0
+    Sat = 1
+    Unknown = 2
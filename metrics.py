@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.metrics
+
+Counters and histograms of where a Solver's time goes. Each tree of
+Solvers (a Solver and everything forked from it) has a Metrics, and
+everything recorded there is also recorded in the global one, metrics.
+
+The names recorded by smt.solver are:
+
+    hit.<tier>, miss.<tier>    counters for each cache a check() or
+                               model() looked in: cache, domain,
+                               counterexamples, models, model_cache
+                               and store
+    lookup.<tier>              histogram of the seconds each took,
+                               for the tiers that do more than look
+                               in a dict: domain, counterexamples,
+                               models and store
+    queries                    counter of queries sent to a backend
+    solve                      histogram of their wall time in seconds
+    result.<status>            counter of their outcomes (sat, unsat,
+                               unknown, timeout, memout, cancelled)
+    query.nodes, query.bytes   histograms of their size, in distinct
+                               nodes and (where a backend needed the
+                               text) bytes of smt2
+    serialize, parse           histograms of the seconds spent building
+                               query text and reading models back
+
+snapshot() returns all of it as plain dicts, and export() hands that
+to every exporter, any callable taking a snapshot; JSONLinesExporter
+appends them to a file.
+"""
+
+import json
+import math
+import threading
+import time
+
+
+class Histogram(object):
+    """The count, sum, least and greatest of the values observed, and
+    how many fell in each power of two bucket: a value v goes in the
+    bucket for the least 2 ** n that is at least v.
+    """
+
+    __slots__ = ['count', 'total', 'least', 'greatest', 'buckets']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.least = None
+        self.greatest = None
+        self.buckets = dict()
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if self.least is None or value < self.least:
+            self.least = value
+        if self.greatest is None or value > self.greatest:
+            self.greatest = value
+
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            if mantissa == 0.5:
+                exponent -= 1
+        else:
+            exponent = None
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def quantile(self, q):
+        """The upper bound of the bucket holding the qth quantile, at
+        most the greatest value seen; None if nothing has been seen.
+        """
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for exponent in sorted(self.buckets, key=lambda e: -math.inf if e is None else e):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                if exponent is None:
+                    return min(0, self.greatest)
+                return min(2.0 ** exponent, self.greatest)
+        return self.greatest
+
+    def snapshot(self):
+        buckets = dict()
+        for exponent, count in self.buckets.items():
+            buckets[0 if exponent is None else 2.0 ** exponent] = count
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.least,
+            'max': self.greatest,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': buckets,
+        }
+
+
+class Metrics(object):
+    """Named counters and histograms, safe to record into from any
+    thread. Everything is recorded in parent as well, if there is one.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.exporters = []
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+
+    def count(self, name, n=1):
+        metrics = self
+        while metrics is not None:
+            with metrics._lock:
+                metrics._counters[name] = metrics._counters.get(name, 0) + n
+            metrics = metrics.parent
+
+    def observe(self, name, value):
+        metrics = self
+        while metrics is not None:
+            with metrics._lock:
+                histogram = metrics._histograms.get(name)
+                if histogram is None:
+                    histogram = metrics._histograms[name] = Histogram()
+                histogram.observe(value)
+            metrics = metrics.parent
+
+    def timer(self, name):
+        """A context manager that observes how many seconds its body
+        took under name.
+        """
+
+        return _Timer(self, name)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        """{'counters': {name: count}, 'histograms': {name: summary}},
+        where each summary is as Histogram.snapshot().
+        """
+
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': dict((name, histogram.snapshot())
+                                   for name, histogram in self._histograms.items()),
+            }
+
+    def reset(self):
+        """Forget everything recorded here (but not in parent)."""
+
+        with self._lock:
+            self._counters = dict()
+            self._histograms = dict()
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def export(self):
+        """Hand a snapshot to each exporter, and return it."""
+
+        snapshot = self.snapshot()
+        for exporter in list(self.exporters):
+            exporter(snapshot)
+        return snapshot
+
+
+class _Timer(object):
+
+    __slots__ = ['metrics', 'name', 'started']
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class JSONLinesExporter(object):
+    """Appends each snapshot to path as one line of JSON, with the time
+    it was taken and label.
+    """
+
+    def __init__(self, path, label=None):
+        self.path = path
+        self.label = label
+        self._lock = threading.Lock()
+
+    def __call__(self, snapshot):
+        record = dict(snapshot, time=time.time())
+        if self.label is not None:
+            record['label'] = self.label
+        line = json.dumps(record, sort_keys=True, default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+# everything recorded by every Solver
+metrics = Metrics()
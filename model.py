@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.model
+
+Parsing of the models printed by (get-model). The solver output is
+read in a single pass by an s-expression tokenizer, which accepts it
+either as one string or as any iterable of chunks (such as the lines
+of a pipe). Every define-fun of a constant is kept in its raw form and
+only turned into a Constant when it is looked up, so a model with tens
+of thousands of symbols costs next to nothing for a caller that only
+wants one of them.
+"""
+
+import re
+import sys
+
+from collections.abc import MutableMapping
+
+import smt.bitvector as bv
+import smt.boolean as bl
+from smt.utils import *
+
+
+_token_re = re.compile(r'''\s*(?:([()])|(\|[^|]*\|)|("(?:[^"]|"")*")|(;[^\n]*)|([^\s()|";]+))''')
+
+
+def _token(match):
+    paren, quoted, string, comment, atom = match.groups()
+    if paren is not None:
+        return paren
+    elif quoted is not None:
+        return quoted[1:-1]
+    elif string is not None:
+        return string
+    return atom
+
+
+def tokenize(chunks):
+    """The tokens of the s-expressions in chunks, a string or an iterable
+    of strings: '(', ')' or an atom. Quoted symbols lose their bars, and
+    comments are skipped.
+    """
+
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+
+    pending = ''
+    for chunk in chunks:
+        text = pending + chunk
+        position = 0
+        for match in _token_re.finditer(text):
+            # anything running up to the end of the chunk might carry on
+            # in the next one
+            if match.end() == len(text) and not match.group(1):
+                break
+            position = match.end()
+            token = _token(match)
+            if token is not None:
+                yield token
+        pending = text[position:]
+
+    for match in _token_re.finditer(pending):
+        token = _token(match)
+        if token is not None:
+            yield token
+
+
+def _read(tokens, token):
+    """The s-expression starting with token, as nested lists."""
+
+    if token != '(':
+        return token
+
+    output = []
+    stack = []
+    for token in tokens:
+        if token == '(':
+            stack.append(output)
+            output = []
+        elif token == ')':
+            if not stack:
+                return output
+            stack[-1].append(output)
+            output = stack.pop()
+        else:
+            output.append(token)
+    raise SolverError('unterminated s-expression in model', None)
+
+
+def _size(sort):
+    """The size of a bitvector sort, None for Bool and False for any
+    other sort.
+    """
+
+    if sort == 'Bool':
+        return None
+    elif isinstance(sort, list) and len(sort) == 3 and sort[:2] == ['_', 'BitVec']:
+        return int(sort[2])
+    return False
+
+
+def _constant(size, value):
+    if size is None:
+        if value == 'true':
+            return bl.Constant(True)
+        elif value == 'false':
+            return bl.Constant(False)
+    elif isinstance(value, str):
+        if value.startswith('#x'):
+            return bv.Constant(size, int(value[2:], 16))
+        elif value.startswith('#b'):
+            return bv.Constant(size, int(value[2:], 2))
+    elif len(value) == 3 and value[0] == '_' and value[1].startswith('bv'):
+        return bv.Constant(size, int(value[1][2:]))
+
+    raise SolverError('unrecognised model value {0}'.format(value), None)
+
+
+def _text(value):
+    if isinstance(value, list):
+        return '(' + ' '.join(_text(v) for v in value) + ')'
+    return value
+
+
+class Model(MutableMapping):
+    """A mapping from symbol names to Constants, which converts the raw
+    values from the solver the first time each one is looked up.
+
+    Cached models are shared between threads, so lookups may race: a
+    converted value is stored before its raw value is dropped, and a
+    name is never missing from both in between.
+    """
+
+    def __init__(self, raw=None):
+        # name -> (size, raw value), for the values not yet converted
+        self._raw = dict() if raw is None else raw
+        self._values = dict()
+
+    def __getitem__(self, name):
+        value = self._values.get(name)
+        if value is None:
+            raw = self._raw.get(name)
+            if raw is None:
+                # converted by another thread since we looked
+                return self._values[name]
+            value = _constant(*raw)
+            self._values[name] = value
+            self._raw.pop(name, None)
+        return value
+
+    def __setitem__(self, name, value):
+        self._raw.pop(name, None)
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        if name in self._values:
+            del self._values[name]
+        else:
+            del self._raw[name]
+
+    def __contains__(self, name):
+        return name in self._values or name in self._raw
+
+    def __iter__(self):
+        for name in list(self._values):
+            yield name
+        for name in list(self._raw):
+            if name not in self._values:
+                yield name
+
+    def __len__(self):
+        return len(self._values) + sum(1 for name in list(self._raw) if name not in self._values)
+
+    def include(self, other):
+        """Add everything in other (a Model or any mapping) to this one,
+        without converting any raw values.
+        """
+
+        if isinstance(other, Model):
+            for name in other._raw:
+                self._values.pop(name, None)
+            for name in other._values:
+                self._raw.pop(name, None)
+            self._raw.update(other._raw)
+            self._values.update(other._values)
+        else:
+            for name in other:
+                self._raw.pop(name, None)
+            self._values.update(other)
+
+    def __repr__(self):
+        return 'Model({0})'.format(dict(self))
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self) + sys.getsizeof(self._raw) + sys.getsizeof(self._values)
+        for name, value in list(self._raw.items()):
+            size += sys.getsizeof(name) + sys.getsizeof(value[1])
+        for name, value in list(self._values.items()):
+            size += sys.getsizeof(name) + sys.getsizeof(value)
+        return size
+
+
+def parse_model(chunks, names=None):
+    """The Model in the output of (get-model), given as for tokenize().
+    Only the constants named in names are kept, if it is given;
+    functions with arguments and sorts other than Bool and bitvectors
+    are skipped.
+    """
+
+    raw = dict()
+    tokens = tokenize(chunks)
+    previous = None
+    for token in tokens:
+        if token != 'define-fun' or previous != '(':
+            previous = token
+            continue
+        previous = None
+
+        try:
+            name = next(tokens)
+            arguments = _read(tokens, next(tokens))
+            sort = _read(tokens, next(tokens))
+            value = _read(tokens, next(tokens))
+        except StopIteration:
+            raise SolverError('truncated define-fun in model', None)
+
+        size = _size(sort)
+        if arguments or size is False:
+            continue
+        if names is None or name in names:
+            raw[name] = (size, value)
+
+    return Model(raw)
+
+
+def format_model(model):
+    """Text for model (a Model or any mapping from names to Constants)
+    in the form (get-model) prints it, which parse_model() reads back.
+    """
+
+    raw = model._raw if isinstance(model, Model) else dict()
+    lines = ['(']
+    for name in model:
+        entry = raw.get(name)
+        if entry is not None:
+            size, value = entry
+            sort = 'Bool' if size is None else '(_ BitVec {0})'.format(size)
+            value = _text(value)
+        else:
+            value = model[name]
+            sort = value.sort()
+            value = value.smt2()
+        lines.append('  (define-fun {0} () {1} {2})'.format(name, sort, value))
+    lines.append(')')
+    return '\n'.join(lines) + '\n'
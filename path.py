@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.path
+
+Incremental, structurally shared path conditions. Each Solver in a
+fork() tree has a PathCondition built from its parent's by adding only
+its own roots, so nothing is recomputed from the top of the path for
+each query.
+
+A PathCondition splits the roots into clusters that share no symbols.
+Each Cluster is immutable and keeps a running hash of its roots; its
+SMT2 text is built on demand, and the text for the roots a cluster
+adds is shared with every cluster that grows from it. The maps from symbol names to clusters
+are stored as per-node deltas. A full copy is taken every
+snapshot_interval nodes, so lookups never walk far up a long path.
+"""
+
+from smt.domain import narrow
+from smt.utils import *
+
+
+def mix(value):
+    """Scramble a 64-bit hash (the splitmix64 finaliser), so that sums
+    of hashes make a good hash of a (multi)set.
+    """
+
+    value &= 0xffffffffffffffff
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return value ^ (value >> 31)
+
+
+def _iterate(tree):
+    """The leaves of a tree of nested pairs of tuples, in order."""
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        elif isinstance(node, list):
+            stack.append(node[1])
+            stack.append(node[0])
+        else:
+            for leaf in node:
+                yield leaf
+
+
+def declarations(symbols):
+    smt2 = ''
+    for symbol in symbols:
+        smt2 += '(declare-fun {0} () {1})\n'.format(symbol.name, symbol.sort())
+    return smt2
+
+
+def assertions(exprs):
+    """(assert) commands for exprs, sharing common subterms (see
+    smt.utils.serialise).
+    """
+
+    definitions, terms = serialise(exprs)
+    smt2 = ''
+    for definition in definitions:
+        smt2 += definition + '\n'
+    for term in terms:
+        smt2 += '(assert {0})\n'.format(term)
+    return smt2
+
+
+class Cluster(object):
+    """A set of roots that (transitively) share symbols. groups is a
+    linked list of (depth, roots, next) with the deepest fork() level
+    first; names is a tree of the symbol names used.
+    """
+
+    __slots__ = ['groups', 'names', 'hash', 'count', 'base', 'added', '_text', '_declared', '_facts']
+
+    def __init__(self, groups=None, names=None, hash=0, count=0, base=None, added=()):
+        self.groups = groups
+        self.names = names
+        self.hash = hash
+        self.count = count
+        # the cluster this one grew from, and the roots it added
+        self.base = base
+        self.added = added
+        self._text = None
+        self._declared = None
+        self._facts = None
+
+    def roots(self):
+        """The roots, outermost first."""
+
+        for depth, roots in self.group_list():
+            for root in roots:
+                yield root
+
+    def group_list(self):
+        """The roots for each level of the fork() tree, outermost first,
+        as pairs of (depth, roots).
+        """
+
+        output = []
+        groups = self.groups
+        while groups is not None:
+            output.append((groups[0], groups[1]))
+            groups = groups[2]
+        output.reverse()
+        return output
+
+    def extend(self, depth, roots, names):
+        """A new cluster with roots added at depth, which must be at
+        least as deep as anything already here.
+        """
+
+        roots = tuple(roots)
+        groups = self.groups
+        if groups is not None and groups[0] == depth:
+            groups = (depth, groups[1] + roots, groups[2])
+        else:
+            groups = (depth, roots, groups)
+
+        h = self.hash
+        for root in roots:
+            h += mix(root.fingerprint)
+        h &= 0xffffffffffffffff
+
+        if names:
+            names = [self.names, tuple(names)]
+        else:
+            names = self.names
+
+        return Cluster(groups, names, h, self.count + len(roots), self, roots)
+
+    def merge(self, other):
+        """The union of two clusters."""
+
+        if other.count == 0:
+            return self
+        elif self.count == 0:
+            return other
+
+        groups = []
+        a, b = self.groups, other.groups
+        while a is not None or b is not None:
+            if b is None or (a is not None and a[0] > b[0]):
+                groups.append((a[0], a[1]))
+                a = a[2]
+            elif a is None or b[0] > a[0]:
+                groups.append((b[0], b[1]))
+                b = b[2]
+            else:
+                groups.append((a[0], a[1] + b[1]))
+                a, b = a[2], b[2]
+
+        linked = None
+        for depth, roots in reversed(groups):
+            linked = (depth, roots, linked)
+
+        h = (self.hash + other.hash) & 0xffffffffffffffff
+        base, other = (self, other) if self.count >= other.count else (other, self)
+        return Cluster(linked, [base.names, other.names], h, self.count + other.count,
+                       base, tuple(other.roots()))
+
+    def smt2(self, symbols_of):
+        """Declarations and assertions for every root, and the symbols
+        they declare. The text for the roots each cluster adds is built
+        once and shared with every cluster that grows from it.
+        """
+
+        chunks = []
+        symbols = dict()
+        cluster = self
+        while cluster is not None:
+            if cluster._text is None:
+                declared = dict()
+                for root in cluster.added:
+                    for symbol in symbols_of(root):
+                        declared[symbol.name] = symbol
+                text = assertions(cluster.added)
+                cluster._text, cluster._declared = text, declared
+            chunks.append(cluster._text)
+            symbols.update(cluster._declared)
+            cluster = cluster.base
+        chunks.reverse()
+
+        return declarations(symbols.values()) + ''.join(chunks), symbols
+
+    def facts(self):
+        """What the roots force on the values of the expressions in
+        them (see smt.domain), built on the facts of the cluster this
+        one grew from.
+        """
+
+        chain = []
+        cluster = self
+        while cluster is not None and cluster._facts is None:
+            chain.append(cluster)
+            cluster = cluster.base
+
+        facts = None if cluster is None else cluster._facts
+        for cluster in reversed(chain):
+            facts = narrow(facts, cluster.added)
+            cluster._facts = facts
+        return facts
+
+
+class PathCondition(object):
+    """The roots of one node in the fork() tree, split into Clusters."""
+
+    # take a full copy of the symbol maps every this many nodes
+    snapshot_interval = 32
+
+    __slots__ = ['parent', 'leaders', 'clusters', 'distance', 'hash', 'count', 'slicing',
+                 'feasible', '_all']
+
+    def __init__(self, slicing=True):
+        self.parent = None
+        # name -> leader, leader -> Cluster; None is the leader for
+        # roots without any symbols (and everything, without slicing)
+        self.leaders = dict()
+        self.clusters = dict()
+        self.distance = 0
+        self.hash = 0
+        self.count = 0
+        self.slicing = slicing
+        self.feasible = None
+        self._all = None
+
+    def _lookup(self, table, key):
+        state = self
+        while state is not None:
+            values = getattr(state, table)
+            if key in values:
+                return values[key]
+            if state.distance == 0:
+                return None
+            state = state.parent
+        return None
+
+    def leader(self, name):
+        return self._lookup('leaders', name)
+
+    def cluster(self, leader):
+        return self._lookup('clusters', leader)
+
+    def all_clusters(self):
+        """Every non-empty Cluster."""
+
+        if self._all is None:
+            chain = []
+            state = self
+            while True:
+                chain.append(state)
+                if state.distance == 0 or state.parent is None:
+                    break
+                state = state.parent
+            clusters = dict()
+            for state in reversed(chain):
+                clusters.update(state.clusters)
+            self._all = [c for c in clusters.values() if c.count]
+        return self._all
+
+    def touched(self, symbols):
+        """The distinct clusters containing any of symbols."""
+
+        if not self.slicing:
+            cluster = self.cluster(None)
+            return [cluster] if cluster is not None else []
+
+        output = []
+        leaders = set()
+        for symbol in symbols:
+            leader = self.leader(symbol.name)
+            if leader is not None and leader not in leaders:
+                leaders.add(leader)
+                output.append(self.cluster(leader))
+        return output
+
+    def extend(self, depth, roots, symbols_of):
+        """A new PathCondition with roots added at depth."""
+
+        state = PathCondition(self.slicing)
+        state.parent = self
+        state.distance = self.distance + 1
+        state.count = self.count + len(roots)
+        h = self.hash
+        for root in roots:
+            h += mix(root.fingerprint)
+        state.hash = h & 0xffffffffffffffff
+
+        if state.distance >= self.snapshot_interval:
+            leaders = dict()
+            clusters = dict()
+            chain = []
+            s = self
+            while True:
+                chain.append(s)
+                if s.distance == 0 or s.parent is None:
+                    break
+                s = s.parent
+            for s in reversed(chain):
+                leaders.update(s.leaders)
+                clusters.update(s.clusters)
+            state.leaders = leaders
+            state.clusters = clusters
+            state.distance = 0
+
+        for root in roots:
+            names = []
+            leaders = []
+            for symbol in symbols_of(root):
+                leader = state.leader(symbol.name) if self.slicing else None
+                if leader is None and self.slicing:
+                    names.append(symbol.name)
+                elif leader not in leaders:
+                    leaders.append(leader)
+                if not self.slicing:
+                    names.append(symbol.name)
+
+            if not self.slicing or (not leaders and not names):
+                leaders = [None]
+            elif not leaders:
+                leaders = [names[0]]
+
+            # merge everything into the largest cluster, renaming the
+            # symbols of the others
+            clusters = [state.cluster(leader) or Cluster() for leader in leaders]
+            biggest = max(range(len(leaders)), key=lambda i: clusters[i].count)
+            leader = leaders[biggest]
+            cluster = clusters[biggest]
+            for i, other in enumerate(clusters):
+                if i == biggest:
+                    continue
+                cluster = cluster.merge(other)
+                state.clusters[leaders[i]] = Cluster()
+                for name in _iterate(other.names):
+                    state.leaders[name] = leader
+
+            for name in names:
+                state.leaders[name] = leader
+            state.clusters[leader] = cluster.extend(depth, [root], names)
+
+        return state
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.record
+
+Recording of the queries a program makes, so the mix can be replayed
+offline against another backend or cache configuration. Set
+Solver.recorder to a Recorder and every check(), model(), minimize(),
+maximize() and enumerate() (and their async and batch forms) is
+appended to a gzipped log of JSON lines.
+
+Expressions are written once per log, as a table of nodes that each
+entry adds to (see encode()), and so are the roots of each Solver up
+the fork() tree, as groups; entries refer to both by index, so a long
+path costs the log nothing more for each call made along it. Every
+Recorder starts with a header line, which starts the tables afresh.
+Each entry has:
+
+    kind        check, model, minimize, maximize or enumerate
+    nodes       the nodes it adds to the table
+    new_groups  the groups it adds, as lists of node indices
+    groups      the groups of roots, outermost first, as indices
+    expr        the node asked about, or null
+    args        signed and limit, for the searches
+    status      sat, unsat, unknown (or another incomplete status) or
+                error
+    value       the model, as {name: value}, or the values found
+    time        wall time of the call in seconds
+    tier        what answered it: solver, or the cache that did (cache,
+                domain, counterexamples, models, model_cache, store),
+                or path if the path condition (or a constant) did;
+                coalesced if it waited on the same async query from
+                another caller
+    tiers       the same for each cluster it was split into
+    smt2        the text of the query as one script, if the Recorder
+                was asked to keep it
+
+read() gives the entries back with their expressions rebuilt, and
+
+    python -m smt.record LOG [--backend fake] [--store PATH] ...
+
+replays a log and prints the throughput and latency of the replay as
+JSON, with the recorded timings alongside.
+"""
+
+import argparse
+import atexit
+import gzip
+import importlib
+import json
+import sys
+import threading
+import time
+
+import smt.solver
+import smt.utils
+from smt.backend import FakeBackend, ProcessBackend, SessionBackend, Query, Z3Backend
+from smt.store import Store
+from smt.utils import *
+
+
+# bumped whenever the format of an entry changes
+version = 2
+
+# class -> the slots holding its structure, in order
+_layouts = dict()
+
+_modules = frozenset(['smt.bitvector', 'smt.boolean'])
+
+
+def _layout(cls):
+    layout = _layouts.get(cls)
+    if layout is None:
+        slots = []
+        for klass in reversed(cls.__mro__):
+            for slot in getattr(klass, '__slots__', ()):
+                if slot not in smt.utils._unkeyed and slot not in slots:
+                    slots.append(slot)
+        layout = _layouts[cls] = tuple(slots)
+    return layout
+
+
+def encode(exprs, index=None):
+    """The nodes of exprs not already in index, children first, and the
+    index of each of exprs. index maps the fingerprint of each node
+    already written to its place in the table, and has the new ones
+    added to it; the new nodes go at the end of the table.
+
+    Each node is a list of its class's name and the values of its
+    slots; a child is given as a list of its index, so that [3] is the
+    fourth node and [[3], [4]] a list of children.
+    """
+
+    if index is None:
+        index = dict()
+
+    nodes = []
+    stack = [(e, False) for e in reversed(exprs)]
+    while stack:
+        e, expanded = stack.pop()
+        if e.fingerprint in index:
+            continue
+        elif not expanded:
+            stack.append((e, True))
+            for c in reversed(e.children()):
+                if c.fingerprint not in index:
+                    stack.append((c, False))
+            continue
+
+        node = [name(e)]
+        for slot in _layout(type(e)):
+            value = getattr(e, slot)
+            if isinstance(value, list):
+                value = [[index[v.fingerprint]] for v in value]
+            elif hasattr(value, 'children'):
+                value = [index[value.fingerprint]]
+            node.append(value)
+        index[e.fingerprint] = len(index)
+        nodes.append(node)
+
+    return nodes, [index[e.fingerprint] for e in exprs]
+
+
+def decode(nodes, output=None):
+    """The expressions in a table from encode(), appended to output
+    (the expressions of the table so far) if it is given. They are
+    rebuilt exactly as they were, without being simplified or interned.
+    """
+
+    if output is None:
+        output = []
+    for node in nodes:
+        module, _, class_name = node[0].rpartition('.')
+        if module not in _modules:
+            raise ValueError('not an expression: {0}'.format(node[0]))
+        cls = getattr(importlib.import_module(module), class_name)
+
+        e = cls.__new__(cls)
+        for slot, value in zip(_layout(cls), node[1:]):
+            if isinstance(value, list):
+                if value and isinstance(value[0], list):
+                    value = [output[v[0]] for v in value]
+                else:
+                    value = output[value[0]]
+            setattr(e, slot, value)
+        e.smt2_cache = None
+        e.symbols_cache = None
+        e.fingerprint = smt.utils._fingerprint(e)
+        output.append(e)
+    return output
+
+
+def answered_by(tiers):
+    """The tier that answered a call, given those that answered each
+    of its clusters.
+    """
+
+    if 'solver' in tiers:
+        return 'solver'
+    elif tiers:
+        return tiers[-1]
+    return 'path'
+
+
+def _value(result):
+    """JSON for the value of a call: a model, the values found by a
+    search, or nothing.
+    """
+
+    if result is None or isinstance(result, bool):
+        return None
+    elif isinstance(result, tuple):
+        return list(result)
+    return dict((symbol, result[symbol].value) for symbol in result)
+
+
+class Recorder(object):
+    """Appends entries to a gzipped log at path, batch of them at a
+    time; each batch is a gzip member of its own, so the log can be
+    added to by later runs. Entries still waiting are written by
+    flush() or close(), which is done at exit. The query text is only
+    kept if smt2 is set, since it repeats the whole path every time.
+    """
+
+    def __init__(self, path, batch=64, smt2=False):
+        self.path = path
+        self.batch = batch
+        self.smt2 = smt2
+        self._lock = threading.Lock()
+        self._pending = [json.dumps({'kind': 'start', 'version': version, 'when': time.time()})]
+        # fingerprint -> node index, and group -> group index
+        self._nodes = dict()
+        self._groups = dict()
+        self.recorded = 0
+        atexit.register(self.close)
+
+    def record(self, kind, groups, expr, status, result, seconds, tiers, args=None):
+        """Record a call of kind over the roots in groups, and expr."""
+
+        with self._lock:
+            nodes = []
+            new_groups = []
+            entry_groups = []
+            for group in groups:
+                new, indices = encode(group, self._nodes)
+                nodes.extend(new)
+                indices = tuple(indices)
+                if indices not in self._groups:
+                    self._groups[indices] = len(self._groups)
+                    new_groups.append(indices)
+                entry_groups.append(self._groups[indices])
+
+            expr_index = None
+            if expr is not None:
+                new, (expr_index,) = encode([expr], self._nodes)
+                nodes.extend(new)
+
+            entry = {
+                'kind': kind,
+                'nodes': nodes,
+                'new_groups': new_groups,
+                'groups': entry_groups,
+                'expr': expr_index,
+                'args': args or dict(),
+                'status': status,
+                'value': _value(result),
+                'time': seconds,
+                'tier': answered_by(tiers),
+                'tiers': list(tiers),
+                'when': time.time(),
+            }
+            if self.smt2:
+                # searches ask about a bitvector term, not an assertion
+                if kind in ('check', 'model'):
+                    query = Query(groups, expr, kind == 'model')
+                else:
+                    query = Query(groups)
+                entry['smt2'] = query.smt2()
+
+            self._pending.append(json.dumps(entry, separators=(',', ':')))
+            self.recorded += 1
+            if len(self._pending) >= self.batch:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            with gzip.open(self.path, 'at', encoding='utf8') as f:
+                f.write('\n'.join(self._pending) + '\n')
+            self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+
+def read(path):
+    """The entries in a log, in the order they were recorded, each with
+    groups as a list of lists of roots and expr as an expression (or
+    None), rebuilt from the tables.
+    """
+
+    exprs = []
+    groups = []
+    with gzip.open(path, 'rt', encoding='utf8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['kind'] == 'start':
+                if entry['version'] != version:
+                    raise ValueError('{0} is from version {1} of the format'.format(
+                        path, entry['version']))
+                exprs = []
+                groups = []
+                continue
+
+            decode(entry.pop('nodes'), exprs)
+            for group in entry.pop('new_groups'):
+                groups.append(tuple(group))
+            entry['group_ids'] = list(entry['groups'])
+            entry['groups'] = [[exprs[i] for i in groups[g]] for g in entry['groups']]
+            if entry['expr'] is not None:
+                entry['expr'] = exprs[entry['expr']]
+            yield entry
+
+
+def _solver(solvers, entry, Solver):
+    """The Solver down a fork() tree holding the roots of entry, shared
+    with earlier entries down the same path.
+    """
+
+    path = ()
+    solver = solvers.get(path)
+    if solver is None:
+        solver = solvers[path] = Solver()
+    for group_id, group in zip(entry['group_ids'], entry['groups']):
+        path += (group_id,)
+        child = solvers.get(path)
+        if child is None:
+            child, _ = solver.fork()
+            for root in group:
+                child.add(root)
+            solvers[path] = child
+        solver = child
+    return solver
+
+
+def _call(solver, kind, expr, args):
+    """The status and value of a call, as the recorder sees them."""
+
+    try:
+        if kind == 'check':
+            result = solver.check(expr)
+        elif kind == 'model':
+            result = solver.model(expr)
+        else:
+            result = solver._values(kind, expr, args.get('limit'), args.get('signed', False))
+    except SolverUnknown as e:
+        return e.reason, None
+    except SolverError:
+        return 'error', None
+    return smt.solver._status(kind, result), result
+
+
+def _latencies(times):
+    if not times:
+        return None
+    times = sorted(times)
+
+    def quantile(q):
+        return times[min(len(times) - 1, int(q * len(times)))]
+
+    return {
+        'count': len(times),
+        'total': sum(times),
+        'mean': sum(times) / len(times),
+        'p50': quantile(0.5),
+        'p95': quantile(0.95),
+        'p99': quantile(0.99),
+        'max': times[-1],
+    }
+
+
+def replay(path, backend=None, store=None, **options):
+    """Run every query in the log at path again, against backend (as
+    for Solver.backend) with fresh caches, and the persistent store if
+    one is given. Any other Solver settings (slicing, domain,
+    reuse_models, counterexamples, timeout, incremental...) can be
+    given as keywords.
+
+    Returns the throughput and latencies of the replay and of the
+    recording, the tiers that answered each, and how many answers
+    differ from those recorded.
+    """
+
+    Solver = smt.solver.Solver
+    settings = dict(store=store, backend=backend, recorder=None)
+    settings.update(options)
+
+    replayed = dict()
+    recorded = dict()
+    tiers = dict()
+    mismatches = []
+    count = 0
+    solvers = dict()
+    with Solver.configured(fresh=True, **settings):
+        started = time.perf_counter()
+        for entry in read(path):
+            solver = _solver(solvers, entry, Solver)
+            expr = entry['expr']
+            tracked = []
+            token = smt.solver._track(tracked)
+            try:
+                call_started = time.perf_counter()
+                answer, value = _call(solver, entry['kind'], expr, entry['args'])
+                elapsed = time.perf_counter() - call_started
+            finally:
+                smt.solver._untrack(token)
+
+            tier = answered_by(tracked)
+            tiers[tier] = tiers.get(tier, 0) + 1
+            replayed.setdefault(entry['kind'], []).append(elapsed)
+            recorded.setdefault(entry['kind'], []).append(entry['time'])
+            # models needn't be the same, but the values found must be
+            if answer != entry['status'] or (entry['kind'] not in ('check', 'model') and
+                                             _value(value) != entry['value']):
+                mismatches.append({'index': count, 'kind': entry['kind'],
+                                   'recorded': entry['status'], 'replayed': answer})
+            count += 1
+        total = time.perf_counter() - started
+
+    everything = [t for times in replayed.values() for t in times]
+    return {
+        'queries': count,
+        'seconds': total,
+        'throughput': count / total if total else None,
+        'latency': _latencies(everything),
+        'kinds': dict((kind, _latencies(times)) for kind, times in replayed.items()),
+        'tiers': tiers,
+        'recorded': {
+            'latency': _latencies([t for times in recorded.values() for t in times]),
+            'kinds': dict((kind, _latencies(times)) for kind, times in recorded.items()),
+        },
+        'mismatches': mismatches,
+    }
+
+
+_backends = {
+    'session': SessionBackend,
+    'process': ProcessBackend,
+    'z3': Z3Backend,
+    'fake': FakeBackend,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smt.record',
+                                     description='Replay a log of recorded solver queries.')
+    parser.add_argument('log')
+    parser.add_argument('--backend', choices=sorted(_backends), default='session')
+    parser.add_argument('--store', help='use a persistent store at this path')
+    parser.add_argument('--timeout', type=float)
+    parser.add_argument('--no-slicing', action='store_true')
+    parser.add_argument('--no-domain', action='store_true')
+    parser.add_argument('--no-counterexamples', action='store_true')
+    parser.add_argument('--reuse-models', type=int)
+    parser.add_argument('--output', help='write the report here rather than to stdout')
+    args = parser.parse_args(argv)
+
+    options = dict()
+    if args.timeout is not None:
+        options['timeout'] = args.timeout
+    if args.no_slicing:
+        options['slicing'] = False
+    if args.no_domain:
+        options['domain'] = False
+    if args.no_counterexamples:
+        options['counterexamples'] = None
+    if args.reuse_models is not None:
+        options['reuse_models'] = args.reuse_models
+
+    store = Store(args.store) if args.store else None
+    report = replay(args.log, _backends[args.backend](), store, **options)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0 if not report['mismatches'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.session
+
+A long-lived solver process driven over stdin/stdout pipes. The
+assertion stack of the process mirrors the Solver.fork() tree, so a
+query only has to send the constraints that differ from the previous
+one instead of re-declaring and re-asserting the whole path.
+"""
+
+import subprocess
+import threading
+
+from smt.utils import *
+
+
+# what z3 takes as no limit
+_unlimited = 4294967295
+
+
+def _prefix(frame, group):
+    """True if every expression in frame is (by identity) at the same
+    position in group.
+    """
+
+    if len(frame) > len(group):
+        return False
+    for a, b in zip(frame, group):
+        if a is not b:
+            return False
+    return True
+
+
+class Session(object):
+
+    command = ['z3', '-smt2', '-in']
+    sentinel = 'smt-session-done'
+
+    # the define-funs sent are global and stay in the process, so past
+    # this many of them it is reset and re-synced on the next query
+    max_definitions = 1 << 14
+
+    def __init__(self, command=None):
+        if command is not None:
+            self.command = command
+        self._lock = threading.Lock()
+        self._process = None
+        self._frames = []
+        self._declared = set()
+        self._defined = dict()
+        self._limits = (None, None)
+        self.start()
+
+    def start(self):
+        self._process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        self._frames = []
+        self._declared = set()
+        self._defined = dict()
+        self._communicate([
+            '(set-option :global-declarations true)',
+            '(set-logic QF_BV)'])
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._process.kill()
+                self._process.wait()
+            except OSError:
+                pass
+            self._process = None
+        self._frames = []
+        self._declared = set()
+        self._defined = dict()
+        self._limits = (None, None)
+
+    def kill(self):
+        """Kill the process, from any thread; a query in progress fails
+        with SessionError.
+        """
+
+        process = self._process
+        if process is not None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def query(self, groups, expr=None, model=False, timeout=None, memory=None):
+        """Check the conjunction of groups (a list of sequences of
+        expressions, outermost first) and optionally expr, returning the
+        raw solver output in the same form as a one-shot run. The solver
+        gives up after timeout seconds, or beyond memory megabytes.
+
+        Each group is kept in its own (push) scope, so consecutive
+        queries down the same fork() path only pay for the groups that
+        changed. Raises SessionError if the process has died.
+        """
+
+        with self._lock:
+            if not self.alive():
+                raise SessionError('solver process is not running')
+
+            commands = []
+            self._sync(groups, commands)
+
+            if expr is not None:
+                commands.append('(push 1)')
+                self._assert([expr], commands)
+            self._set_limits(timeout, memory, commands)
+            commands.append('(check-sat)')
+            if model:
+                commands.append('(get-model)')
+            if expr is not None:
+                commands.append('(pop 1)')
+
+            return self._checked(self._communicate(commands))
+
+    def begin(self, groups, exprs):
+        """Open a scope holding exprs above groups (as for query()), for
+        a run of check_value() and add() until end(). Nothing else can
+        use the session in between.
+        """
+
+        with self._lock:
+            if not self.alive():
+                raise SessionError('solver process is not running')
+
+            commands = []
+            self._sync(groups, commands)
+            commands.append('(push 1)')
+            self._assert(exprs, commands)
+            self._communicate(commands)
+
+    def check_value(self, exprs, term, timeout=None, memory=None):
+        """Check the scope from begin() with exprs added just for this
+        check. The output has the value of term, a symbol, on the line
+        after a sat; otherwise that line is the error get-value gives,
+        which costs less than waiting for the answer before asking.
+        """
+
+        with self._lock:
+            commands = ['(push 1)']
+            self._assert(exprs, commands)
+            self._set_limits(timeout, memory, commands)
+            commands.append('(check-sat)')
+            commands.append('(get-value ({0}))'.format(term.name))
+            commands.append('(pop 1)')
+            return self._communicate(commands)
+
+    def add(self, exprs):
+        """Add exprs to the scope from begin()."""
+
+        with self._lock:
+            commands = []
+            self._assert(exprs, commands)
+            self._communicate(commands)
+
+    def end(self):
+        """Close the scope from begin()."""
+
+        with self._lock:
+            self._communicate(['(pop 1)'])
+
+    def _set_limits(self, timeout, memory, commands):
+        limits = (timeout, memory)
+        if limits != self._limits:
+            commands.append('(set-option :timeout {0})'.format(
+                _unlimited if timeout is None else max(1, int(timeout * 1000))))
+            commands.append('(set-option :memory_max_size {0})'.format(
+                _unlimited if memory is None else int(memory)))
+            self._limits = limits
+
+    def _checked(self, output):
+        # anything other than a result means the stack is in an
+        # unknown state, so start again from a clean one next time.
+        if not output.startswith(('sat', 'unsat', 'unknown')):
+            commands = []
+            self._reset(commands)
+            self._communicate(commands)
+        return output
+
+    def _reset(self, commands):
+        commands.extend(['(reset)',
+                         '(set-option :global-declarations true)',
+                         '(set-logic QF_BV)'])
+        self._frames = []
+        self._declared = set()
+        self._defined = dict()
+        self._limits = (None, None)
+
+    def _sync(self, groups, commands):
+        if len(self._defined) > self.max_definitions:
+            # drops the subterms held here as well as in the process
+            self._reset(commands)
+
+        depth = 0
+        for frame, group in zip(self._frames, groups):
+            if not _prefix(frame, group):
+                break
+            # only the innermost scope can have constraints appended
+            if len(frame) < len(group) and depth < len(self._frames) - 1:
+                break
+            depth += 1
+
+        if depth < len(self._frames):
+            commands.append('(pop {0})'.format(len(self._frames) - depth))
+            del self._frames[depth:]
+
+        if depth > 0 and len(self._frames[-1]) < len(groups[depth - 1]):
+            group = groups[depth - 1]
+            self._assert(group[len(self._frames[-1]):], commands)
+            self._frames[-1] = tuple(group)
+
+        for group in groups[depth:]:
+            commands.append('(push 1)')
+            self._assert(group, commands)
+            self._frames.append(tuple(group))
+
+    def _assert(self, exprs, commands):
+        for e in exprs:
+            for symbol in e.symbols():
+                if symbol.name in self._declared:
+                    continue
+                self._declared.add(symbol.name)
+                commands.append('(declare-fun {0} () {1})'.format(symbol.name, symbol.sort()))
+
+        # definitions are global, so shared subterms are only sent once
+        # until the process is next reset.
+        definitions, terms = serialise(exprs, self._defined)
+        commands.extend(definitions)
+        for term in terms:
+            commands.append('(assert {0})'.format(term))
+
+    def _communicate(self, commands):
+        commands.append('(echo "{0}")'.format(self.sentinel))
+        try:
+            self._process.stdin.write('\n'.join(commands) + '\n')
+            self._process.stdin.flush()
+
+            lines = []
+            while True:
+                line = self._process.stdout.readline()
+                if not line:
+                    raise SessionError('solver process exited')
+                line = line.rstrip('\r\n')
+                if line == self.sentinel:
+                    break
+                lines.append(line)
+
+        except (IOError, OSError) as e:
+            self.close()
+            raise SessionError(str(e))
+
+        except SessionError:
+            self.close()
+            raise
+
+        if not lines:
+            return ''
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.simplify
+
+Algebraic simplification driven by a table of rewrite rules, keyed on
+expression class. Each rule looks at one node (whose children are
+already simplified) and returns a smaller equivalent expression, or
+None if it doesn't apply.
+
+simplify() rewrites an existing expression bottom-up; set_simplify(True)
+applies the rules to every node as it is constructed instead. Either
+way hits counts how often each rule fired.
+"""
+
+import collections
+
+import smt.bitvector as bv
+import smt.boolean as bl
+import smt.utils
+from smt.enums import *
+from smt.utils import *
+
+
+# rule name -> number of times it has fired
+hits = collections.Counter()
+
+# expression class -> [(name, rule)], tried in order
+rules = collections.defaultdict(list)
+
+
+def rule(*classes):
+    def register(function):
+        for cls in classes:
+            rules[cls].append((function.__name__, function))
+        return function
+    return register
+
+
+def stats():
+    return dict(hits)
+
+
+def reset_stats():
+    hits.clear()
+
+
+def _bv_constant(e, value=None):
+    if not isinstance(e, bv.Constant):
+        return False
+    return value is None or e.value == value % carry_bit(e.size)
+
+
+def _bl_constant(e, value=None):
+    if not isinstance(e, bl.Constant):
+        return False
+    return value is None or bool(e.value) == value
+
+
+def _ones(size):
+    return carry_bit(size) - 1
+
+
+_commutative = frozenset([
+    BinaryOperator.And, BinaryOperator.Or, BinaryOperator.Xor,
+    BinaryOperator.Add, BinaryOperator.Multiply])
+
+
+# bitvector arithmetic and logic
+
+@rule(bv.BinaryOperation)
+def fold_binary(e):
+    if _bv_constant(e.lhs) and _bv_constant(e.rhs):
+        value = bv.BinaryOperation.semantics[e.op](e.lhs.value, e.rhs.value, e.size)
+        return bv.Constant(e.size, value % carry_bit(e.size))
+
+
+@rule(bv.BinaryOperation)
+def constant_right(e):
+    # put constants on the right of commutative operators, so that the
+    # other rules (and the caches) only see one form
+    if e.op in _commutative and _bv_constant(e.lhs) and not _bv_constant(e.rhs):
+        return bv.BinaryOperation(e.rhs, e.op, e.lhs)
+
+
+@rule(bv.BinaryOperation)
+def identity(e):
+    if not _bv_constant(e.rhs):
+        return None
+    if e.op in (BinaryOperator.Add, BinaryOperator.Subtract, BinaryOperator.Or,
+                BinaryOperator.Xor, BinaryOperator.ShiftLeft,
+                BinaryOperator.LogicalShiftRight, BinaryOperator.ArithmeticShiftRight,
+                BinaryOperator.RotateLeft, BinaryOperator.RotateRight) and _bv_constant(e.rhs, 0):
+        return e.lhs
+    if e.op in (BinaryOperator.Multiply, BinaryOperator.UnsignedDivide,
+                BinaryOperator.SignedDivide) and _bv_constant(e.rhs, 1):
+        return e.lhs
+    if e.op == BinaryOperator.And and _bv_constant(e.rhs, _ones(e.size)):
+        return e.lhs
+
+
+@rule(bv.BinaryOperation)
+def annihilate(e):
+    if not _bv_constant(e.rhs):
+        return None
+    if e.op in (BinaryOperator.Multiply, BinaryOperator.And) and _bv_constant(e.rhs, 0):
+        return bv.Constant(e.size, 0)
+    if e.op == BinaryOperator.Or and _bv_constant(e.rhs, _ones(e.size)):
+        return bv.Constant(e.size, _ones(e.size))
+    if e.op in (BinaryOperator.UnsignedRemainder, BinaryOperator.SignedRemainder,
+                BinaryOperator.SignedModulo) and _bv_constant(e.rhs, 1):
+        return bv.Constant(e.size, 0)
+    if e.op in (BinaryOperator.ShiftLeft, BinaryOperator.LogicalShiftRight) and e.rhs.value >= e.size:
+        return bv.Constant(e.size, 0)
+
+
+@rule(bv.BinaryOperation)
+def self_operand(e):
+    if not e.lhs.identical(e.rhs):
+        return None
+    if e.op in (BinaryOperator.And, BinaryOperator.Or):
+        return e.lhs
+    if e.op in (BinaryOperator.Xor, BinaryOperator.Subtract, BinaryOperator.UnsignedRemainder,
+                BinaryOperator.SignedRemainder, BinaryOperator.SignedModulo):
+        return bv.Constant(e.size, 0)
+
+
+@rule(bv.BinaryOperation)
+def reassociate(e):
+    # (x op c1) op c2 -> x op (c1 op c2) for associative operators
+    lhs = e.lhs
+    if (e.op in _commutative and _bv_constant(e.rhs) and isinstance(lhs, bv.BinaryOperation)
+            and lhs.op == e.op and _bv_constant(lhs.rhs)):
+        value = bv.BinaryOperation.semantics[e.op](lhs.rhs.value, e.rhs.value, e.size)
+        return bv.BinaryOperation(lhs.lhs, e.op, bv.Constant(e.size, value % carry_bit(e.size)))
+
+    # (x + c1) - c2 -> x + (c1 - c2), and (x - c1) + c2 likewise
+    if (e.op in (BinaryOperator.Add, BinaryOperator.Subtract) and _bv_constant(e.rhs)
+            and isinstance(lhs, bv.BinaryOperation) and _bv_constant(lhs.rhs)
+            and lhs.op in (BinaryOperator.Add, BinaryOperator.Subtract) and lhs.op != e.op):
+        if lhs.op == BinaryOperator.Add:
+            value = lhs.rhs.value - e.rhs.value
+        else:
+            value = e.rhs.value - lhs.rhs.value
+        return bv.BinaryOperation(lhs.lhs, BinaryOperator.Add, bv.Constant(e.size, value))
+
+
+@rule(bv.UnaryOperation)
+def fold_negate(e):
+    if _bv_constant(e.value):
+        return bv.Constant(e.size, -e.value.value)
+
+
+@rule(bv.UnaryOperation, bv.BooleanUnaryOperation)
+def double_negation(e):
+    if type(e.value) is type(e) and e.value.op == e.op:
+        return e.value.value
+
+
+@rule(bv.BooleanUnaryOperation)
+def fold_not(e):
+    if _bv_constant(e.value):
+        return bv.Constant(e.value.size, ~e.value.value)
+
+
+# bitvector comparisons
+
+@rule(bv.BooleanBinaryOperation)
+def fold_comparison(e):
+    if _bv_constant(e.lhs) and _bv_constant(e.rhs):
+        return bl.Constant(bool(bv.BooleanBinaryOperation.semantics[e.op](
+            e.lhs.value, e.rhs.value, e.lhs.size)))
+
+
+@rule(bv.BooleanBinaryOperation)
+def reflexive_comparison(e):
+    if not e.lhs.identical(e.rhs):
+        return None
+    return bl.Constant(e.op in (
+        BinaryOperator.Equal,
+        BinaryOperator.UnsignedLessThanOrEqual, BinaryOperator.UnsignedGreaterThanOrEqual,
+        BinaryOperator.SignedLessThanOrEqual, BinaryOperator.SignedGreaterThanOrEqual))
+
+
+@rule(bv.BooleanBinaryOperation)
+def unsigned_bounds(e):
+    if _bv_constant(e.rhs, 0):
+        if e.op == BinaryOperator.UnsignedLessThan:
+            return bl.Constant(False)
+        elif e.op == BinaryOperator.UnsignedGreaterThanOrEqual:
+            return bl.Constant(True)
+    elif _bv_constant(e.rhs, _ones(e.rhs.size)):
+        if e.op == BinaryOperator.UnsignedGreaterThan:
+            return bl.Constant(False)
+        elif e.op == BinaryOperator.UnsignedLessThanOrEqual:
+            return bl.Constant(True)
+
+
+# if-then-else
+
+@rule(bv.IfThenElse, bl.IfThenElse)
+def constant_predicate(e):
+    if _bl_constant(e.predicate):
+        if e.predicate.value:
+            return e.if_case
+        return e.else_case
+
+
+@rule(bv.IfThenElse, bl.IfThenElse)
+def same_branches(e):
+    if e.if_case.identical(e.else_case):
+        return e.if_case
+
+
+# extraction
+
+@rule(bv.Extraction)
+def fold_extraction(e):
+    if _bv_constant(e.value):
+        return bv.Constant(e.size, e.value.value >> e.start)
+
+
+@rule(bv.Extraction)
+def whole_extraction(e):
+    if e.start == 0 and e.size == e.value.size:
+        return e.value
+
+
+# boolean
+
+@rule(bl.UnaryOperation)
+def fold_boolean_not(e):
+    if _bl_constant(e.value):
+        return bl.Constant(not e.value.value)
+
+
+@rule(bl.UnaryOperation)
+def double_not(e):
+    if isinstance(e.value, bl.UnaryOperation) and e.value.op == e.op:
+        return e.value.value
+
+
+@rule(bl.BinaryOperation)
+def fold_boolean(e):
+    if _bl_constant(e.lhs) and _bl_constant(e.rhs):
+        return bl.Constant(bool(bl.BinaryOperation.semantics[e.op](
+            bool(e.lhs.value), bool(e.rhs.value))))
+
+
+@rule(bl.BinaryOperation)
+def boolean_constant_operand(e):
+    for constant, other in ((e.lhs, e.rhs), (e.rhs, e.lhs)):
+        if not _bl_constant(constant):
+            continue
+        value = bool(constant.value)
+        if e.op == BinaryOperator.And:
+            return other if value else bl.Constant(False)
+        elif e.op == BinaryOperator.Or:
+            return bl.Constant(True) if value else other
+        elif e.op == BinaryOperator.Xor and not value:
+            return other
+        elif e.op == BinaryOperator.Equal and value:
+            return other
+
+    if e.op == BinaryOperator.Implies:
+        if _bl_constant(e.lhs):
+            return e.rhs if e.lhs.value else bl.Constant(True)
+        elif _bl_constant(e.rhs, True):
+            return bl.Constant(True)
+
+
+@rule(bl.BinaryOperation)
+def boolean_self_operand(e):
+    if not e.lhs.identical(e.rhs):
+        return None
+    if e.op in (BinaryOperator.And, BinaryOperator.Or):
+        return e.lhs
+    elif e.op == BinaryOperator.Xor:
+        return bl.Constant(False)
+    elif e.op in (BinaryOperator.Implies, BinaryOperator.Equal):
+        return bl.Constant(True)
+
+
+def rewrite(e):
+    """Apply the rules to the top of e until none of them fire."""
+
+    changed = True
+    while changed:
+        changed = False
+        for name, function in rules.get(type(e), ()):
+            output = function(e)
+            if output is not None:
+                hits[name] += 1
+                e = output
+                changed = True
+                break
+    return e
+
+
+# how to rebuild each class of expression with new children
+_rebuild = {
+    bv.UnaryOperation: lambda e, c: bv.UnaryOperation(e.op, c[0]),
+    bv.BooleanUnaryOperation: lambda e, c: bv.BooleanUnaryOperation(e.op, c[0]),
+    bv.BinaryOperation: lambda e, c: bv.BinaryOperation(c[0], e.op, c[1]),
+    bv.BooleanBinaryOperation: lambda e, c: bv.BooleanBinaryOperation(c[0], e.op, c[1]),
+    bv.Concatenation: lambda e, c: bv.Concatenation(c),
+    bv.Repetition: lambda e, c: bv.Repetition(c[0], e.count),
+    bv.Extraction: lambda e, c: bv.Extraction(c[0], e.start, e.end),
+    bv.Extension: lambda e, c: bv.Extension(c[0], e.kind, size=e.size),
+    bv.IfThenElse: lambda e, c: bv.IfThenElse(c[0], c[1], c[2]),
+    bl.UnaryOperation: lambda e, c: bl.UnaryOperation(e.op, c[0]),
+    bl.BinaryOperation: lambda e, c: bl.BinaryOperation(c[0], e.op, c[1]),
+    bl.IfThenElse: lambda e, c: bl.IfThenElse(c[0], c[1], c[2]),
+}
+
+
+def _simplify(e, values):
+    children = e.children()
+    if any(value is not child for value, child in zip(values, children)):
+        e = _rebuild[type(e)](e, values)
+    return rewrite(e)
+
+
+def simplify(expr):
+    """A simplified copy of expr (or expr itself, if no rule applies)."""
+
+    return smt.utils._postorder(expr, _simplify)
+
+
+def set_simplify(enabled):
+    """Simplify every expression as it is constructed."""
+
+    smt.utils._rewrite = rewrite if enabled else None
@@ -17,61 +17,429 @@
 """smt.solver
 
 Implements the actual 'using an SMT solver bit'. Backend has only
-been tested with z3. Note that it will fill /tmp up with lots of
-nonsense smt2 files.
+been tested with z3. Raw solver output is kept in a persistent store
+(see smt.store) shared between runs.
+
+By default queries go to a single long-lived solver process (see
+smt.session) whose push/pop stack follows the fork() tree; if that
+process dies we fall back to running z3 once per query.
+
+Each Solver keeps its path condition incrementally (see smt.path), so
+the cost of a query that hits a cache doesn't grow with the length of
+the path, and query text is only built for the solver itself.
+
+check_async() and model_async() are the same for asyncio code; they
+share the caches with check() and model(), and identical queries in
+flight at once are only sent to the solver once.
+
+Each tree of Solvers records what it does in Solver.metrics, and all
+of them in smt.metrics.metrics; see smt.metrics for what is recorded.
+Every call can also be logged, to be replayed offline; see smt.record.
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
 import os
-import re
-import subprocess
+import threading
 import time
+import weakref
 
 import smt.bitvector as bv
 import smt.boolean as bl
+import smt.metrics
+from smt.backend import AdaptiveTimeout, ProcessBackend, Query, SessionBackend, incomplete, parse_output
+from smt.cache import Cache
+from smt.counterexample import CounterexampleCache, complete, satisfies
+from smt.domain import truth
 from smt.enums import *
+from smt.metrics import Metrics
+from smt.model import Model, format_model
+from smt.path import Cluster, PathCondition, assertions, declarations, mix
+from smt.store import Store
 from smt.utils import *
 
 
-cache_hits = 0
-cache_misses = 0
+_missing = object()
+
+# the statuses counted as result.<status> in the metrics; any other is
+# an error
+_results = frozenset(['sat', 'unsat']) | incomplete
+
+# number of solver workers used by check_batch(), and of queries the
+# async api runs at once; defaults to one per cpu, change it with
+# set_workers().
+workers = os.cpu_count() or 1
+_pool = None
+_pool_lock = threading.Lock()
+
+# event loop -> (semaphore, queries in flight) for the async api
+_loops = weakref.WeakKeyDictionary()
+
+# the tiers that answered each cluster of the call being recorded, if
+# one is
+_tiers = contextvars.ContextVar('tiers', default=None)
+
+
+def _track(tiers):
+    """Append the tier that answers each cluster of the calls made
+    from here on in this context to tiers, until _untrack() is given
+    what this returns.
+    """
+
+    return _tiers.set(tiers)
+
+
+def _untrack(token):
+    _tiers.reset(token)
+
+
+def _status(kind, result):
+    """The status of what a call of kind returned: sat, or unsat if the
+    roots (and expr) had no model or a search found no values.
+    """
+
+    if kind == 'model':
+        return 'unsat' if result is None else 'sat'
+    return 'sat' if result else 'unsat'
+
+
+def _empty(cache):
+    return Cache(cache.max_entries, cache.max_bytes, cache.policy, cache.sizeof)
+
+
+def _tracked(tier):
+    tiers = _tiers.get()
+    if tiers is not None:
+        tiers.append(tier)
+
+
+def __getattr__(name):
+    # the old module-level counters, now read from the global metrics
+    counters = smt.metrics.metrics.snapshot()['counters']
+    if name == 'cache_hits':
+        return sum(count for counter, count in counters.items()
+                   if counter.startswith('hit.') and counter != 'hit.domain')
+    elif name == 'cache_misses':
+        return counters.get('queries', 0)
+    elif name == 'domain_hits':
+        return counters.get('hit.domain', 0)
+    raise AttributeError(name)
+
+
+def set_workers(count):
+    """Resize the worker pool used by check_batch(), and the limit on
+    solver queries running at once through the async api.
+    """
+
+    global workers, _pool
+    with _pool_lock:
+        workers = max(1, count)
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+        _loops.clear()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        return _pool
+
+
+async def _coalesce(key, function):
+    """The answer of function, a coroutine function that calls the
+    solver, run once at most workers are running. Anything that asks
+    for the same key while it is running gets the same answer.
+    """
+
+    loop = asyncio.get_event_loop()
+    with _pool_lock:
+        state = _loops.get(loop)
+        if state is None:
+            state = _loops[loop] = (asyncio.Semaphore(workers), dict())
+    semaphore, running = state
+
+    entry = running.get(key)
+    if entry is not None:
+        _tracked('coalesced')
+    else:
+        async def run():
+            try:
+                async with semaphore:
+                    return await function()
+            finally:
+                del running[key]
+
+        # the task, and how many callers are waiting for it
+        entry = running[key] = [asyncio.ensure_future(run()), 0]
+
+    # one caller giving up mustn't cancel the query for the others, but
+    # the last one to go takes it with them
+    task = entry[0]
+    entry[1] += 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if entry[1] == 1:
+            task.cancel()
+        raise
+    finally:
+        entry[1] -= 1
+
+
+def check_batch(queries):
+    """Check a list of (solver, expr) pairs in parallel, returning the
+    results in the same order as the queries.
+
+    Queries are split into independent clusters first (see
+    Solver._clusters()), so clusters shared between queries are solved
+    once. Each worker drives its own solver process, so the pool threads only
+    wait on i/o. Identical queries are only solved once, and results
+    go into Solver.cache exactly as check() would put them. Each query
+    has its solver's limits, and SolverUnknown is raised if any of them
+    is given up on.
+    """
+
+    recorder = Solver.recorder
+    started = time.perf_counter()
+    tiers = [[] for _ in queries]
+
+    results = [True] * len(queries)
+    pending = dict()
+    for i, (solver, expr) in enumerate(queries):
+        token = _track(tiers[i]) if recorder is not None else None
+        try:
+            if expr is not None and not expr.symbolic:
+                results[i] = expr.value
+                continue
+
+            state, clusters = solver._clusters(expr)
+            if state.feasible is False:
+                results[i] = False
+                continue
+
+            for cluster, cluster_expr in clusters:
+                key = solver._key(cluster, cluster_expr)
+                result = solver._check_cached(key, cluster, cluster_expr, state.feasible)
+                if result is not None:
+                    if not result:
+                        results[i] = False
+                        break
+                elif key in pending:
+                    pending[key][3].append(i)
+                else:
+                    pending[key] = (solver, cluster, cluster_expr, [i])
+        finally:
+            if token is not None:
+                _untrack(token)
+
+    if len(pending) == 1 or workers == 1:
+        for key, (solver, cluster, expr, indices) in pending.items():
+            if not solver._check_results(key, cluster, expr, solver._limits()):
+                for i in indices:
+                    results[i] = False
+    else:
+        executor = _executor()
+        futures = []
+        for key, (solver, cluster, expr, indices) in pending.items():
+            future = executor.submit(solver._check_results, key, cluster, expr, solver._limits())
+            futures.append((future, indices))
+
+        for future, indices in futures:
+            if not future.result():
+                for i in indices:
+                    results[i] = False
+
+    if recorder is not None:
+        # every query waited for the whole batch
+        seconds = time.perf_counter() - started
+        for _, _, _, indices in pending.values():
+            for i in indices:
+                tiers[i].append('solver')
+        for i, (solver, expr) in enumerate(queries):
+            recorder.record('check', solver._groups(), expr, 'sat' if results[i] else 'unsat', None,
+                            seconds, tiers[i])
+
+    return results
 
 
 class Solver(object):
     
-    bl_re = re.compile('''\(define-fun[\s\r\n]*([a-zA-Z0-9_]*)[\s\r\n]*\(\)[\s\r\n]*Bool[\s\r\n]*(true|false)[\s\r\n]*\)''')
-    bv_re = re.compile('''\(define-fun[\s\r\n]*([a-zA-Z0-9_]*)[\s\r\n]*\(\)[\s\r\n]*\(_[\s\r\n]*BitVec[\s\r\n]*([0-9]*)\)[\s\r\n]*#x([0-9a-fA-F]*)[\s\r\n]*\)''')
-    
-    smt2_cache = {}
-    symbol_cache = {}
-        
-    cache = dict()
-    model_cache = dict()
-    
-    def __init__(self, parent=None):
+    # all bounded; replace them (or change their budgets) to taste.
+    cache = Cache(max_entries=1 << 20)
+    model_cache = Cache(max_entries=1 << 16, max_bytes=512 << 20)
+
+    # persistent second level cache on disk, private to the user (see
+    # smt.store); None to do without.
+    store = Store(max_bytes=1 << 30)
+
+    # results keyed on the set of constraints in a query, answering
+    # queries whose subsets/supersets have been seen before.
+    counterexamples = CounterexampleCache()
+
+    # what answers the queries (see smt.backend), for every Solver that
+    # wasn't given a backend of its own. None picks a persistent
+    # incremental solver process for each thread, or a process per
+    # query if incremental is turned off.
+    backend = None
+    incremental = True
+    _session_backend = SessionBackend()
+    _process_backend = ProcessBackend()
+
+    # limits on every query to the solver, in seconds (or an
+    # AdaptiveTimeout) and megabytes; None for no limit. A Solver can be
+    # given its own, which its forks share, and check(), status() and
+    # model() take them for a single call.
+    timeout = None
+    memory = None
+
+    # a smt.record.Recorder to log every call to, for replaying
+    # offline; None to record nothing.
+    recorder = None
+
+    # split the roots into clusters that share no symbols, and solve
+    # (and cache) each cluster on its own.
+    slicing = True
+
+    # answer the checks that the known bits and ranges of the values in
+    # the roots decide (see smt.domain) without asking the solver.
+    domain = True
+
+    # how many recently seen models (this Solver's, inherited from its
+    # parent and from anywhere) to evaluate before asking the solver;
+    # 0 turns this off.
+    reuse_models = 8
+    _recent_models = []
+
+    def __init__(self, parent=None, backend=None, timeout=None, memory=None, metrics=None):
         self._parent = parent
+        if parent is not None:
+            if backend is None:
+                backend = parent._backend
+            if timeout is None:
+                timeout = parent._timeout
+            if memory is None:
+                memory = parent._memory
+            if metrics is None:
+                metrics = parent.metrics
+        if metrics is None:
+            metrics = Metrics(smt.metrics.metrics)
+        self.metrics = metrics
+        self._backend = backend
+        self._timeout = timeout
+        self._memory = memory
+        self._queries = set()
+        self._lock = threading.Lock()
         self._roots = []
         self._solve_time = 0
+        # weak references to the Solvers forked from this one, whose
+        # path conditions go stale if its roots change
+        self._children = []
+        self._forked = False
+        self._path = None
+        self._path_slicing = None
+        if parent is not None:
+            parent._forked = True
+            parent._children.append(weakref.ref(self))
+            self._depth = parent._depth + 1
+            self._models = list(parent._models)
+        else:
+            self._depth = 0
+            self._models = []
         
     def fork(self):
         return Solver(self), Solver(self)
 
+    @classmethod
+    @contextlib.contextmanager
+    def configured(cls, fresh=False, **settings):
+        """Change the class-level settings of Solver (backend, store,
+        slicing...) for the body of a with statement, and put them back
+        after it. Forks are always plain Solvers, so this is how to run
+        a whole tree of them differently. With fresh set, every cache
+        also starts out empty, with the same budget as before.
+        """
+
+        if fresh:
+            counterexamples = cls.counterexamples
+            if counterexamples is not None:
+                counterexamples = CounterexampleCache(counterexamples.max_entries,
+                                                      counterexamples.max_visits)
+            settings = dict({
+                'cache': _empty(cls.cache),
+                'model_cache': _empty(cls.model_cache),
+                'counterexamples': counterexamples,
+                '_recent_models': [],
+            }, **settings)
+
+        for name in settings:
+            if name not in cls.__dict__:
+                raise AttributeError(name)
+        saved = dict((name, cls.__dict__[name]) for name in settings)
+        for name, value in settings.items():
+            setattr(cls, name, value)
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                setattr(cls, name, value)
+
+    def cancel(self):
+        """Cancel the queries this Solver is waiting on (in other
+        threads), which then give up as if they had run out of time.
+        """
+
+        with self._lock:
+            queries = list(self._queries)
+        for query in queries:
+            query.cancel()
+
+    def _invalidate(self):
+        """Drop the cached path condition of this Solver and of those
+        forked from it, and nothing else. A Solver without one has none
+        below it either, so the walk stops there.
+        """
+
+        self._path = None
+        stack = [self]
+        while stack:
+            s = stack.pop()
+            for child in s._children:
+                child = child()
+                if child is not None and child._path is not None:
+                    child._path = None
+                    stack.append(child)
+
     def flatten(self):
         self._roots = self.roots()
         self._parent = None
+        self._invalidate()
 
     def concretise(self):
         m = self.model()
         self._roots = []
+        self._invalidate()
         for symbol_name in m:
             symbol_value = m[symbol_name]
             self.add(bv.Symbol(symbol_value.size, symbol_name) == symbol_value)
 
     def solve_time(self):
+        """How long the last query this Solver sent took, in seconds;
+        see metrics for the rest.
+        """
+
         return self._solve_time
 
     def add(self, expr):
         self._roots.append(expr)
-        self._cache(expr)
+        if self._forked or self._path_slicing != self.slicing:
+            self._invalidate()
+        elif self._path is not None:
+            self._path = self._path.extend(self._depth, [expr], self._symbols)
 
     def roots(self):
         r = []
@@ -81,161 +449,743 @@ class Solver(object):
             s = s._parent
         return r
 
-    def _cache(self, expr):
-        if expr not in self.smt2_cache:
-            self.smt2_cache[expr] = expr.smt2()
-        if expr not in self.symbol_cache:
-            self.symbol_cache[expr] = expr.symbols()
+    def _groups(self):
+        """The roots of each Solver up the fork() tree, outermost
+        first, skipping those without any constraints of their own.
+        """
+
+        groups = []
+        s = self
+        while s is not None:
+            if s._roots:
+                groups.append(s._roots)
+            s = s._parent
+        groups.reverse()
+        return groups
+
+    def _state(self):
+        """The PathCondition for this Solver, built from the nearest
+        ancestor that already has one.
+        """
+
+        slicing = self.slicing
+        chain = []
+        s = self
+        while s is not None and (s._path is None or s._path_slicing != slicing):
+            chain.append(s)
+            s = s._parent
+
+        if s is not None:
+            state = s._path
+        else:
+            state = PathCondition(slicing)
+
+        for s in reversed(chain):
+            if s._roots:
+                state = state.extend(s._depth, s._roots, self._symbols)
+            s._path, s._path_slicing = state, slicing
+        return state
+
+    def _clusters(self, expr=None, everything=False):
+        """Split the roots, and expr, into independent clusters which
+        share no symbols. Returns the PathCondition and a list of
+        (cluster, expr) pairs, where expr is None for clusters that expr
+        doesn't touch; the cluster containing expr comes first.
+
+        The clusters expr doesn't touch are left out once the path
+        condition is known to be satisfiable, unless everything is set.
+        """
+
+        state = self._state()
+        output = []
+        touched = []
+        if expr is not None:
+            touched = state.touched(self._symbols(expr))
+            cluster = Cluster()
+            for other in touched:
+                cluster = cluster.merge(other)
+            output.append((cluster, expr))
+
+        if everything or not state.feasible:
+            for cluster in state.all_clusters():
+                if not any(cluster is other for other in touched):
+                    output.append((cluster, None))
+
+        return state, output
+
+    def _symbols(self, expr):
+        return expr.symbols()
         
     def _hash(self, expr=None):
-        output = 0
-        
-        if expr:
-            output = hash(expr)
-        
-        for root in self.roots():
-            output += (101 * hash(root))
-            output &= 0xffffffffffffffff
-        
-        return abs(output)
+        output = self._state().hash
+        if expr is not None:
+            output += mix(expr.fingerprint)
+        return output & 0xffffffffffffffff
 
-    def _smt2(self, expr=None):
-        smt2 = ''
-        
-        expressions = self.roots()
+    def _key(self, cluster, expr=None):
+        output = cluster.hash
+        if expr is not None:
+            output += mix(expr.fingerprint)
+        return output & 0xffffffffffffffff
+
+    def _expressions(self, cluster=None, expr=None):
+        if cluster is None:
+            expressions = self.roots()
+        else:
+            expressions = list(cluster.roots())
         if expr is not None:
-            self._cache(expr)
             expressions.append(expr)
-    
-        symbols = set()
-        for e in expressions:
-            symbols.update(e.symbols())
-        
-        for symbol in symbols:
-            if isinstance(symbol, bl.Symbol):
-                smt2 += '(declare-fun {0} () Bool)\n'.format(symbol.name) 
-            elif isinstance(symbol, bv.Symbol):
-                smt2 += '(declare-fun {0} () (_ BitVec {1}))\n'.format(symbol.name, symbol.size)
-        
-        for e in expressions:
-            smt2 += '(assert {0})\n'.format(e.smt2())
-        
+        return expressions
+
+    def _remember(self, model):
+        for models in (self._models, self._recent_models):
+            for i, m in enumerate(models):
+                if m is model:
+                    del models[i]
+                    break
+            models.insert(0, model)
+            del models[self.reuse_models:]
+
+    def _reuse_model(self, expressions):
+        """A recently seen model, completed with defaults for any new
+        symbols, that satisfies all of expressions; or None.
+        """
+
+        if not self.reuse_models:
+            return None
+
+        tried = set()
+        for models in (self._models, list(self._recent_models)):
+            for m in models:
+                if id(m) in tried:
+                    continue
+                tried.add(id(m))
+                candidate = complete(m, expressions)
+                if satisfies(candidate, expressions):
+                    return candidate
+        return None
+
+    def _keys(self, expressions):
+        return tuple(sorted(set(e.fingerprint for e in expressions)))
+
+    def _looked_up(self, tier, started, hit):
+        """Record a lookup in one of the caches, started at the given
+        time.perf_counter(); the in-memory caches cost less than timing
+        them would, so they pass None and are only counted.
+        """
+
+        if started is not None:
+            self.metrics.observe('lookup.' + tier, time.perf_counter() - started)
+        self.metrics.count(('hit.' if hit else 'miss.') + tier)
+        if hit:
+            _tracked(tier)
+
+    def _smt2(self, cluster, expr=None, model=False):
+        smt2 = '(set-logic QF_BV)\n'
+        text, declared = cluster.smt2(self._symbols)
+        smt2 += text
+
+        if expr is not None:
+            symbols = [symbol for symbol in self._symbols(expr) if symbol.name not in declared]
+            smt2 += declarations(symbols)
+            smt2 += assertions([expr])
+
+        smt2 += '(check-sat)\n'
+        if model:
+            smt2 += '(get-model)\n'
         return smt2
     
-    def _call_solver(self, smt2, in_file, out_file):
+    def _get_backend(self):
+        if self._backend is not None:
+            return self._backend
+        elif self.backend is not None:
+            return self.backend
+        elif self.incremental:
+            return self._session_backend
+        return self._process_backend
+
+    def _limits(self, timeout=None, memory=None):
+        """The (timeout, memory) limits for a query, given those for a
+        single call.
+        """
+
+        if timeout is None:
+            timeout = self._timeout if self._timeout is not None else self.timeout
+        if memory is None:
+            memory = self._memory if self._memory is not None else self.memory
+        return timeout, memory
+
+    def _record(self, kind, expr, tiers, started, result, error, args):
+        if error is None:
+            status = _status(kind, result)
+        elif isinstance(error, SolverUnknown):
+            status = error.reason
+        else:
+            status = 'error'
+        self.recorder.record(kind, self._groups(), expr, status, result,
+                             time.perf_counter() - started, tiers, args)
+
+    def _recorded(self, kind, expr, function, args=None):
+        """function(), a call of kind about expr, logged by the recorder
+        if there is one (and this isn't part of a call already logged).
+        """
+
+        if self.recorder is None or _tiers.get() is not None:
+            return function()
+
+        tiers = []
+        token = _track(tiers)
+        started = time.perf_counter()
         try:
-            # we use disk as a persistent second level cache...
-            with open(out_file, 'r') as tmp:
-                output = tmp.read()
-                
-            global cache_hits
-            cache_hits += 1
-            
-        except:
-
-            global cache_misses
-            cache_misses += 1
-
-            started = time.time()
-            with open(in_file, 'w') as tmp:
-                tmp.write(smt2)
-            
-            command = 'z3 -smt2 {0} > {1}'.format(in_file, out_file)
-            subprocess.call(command, shell=True)
-
-            with open(out_file, 'r') as tmp:
-                output = tmp.read()
-
-            finished = time.time()
-            self._solve_time = finished - started
-
-            os.unlink(in_file)
-            #os.unlink(out_file)
-            
-        return output
-        
-    def _parse_model(self, results, expr=None):
-        output = dict()
-        
-        expressions = list(self.roots())
-        if expr is not None:
-            self._cache(expr)
-            expressions.append(expr)
-    
-        symbols = set()
+            result = function()
+        except SolverError as e:
+            self._record(kind, expr, tiers, started, None, e, args)
+            raise
+        finally:
+            _untrack(token)
+        self._record(kind, expr, tiers, started, result, None, args)
+        return result
+
+    async def _recorded_async(self, kind, expr, function):
+        """_recorded(), for a coroutine function."""
+
+        if self.recorder is None or _tiers.get() is not None:
+            return await function()
+
+        tiers = []
+        token = _track(tiers)
+        started = time.perf_counter()
+        try:
+            result = await function()
+        except SolverError as e:
+            self._record(kind, expr, tiers, started, None, e, None)
+            raise
+        finally:
+            _untrack(token)
+        self._record(kind, expr, tiers, started, result, None, None)
+        return result
+
+    def _query(self, key, kind, cluster, expr, model, limits):
+        """The backend and Query for a cluster and expr, and the
+        AdaptiveTimeout to tell how long it took, if there is one. The
+        last item is the (status, model) answer if it is already in the
+        persistent store, otherwise None.
+        """
+
+        timeout, memory = limits
+        adaptive = None
+        if isinstance(timeout, AdaptiveTimeout):
+            adaptive, timeout = timeout, timeout()
+
+        backend = self._get_backend()
+        groups = [roots for depth, roots in cluster.group_list()]
+        query = Query(groups, expr, model, lambda: self._smt2(cluster, expr, model), timeout, memory,
+                      self.metrics)
+
+        # we use disk as a persistent second level cache...
+        if self.store is not None and backend.persistent:
+            started = time.perf_counter()
+            output = self.store.get(kind, key)
+            self._looked_up('store', started, output is not None)
+            if output is not None:
+                return backend, query, adaptive, parse_output(output, query)
+
+        self._sending(query)
+        return backend, query, adaptive, None
+
+    def _sending(self, query):
+        """Record a query about to go to the backend."""
+
+        self.metrics.count('queries')
+        self.metrics.observe('query.nodes', node_count(query.exprs()))
+        _tracked('solver')
+
+    def _finished(self, status, started):
+        """Record how a query sent at the given time.time() went."""
+
+        self._solve_time = time.time() - started
+        self.metrics.observe('solve', self._solve_time)
+        self.metrics.count('result.' + status if status in _results else 'result.error')
+
+    def _answered(self, key, kind, backend, query, adaptive, started, answer):
+        """Note how long query took, and store its answer."""
+
+        status, result = answer
+        self._finished(status, started)
+        if adaptive is not None:
+            adaptive.record(self._solve_time, status)
+
+        if self.store is not None and backend.persistent and status in ('sat', 'unsat'):
+            output = status + '\n'
+            if result is not None:
+                output += format_model(result)
+            self.store.put(kind, key, output)
+
+        return answer
+
+    def _call_solver(self, key, kind, cluster, expr=None, model=False, limits=(None, None)):
+        """The (status, model) answer for a cluster and expr, from the
+        persistent store if it is there.
+        """
+
+        backend, query, adaptive, answer = self._query(key, kind, cluster, expr, model, limits)
+        if answer is not None:
+            return answer
+
+        with self._lock:
+            self._queries.add(query)
+        started = time.time()
+        try:
+            answer = backend.query(query)
+        finally:
+            with self._lock:
+                self._queries.discard(query)
+        return self._answered(key, kind, backend, query, adaptive, started, answer)
+
+    async def _call_solver_async(self, key, kind, cluster, expr=None, model=False, limits=(None, None)):
+        """_call_solver(), awaiting the backend."""
+
+        backend, query, adaptive, answer = self._query(key, kind, cluster, expr, model, limits)
+        if answer is not None:
+            return answer
+
+        with self._lock:
+            self._queries.add(query)
+        started = time.time()
+        try:
+            answer = await backend.query_async(query)
+        finally:
+            with self._lock:
+                self._queries.discard(query)
+        return self._answered(key, kind, backend, query, adaptive, started, answer)
+
+    def _complete_model(self, model, expressions):
+        """Fill in model with a value for every symbol in expressions
+        that the solver left out because its value doesn't matter.
+        """
+
         for e in expressions:
+            for symbol in self._symbols(e):
+                if symbol.name not in model:
+                    if isinstance(symbol, bv.Expression):
+                        model[symbol.name] = bv.Constant(symbol.size, 0x2323232323232323)
+                    else:
+                        model[symbol.name] = bl.Constant(True)
+        return model
 
-            symbols.update(e.symbols())
-        
-        for bl_match in self.bl_re.findall(results):
-            name = bl_match[0]
-            if bl_match[1] == 'true':
-                value = True
-            else:
-                value = False
-            output[name] = bl.Constant(value)
-        
-        for bv_match in self.bv_re.findall(results):
-            name = bv_match[0]
-            size = int(bv_match[1])
-            value = int('0x' + bv_match[2], 16)
-            output[name] = bv.Constant(size, value)
-        
-        for symbol in symbols:
-            if symbol.name not in output:
-                if isinstance(symbol, bv.Expression):
-                    output[symbol.name] = bv.Constant(symbol.size, 0x2323232323232323)
-                else:
-                    output[symbol.name] = bl.Constant(True)
-        
-        return output
-        
-    def check(self, expr=None):
+    def _check_cached(self, key, cluster, expr, feasible=None):
+        """The result for one cluster if it is already known, either
+        exactly, from the abstract domain or from the counterexample
+        cache, otherwise None. feasible is what is known of the whole
+        path condition.
+        """
+
+        result = self.cache.get(key)
+        self._looked_up('cache', None, result is not None)
+        if result is not None:
+            return result
+
+        if self.domain:
+            started = time.perf_counter()
+            result = self._check_domain(cluster, expr, feasible)
+            self._looked_up('domain', started, result is not None)
+            if result is not None:
+                self.cache[key] = result
+                return result
+
+        expressions = self._expressions(cluster, expr)
+        if self.counterexamples is not None:
+            started = time.perf_counter()
+            result = self.counterexamples.lookup(self._keys(expressions), expressions)
+            self._looked_up('counterexamples', started, result is not None)
+            if result is not None:
+                self.cache[key] = result
+                return result
+
+        started = time.perf_counter()
+        m = self._reuse_model(expressions)
+        if self.reuse_models:
+            self._looked_up('models', started, m is not None)
+        if m is not None:
+            self._remember(m)
+            self.cache[key] = True
+            if self.counterexamples is not None:
+                self.counterexamples.insert(self._keys(expressions), m)
+            return True
+
+        return None
+
+    def _check_domain(self, cluster, expr, feasible):
+        """The result for one cluster if what its roots force on the
+        values in them decides it, otherwise None.
+        """
+
+        facts = cluster.facts()
+        if facts.contradiction:
+            result = False
+        elif expr is None:
+            return None
+        else:
+            result = truth(expr, facts)
+            # expr holding wherever the roots do only helps if they can
+            if result and not (feasible or cluster.count == 0 or
+                               self.cache.get(self._key(cluster))):
+                return None
+            elif result is None:
+                return None
+
+        return result
+
+    def _check_results(self, key, cluster, expr, limits=(None, None)):
+        status, _ = self._call_solver(key, 'check', cluster, expr, limits=limits)
+        return self._check_answer(key, cluster, expr, status)
+
+    async def _check_results_async(self, key, cluster, expr, limits):
+        status, _ = await self._call_solver_async(key, 'check', cluster, expr, limits=limits)
+        return self._check_answer(key, cluster, expr, status)
+
+    def _check_answer(self, key, cluster, expr, status):
+        if status == 'sat':
+            result = True
+        elif status == 'unsat':
+            result = False
+        elif status in incomplete:
+            raise SolverUnknown(status)
+        else:
+            raise SolverError(status, self._smt2(cluster, expr))
+        self.cache[key] = result
+
+        if self.counterexamples is not None:
+            expressions = self._expressions(cluster, expr)
+            self.counterexamples.insert(self._keys(expressions), result)
+
+        return result
+
+    def check(self, expr=None, timeout=None, memory=None):
+        """True if the roots (and expr) are satisfiable, otherwise False;
+        raises SolverUnknown if the solver gives up (see status()).
+        """
+
+        if self.recorder is None:
+            return self._check(expr, timeout, memory)
+        return self._recorded('check', expr, lambda: self._check(expr, timeout, memory))
+
+    def _check(self, expr, timeout, memory):
         if expr is not None and not expr.symbolic:
             return expr.value
 
         #print 'check {}'.format(expr.smt2())
-        
-        smt2 = '(set-logic QF_BV)\n'
-        smt2 += self._smt2(expr)
-        smt2 += '(check-sat)\n'
-        
-        smt2_hash = string_hash(smt2)
-        if smt2_hash not in self.cache:
-            in_file = '/tmp/{0:016x}.check.smt2'.format(smt2_hash)
-            out_file = '/tmp/{0:016x}.check'.format(smt2_hash)
-            results = self._call_solver(smt2, in_file, out_file)
-            if results.startswith('sat'):
-                self.cache[smt2_hash] = True
-            elif results.startswith('unsat'):
-                self.cache[smt2_hash] = False
-            else:
-                raise SolverError(results.splitlines()[0], smt2)
+
+        state, clusters = self._clusters(expr)
+        if state.feasible is False:
+            return False
+
+        for cluster, cluster_expr in clusters:
+            key = self._key(cluster, cluster_expr)
+            result = self._check_cached(key, cluster, cluster_expr, state.feasible)
+            if result is None:
+                result = self._check_results(key, cluster, cluster_expr,
+                                             self._limits(timeout, memory))
+
+            if not result:
+                if cluster_expr is None:
+                    state.feasible = False
+                return False
+
+        # every cluster has now been seen to be satisfiable
+        state.feasible = True
+        return True
+
+    async def check_async(self, expr=None, timeout=None, memory=None):
+        """check() for asyncio code. Checks of the same cluster that are
+        in flight at once share one solver query.
+        """
+
+        return await self._recorded_async('check', expr, lambda: self._check_async(expr, timeout, memory))
+
+    async def _check_async(self, expr, timeout, memory):
+        if expr is not None and not expr.symbolic:
+            return expr.value
+
+        limits = self._limits(timeout, memory)
+        state, clusters = self._clusters(expr)
+        if state.feasible is False:
+            return False
+
+        for cluster, cluster_expr in clusters:
+            key = self._key(cluster, cluster_expr)
+            result = self._check_cached(key, cluster, cluster_expr, state.feasible)
+            if result is None:
+                result = await _coalesce(('check', key, limits), lambda: self._check_results_async(
+                    key, cluster, cluster_expr, limits))
+
+            if not result:
+                if cluster_expr is None:
+                    state.feasible = False
+                return False
+
+        state.feasible = True
+        return True
+
+    def status(self, expr=None, timeout=None, memory=None):
+        """check(), as Result.Sat, Result.Unsat or Result.Unknown when
+        the solver gives up.
+        """
+
+        try:
+            if self.check(expr, timeout, memory):
+                return Result.Sat
+            return Result.Unsat
+        except SolverUnknown:
+            return Result.Unknown
+
+    def check_many(self, exprs):
+        """check() each of exprs against this Solver in parallel; see
+        check_batch().
+        """
+
+        return check_batch([(self, expr) for expr in exprs])
+
+    def _model(self, cluster, expr, limits=(None, None)):
+        key = self._key(cluster, expr)
+        result = self._model_cached(key, cluster, expr)
+        if result is not _missing:
+            return result
+
+        status, result = self._call_solver(key, 'model', cluster, expr, model=True, limits=limits)
+        return self._model_answer(key, cluster, expr, status, result)
+
+    async def _model_async(self, key, cluster, expr, limits):
+        status, result = await self._call_solver_async(key, 'model', cluster, expr, model=True, limits=limits)
+        return self._model_answer(key, cluster, expr, status, result)
+
+    def _model_cached(self, key, cluster, expr):
+        """The model for one cluster if it is already known, None if
+        there isn't one, otherwise _missing.
+        """
+
+        result = self.model_cache.get(key, _missing)
+        self._looked_up('model_cache', None, result is not _missing)
+        if result is not _missing:
+            return result
+
+        expressions = self._expressions(cluster, expr)
+        keys = self._keys(expressions)
+        if self.counterexamples is not None:
+            started = time.perf_counter()
+            result = self.counterexamples.lookup(keys, expressions, model=True)
+            self._looked_up('counterexamples', started, result is not None)
+            if result is not None:
+                if result is False:
+                    result = None
+                self.model_cache[key] = result
+                return result
+
+        started = time.perf_counter()
+        result = self._reuse_model(expressions)
+        if self.reuse_models:
+            self._looked_up('models', started, result is not None)
+        if result is not None:
+            self.model_cache[key] = result
+            if self.counterexamples is not None:
+                self.counterexamples.insert(keys, result)
+            return result
+
+        return _missing
+
+    def _model_answer(self, key, cluster, expr, status, result):
+        expressions = self._expressions(cluster, expr)
+        keys = self._keys(expressions)
+        if status == 'sat':
+            result = self._complete_model(result if result is not None else Model(), expressions)
+        elif status == 'unsat':
+            result = None
+        elif status in incomplete:
+            raise SolverUnknown(status)
         else:
-            global cache_hits
-            cache_hits += 1
-            
-        return self.cache[smt2_hash]
-        
-    def model(self, expr=None):
-        smt2 = '(set-logic QF_BV)\n'
-        smt2 += self._smt2(expr)
-        smt2 += '(check-sat)\n'
-        smt2 += '(get-model)\n'
-        
-        smt2_hash = string_hash(smt2)
-        if smt2_hash not in self.model_cache:
-            in_file = '/tmp/{0:016x}.model.smt2'.format(smt2_hash)
-            out_file = '/tmp/{0:016x}.model'.format(smt2_hash)
-            results = self._call_solver(smt2, in_file, out_file)
-            if results.startswith('sat'):
-                self.model_cache[smt2_hash] = self._parse_model(results, expr)
-            elif results.startswith('unsat'):
-                self.model_cache[smt2_hash] = None
+            raise SolverError(status, self._smt2(cluster, expr, True))
+        self.model_cache[key] = result
+
+        if self.counterexamples is not None:
+            if result is None:
+                self.counterexamples.insert(keys, False)
             else:
-                raise SolverError(results.splitlines()[0], smt2)
-        else:
-            global cache_hits
-            cache_hits += 1
+                self.counterexamples.insert(keys, result)
         
-        return self.model_cache[smt2_hash]
\ No newline at end of file
+        return result
+
+    def model(self, expr=None, timeout=None, memory=None):
+        """A model of the roots (and expr), or None if there isn't one;
+        raises SolverUnknown if the solver gives up.
+        """
+
+        if self.recorder is None:
+            return self._model_of(expr, timeout, memory)
+        return self._recorded('model', expr, lambda: self._model_of(expr, timeout, memory))
+
+    def _model_of(self, expr, timeout, memory):
+        limits = self._limits(timeout, memory)
+        state, clusters = self._clusters(expr, everything=True)
+        if state.feasible is False:
+            return None
+
+        output = Model()
+        for cluster, cluster_expr in clusters:
+            m = self._model(cluster, cluster_expr, limits)
+            if m is None:
+                if cluster_expr is None:
+                    state.feasible = False
+                return None
+            self._remember(m)
+            output.include(m)
+
+        state.feasible = True
+        return output
+
+    def _call_search(self, key, kind, cluster, term, limit, limits):
+        """The values of term from the backend's kind of search, as a
+        tuple of ints, from the persistent store if they are there.
+        """
+
+        timeout, memory = limits
+        if isinstance(timeout, AdaptiveTimeout):
+            timeout = timeout()
+
+        backend = self._get_backend()
+        groups = [roots for depth, roots in cluster.group_list()]
+        query = Query(groups, None, False, None, timeout, memory, self.metrics)
+
+        persistent = self.store is not None and backend.persistent
+        if persistent:
+            started = time.perf_counter()
+            output = self.store.get(kind, key)
+            self._looked_up('store', started, output is not None)
+            if output is not None:
+                return tuple(int(value) for value in output.split()[1:])
+
+        self._sending(query)
+
+        with self._lock:
+            self._queries.add(query)
+        started = time.time()
+        try:
+            if kind == 'enumerate':
+                status, values = backend.enumerate(query, term, limit)
+            else:
+                status, value = getattr(backend, kind)(query, term)
+                values = [value]
+        finally:
+            with self._lock:
+                self._queries.discard(query)
+        self._finished(status, started)
+
+        if status == 'unsat':
+            values = ()
+        elif status in incomplete:
+            raise SolverUnknown(status)
+        elif status != 'sat':
+            raise SolverError(status, query.smt2())
+
+        values = tuple(values)
+        if persistent:
+            self.store.put(kind, key, status + '\n' + ' '.join(str(v) for v in values) + '\n')
+        return values
+
+    def _values(self, kind, expr, limit=None, signed=False, timeout=None, memory=None):
+        """The values of expr found by a search of kind ('minimize',
+        'maximize' or 'enumerate'), as a tuple of ints; empty if the
+        roots are unsatisfiable. The search only covers the cluster expr
+        is in, and the answer is cached like check()'s.
+        """
+
+        return self._recorded(kind, expr, lambda: self._search(kind, expr, limit, signed, timeout, memory),
+                              {'limit': limit, 'signed': signed})
+
+    def _search(self, kind, expr, limit, signed, timeout, memory):
+        if not self.check(timeout=timeout, memory=memory):
+            return ()
+
+        term = expr
+        if signed:
+            # flipping the sign bit puts signed values in unsigned order
+            term = expr ^ sign_bit(expr.size)
+
+        cluster = Cluster()
+        for other in self._state().touched(self._symbols(expr)):
+            cluster = cluster.merge(other)
+        key = self._key(cluster, term) + mix(string_hash('{0} {1}'.format(kind, limit)))
+        key &= 0xffffffffffffffff
+
+        values = self.cache.get(key, _missing)
+        self._looked_up('cache', None, values is not _missing)
+        if values is _missing:
+            values = self._call_search(key, kind, cluster, term, limit, self._limits(timeout, memory))
+            self.cache[key] = values
+
+        if signed:
+            values = tuple(value ^ sign_bit(expr.size) for value in values)
+        return values
+
+    def minimize(self, expr, signed=False, timeout=None, memory=None):
+        """The least value of the bitvector expr under the roots, as a
+        Constant, or None if they are unsatisfiable. Values are ordered
+        as unsigned unless signed is set.
+        """
+
+        if not expr.symbolic:
+            return expr
+        values = self._values('minimize', expr, None, signed, timeout, memory)
+        if not values:
+            return None
+        return bv.Constant(expr.size, values[0])
+
+    def maximize(self, expr, signed=False, timeout=None, memory=None):
+        """As minimize(), for the greatest value."""
+
+        if not expr.symbolic:
+            return expr
+        values = self._values('maximize', expr, None, signed, timeout, memory)
+        if not values:
+            return None
+        return bv.Constant(expr.size, values[0])
+
+    def enumerate(self, expr, limit, timeout=None, memory=None):
+        """Up to limit distinct values of the bitvector expr under the
+        roots, as Constants in (unsigned) order; all of them, if there
+        are fewer than limit.
+        """
+
+        if not expr.symbolic:
+            return [expr]
+        values = self._values('enumerate', expr, limit, False, timeout, memory)
+        return [bv.Constant(expr.size, value) for value in sorted(values)]
+
+    async def model_async(self, expr=None, timeout=None, memory=None):
+        """model() for asyncio code. Models of the same cluster that
+        are asked for at once share one solver query.
+        """
+
+        return await self._recorded_async('model', expr, lambda: self._model_of_async(expr, timeout, memory))
+
+    async def _model_of_async(self, expr, timeout, memory):
+        limits = self._limits(timeout, memory)
+        state, clusters = self._clusters(expr, everything=True)
+        if state.feasible is False:
+            return None
+
+        output = Model()
+        for cluster, cluster_expr in clusters:
+            key = self._key(cluster, cluster_expr)
+            m = self._model_cached(key, cluster, cluster_expr)
+            if m is _missing:
+                m = await _coalesce(('model', key, limits), lambda: self._model_async(
+                    key, cluster, cluster_expr, limits))
+            if m is None:
+                if cluster_expr is None:
+                    state.feasible = False
+                return None
+            self._remember(m)
+            output.include(m)
+
+        state.feasible = True
+        return output
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""smt.store
+
+A persistent second level cache of raw solver output, kept in a single
+indexed SQLite database instead of a file per query. Writes are
+batched, several processes can share one store (SQLite does the
+locking), and the store can be trimmed to a size budget by dropping
+the least recently used results.
+
+Answers in the store are trusted, so by default it lives in a
+directory only its user can write to (under $XDG_CACHE_HOME, or
+~/.cache), and a database owned by someone else is refused. Every key
+carries the format version, so results written by a version of this
+code that builds queries or keys differently are never read back.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from smt.utils import *
+
+
+# bumped whenever the query keys or the stored output change meaning
+version = 1
+
+
+def _default_path():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'smt', 'results.sqlite')
+
+
+def _key(kind, key):
+    return '{0}.{1}'.format(kind, version), to_signed(key, 64)
+
+
+class Store(object):
+
+    # the default location, unless SMT_STORE says otherwise
+    default_path = _default_path()
+
+    def __init__(self, path=None, max_bytes=None, batch=64, timeout=30.0):
+        if path is None:
+            path = os.environ.get('SMT_STORE', self.default_path)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch = batch
+        self.timeout = timeout
+
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        self._writes = dict()
+        self._reads = dict()
+        self._flushes = 0
+        atexit.register(self.close)
+
+    def _connect(self):
+        # connections can't be shared with a forked child, so each
+        # process opens its own.
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if hasattr(os, 'getuid'):
+            # makedirs leaves the mode of a directory that was already
+            # there, and anyone who can write to it can swap the file
+            status = os.stat(directory)
+            if status.st_uid != os.getuid() or status.st_mode & 0o022:
+                raise PermissionError('{0} can be written by another user'.format(directory))
+            if os.path.exists(self.path) and os.stat(self.path).st_uid != os.getuid():
+                raise PermissionError('{0} belongs to another user'.format(self.path))
+
+        connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('''CREATE TABLE IF NOT EXISTS results (
+            kind TEXT NOT NULL,
+            key INTEGER NOT NULL,
+            output BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (kind, key)) WITHOUT ROWID''')
+        connection.execute('''CREATE INDEX IF NOT EXISTS results_accessed
+            ON results (accessed)''')
+        connection.commit()
+
+        if self._pid is not None:
+            # a forked child leaves what its parent has pending to it
+            self._writes = dict()
+            self._reads = dict()
+        self._connection = connection
+        self._pid = os.getpid()
+        return connection
+
+    def get(self, kind, key):
+        """The stored output for key, or None."""
+
+        kind, key = _key(kind, key)
+        with self._lock:
+            if (kind, key) in self._writes:
+                return self._writes[(kind, key)]
+
+            row = self._connect().execute(
+                'SELECT output FROM results WHERE kind = ? AND key = ?',
+                (kind, key)).fetchone()
+            if row is None:
+                return None
+
+            # remember the access, written out with the next batch
+            self._reads[(kind, key)] = time.time()
+            return zlib.decompress(row[0]).decode('utf8')
+
+    def put(self, kind, key, output):
+        kind, key = _key(kind, key)
+        with self._lock:
+            self._writes[(kind, key)] = output
+            if len(self._writes) >= self.batch:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._writes and not self._reads:
+                return
+
+            connection = self._connect()
+            now = time.time()
+            rows = []
+            for (kind, key), output in self._writes.items():
+                data = zlib.compress(output.encode('utf8'))
+                rows.append((kind, key, data, len(data), now))
+
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', rows)
+                connection.executemany(
+                    'UPDATE results SET accessed = ? WHERE kind = ? AND key = ?',
+                    [(accessed, kind, key) for (kind, key), accessed in self._reads.items()])
+
+            self._writes = dict()
+            self._reads = dict()
+
+            self._flushes += 1
+            if self.max_bytes is not None and self._flushes % 16 == 0:
+                self.evict()
+
+    def size(self):
+        """The total size of the stored (compressed) outputs."""
+
+        with self._lock:
+            self.flush()
+            row = self._connect().execute('SELECT SUM(size) FROM results').fetchone()
+            return row[0] or 0
+
+    def evict(self, max_bytes=None):
+        """Drop the least recently used results until the store is
+        within max_bytes (by default, the store's own budget).
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if max_bytes is None:
+            return
+
+        with self._lock:
+            excess = self.size() - max_bytes
+            if excess <= 0:
+                return
+
+            connection = self._connect()
+            victims = []
+            for kind, key, size in connection.execute(
+                    'SELECT kind, key, size FROM results ORDER BY accessed'):
+                victims.append((kind, key))
+                excess -= size
+                if excess <= 0:
+                    break
+
+            with connection:
+                connection.executemany(
+                    'DELETE FROM results WHERE kind = ? AND key = ?', victims)
+
+    def compact(self):
+        """Apply the size budget and give the freed space back to the
+        filesystem.
+        """
+
+        with self._lock:
+            self.evict()
+            connection = self._connect()
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            connection.execute('VACUUM')
+
+    def clear(self):
+        with self._lock:
+            self._writes = dict()
+            self._reads = dict()
+            with self._connect() as connection:
+                connection.execute('DELETE FROM results')
+
+    def close(self):
+        with self._lock:
+            # a forked child leaves its parent's connection alone
+            if self._connection is not None and self._pid != os.getpid():
+                return
+            try:
+                self.flush()
+            finally:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
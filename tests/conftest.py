@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014 Mark Brand - c01db33f (at) gmail.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import importlib.util
+import os
+import random
+import sys
+
+# the checkout is the smt package itself, whatever its directory is
+# called, so it is imported under that name
+if 'smt' not in sys.modules:
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    _spec = importlib.util.spec_from_file_location(
+        'smt', os.path.join(_root, '__init__.py'), submodule_search_locations=[_root])
+    _module = importlib.util.module_from_spec(_spec)
+    sys.modules['smt'] = _module
+    _spec.loader.exec_module(_module)
+
+import pytest
+
+import smt.bitvector as bv
+import smt.boolean as bl
+from smt.enums import *
+
+
+_binary = [
+    lambda a, b: a + b,
+    lambda a, b: a - b,
+    lambda a, b: a * b,
+    lambda a, b: a // b,
+    lambda a, b: a % b,
+    lambda a, b: a.signed_divide(b),
+    lambda a, b: a.signed_remainder(b),
+    lambda a, b: a.signed_modulo(b),
+    lambda a, b: a << b,
+    lambda a, b: a >> b,
+    lambda a, b: a.arithmetic_shift_right(b),
+    lambda a, b: a.rotate_left(b),
+    lambda a, b: a.rotate_right(b),
+    lambda a, b: a & b,
+    lambda a, b: a | b,
+    lambda a, b: a ^ b,
+]
+
+_compare = [
+    lambda a, b: a == b,
+    lambda a, b: a != b,
+    lambda a, b: a < b,
+    lambda a, b: a <= b,
+    lambda a, b: a > b,
+    lambda a, b: a >= b,
+    lambda a, b: a.signed_less_than(b),
+    lambda a, b: a.signed_less_than_or_equal(b),
+    lambda a, b: a.signed_greater_than(b),
+    lambda a, b: a.signed_greater_than_or_equal(b),
+]
+
+
+class Generator(object):
+    """Random expressions over a few symbols, for checking everything
+    that claims to agree with evaluate().
+    """
+
+    def __init__(self, seed, sizes=(8,), names=('a', 'b', 'c')):
+        self.r = random.Random(seed)
+        self.sizes = sizes
+        self.names = names
+
+    def symbol(self, size):
+        return bv.Symbol(size, '{0}{1}'.format(self.r.choice(self.names), size))
+
+    def constant(self, size):
+        r = self.r
+        return bv.Constant(size, r.choice([0, 1, 2, size - 1, size, r.getrandbits(size),
+                                           (1 << size) - 1, 1 << (size - 1)]))
+
+    def bitvector(self, size, depth=3):
+        r = self.r
+        if depth <= 0 or r.random() < 0.2:
+            return self.symbol(size) if r.random() < 0.7 else self.constant(size)
+
+        choice = r.randrange(8)
+        if choice < 4:
+            lhs = self.bitvector(size, depth - 1)
+            rhs = self.bitvector(size, depth - 1) if r.random() < 0.7 else self.constant(size)
+            return r.choice(_binary)(lhs, rhs)
+        elif choice == 4:
+            return -self.bitvector(size, depth - 1)
+        elif choice == 5:
+            wider = self.bitvector(size * 2, depth - 1)
+            start = r.randrange(size + 1)
+            return wider.extract(start=start, end=start + size)
+        elif choice == 6 and size >= 16:
+            half = size // 2
+            if r.random() < 0.5:
+                return self.bitvector(half, depth - 1).concatenate(self.bitvector(half, depth - 1))
+            narrow = self.bitvector(half, depth - 1)
+            return narrow.sign_extend_to(size) if r.random() < 0.5 else narrow.zero_extend_to(size)
+        return bv.if_then_else(self.boolean(depth - 1), self.bitvector(size, depth - 1),
+                               self.bitvector(size, depth - 1))
+
+    def boolean(self, depth=3):
+        r = self.r
+        if depth <= 0 or r.random() < 0.6:
+            size = r.choice(self.sizes)
+            rhs = self.bitvector(size, depth - 1) if r.random() < 0.5 else self.constant(size)
+            return r.choice(_compare)(self.bitvector(size, max(depth - 1, 0)), rhs)
+
+        choice = r.randrange(3)
+        if choice == 0:
+            return bl.UnaryOperation(UnaryOperator.Not, self.boolean(depth - 1))
+        op = r.choice([BinaryOperator.And, BinaryOperator.Or])
+        return bl.BinaryOperation(self.boolean(depth - 1), op, self.boolean(depth - 1))
+
+    def assignment(self, exprs):
+        """Random values for the symbols in exprs, by name."""
+
+        output = dict()
+        for e in exprs:
+            for symbol in e.symbols():
+                if symbol.name not in output:
+                    output[symbol.name] = self.value(symbol.size)
+        return output
+
+    def value(self, size):
+        r = self.r
+        return r.choice([0, 1, (1 << size) - 1, 1 << (size - 1), r.getrandbits(size)])
+
+
+@pytest.fixture
+def generator():
+    return Generator
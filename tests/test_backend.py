@@ -0,0 +1,50 @@
+import threading
+import time
+
+import smt.bitvector as bv
+from smt.backend import Backend, FakeBackend, PortfolioBackend, Query
+
+
+class _Stuck(Backend):
+    """Works on every query until it is cancelled."""
+
+    persistent = False
+
+    def __init__(self):
+        self.started = threading.Event()
+
+    def query(self, query):
+        self.started.set()
+        while not query.cancelled:
+            time.sleep(0.005)
+        return 'cancelled', None
+
+
+def _query():
+    x = bv.Symbol(8, 'x')
+    return Query([[x + 1 == 5]], None, True)
+
+
+def test_portfolio_takes_first_answer():
+    stuck = _Stuck()
+    portfolio = PortfolioBackend([stuck, FakeBackend()])
+    status, model = portfolio.query(_query())
+    assert status == 'sat'
+    assert model['x'].value == 4
+    portfolio.close()
+    assert all(not thread.is_alive() for thread in portfolio._pool._threads)
+
+
+def test_portfolio_close_stops_running_queries():
+    portfolio = PortfolioBackend([_Stuck(), _Stuck()])
+    answers = []
+    thread = threading.Thread(target=lambda: answers.append(portfolio.query(_query())))
+    thread.start()
+    for member in portfolio.members:
+        assert member.started.wait(5)
+
+    portfolio.close()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert answers == [('cancelled', None)]
+    assert all(not t.is_alive() for t in portfolio._pool._threads)
@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+import smt.benchmark
+from smt.solver import Solver
+
+
+@pytest.mark.parametrize('name', sorted(smt.benchmark.workloads))
+def test_workload(name):
+    cache = Solver.cache
+    result = smt.benchmark.run_workload(name, repeat=1)
+    assert Solver.cache is cache
+    assert set(result['times']) == set(['construct', 'smt2', 'fingerprint', 'symbols',
+                                        'solve_cold', 'solve_warm'])
+    assert result['nodes'] > 0
+    # the second solve is answered from what the first cached
+    assert 'queries' not in result['cache']['warm']
+
+
+def test_compare(tmp_path):
+    results = smt.benchmark.run(['memory'], repeat=1)
+    path = tmp_path / 'results.json'
+    path.write_text(json.dumps(results))
+    assert smt.benchmark.main(['--compare', str(path), str(path)]) == 0
+    for name, stage, before, after, ratio in smt.benchmark.compare(results, results):
+        assert ratio in (1.0, None)
@@ -0,0 +1,113 @@
+import itertools
+import random
+import threading
+
+import smt.bitvector as bv
+from smt.counterexample import CounterexampleCache, satisfies
+
+
+def _sets(r, universe, count):
+    return [tuple(sorted(r.sample(universe, r.randrange(len(universe) + 1)))) for _ in range(count)]
+
+
+def test_subsets_and_supersets_match_brute_force():
+    r = random.Random(0)
+    universe = list(range(8))
+    cache = CounterexampleCache()
+    stored = dict()
+    for keys in _sets(r, universe, 60):
+        value = {'n': len(stored)}
+        cache.insert(keys, value)
+        stored[keys] = value
+
+    for keys in _sets(r, universe, 100):
+        subsets = [v for k, v in stored.items() if set(k) <= set(keys)]
+        supersets = [v for k, v in stored.items() if set(k) >= set(keys)]
+        assert sorted(v['n'] for v in cache.subsets(keys)) == sorted(v['n'] for v in subsets)
+        assert sorted(v['n'] for v in cache.supersets(keys)) == sorted(v['n'] for v in supersets)
+
+
+def test_lookup_is_sound(generator):
+    # one 8-bit symbol, so every set of constraints can be decided by
+    # trying all of its values
+    g = generator(1, sizes=(8,), names=('x',))
+    constraints = []
+    while len(constraints) < 12:
+        e = g.boolean(2)
+        if [s.name for s in e.symbols()] == ['x8']:
+            constraints.append(e)
+
+    def solve(exprs):
+        for value in range(256):
+            model = {'x8': bv.Constant(8, value)}
+            if satisfies(model, exprs):
+                return model
+        return False
+
+    r = random.Random(2)
+    cache = CounterexampleCache()
+    for _ in range(200):
+        exprs = r.sample(constraints, r.randrange(1, 5))
+        keys = tuple(sorted(set(e.fingerprint for e in exprs)))
+        truth = solve(exprs)
+        for model in (False, True):
+            answer = cache.lookup(keys, exprs, model)
+            if answer is False:
+                assert truth is False
+            elif answer is not None:
+                assert truth is not False
+                if model:
+                    assert satisfies(answer, exprs)
+        cache.insert(keys, truth)
+
+
+def test_bounded():
+    cache = CounterexampleCache(max_entries=100)
+    for keys in itertools.combinations(range(20), 3):
+        cache.insert(keys, False)
+    assert len(cache) == 100
+    # the oldest went first, and took their nodes with them
+    assert cache.subsets((0, 1, 2)) == []
+    assert cache.supersets((17, 18, 19)) == [False]
+    nodes = 0
+    stack = [cache._root]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        stack.extend(node.children.values())
+    assert nodes <= 1 + 3 * 100
+
+
+def test_superset_search_is_bounded():
+    cache = CounterexampleCache(max_visits=50)
+    for i in range(1000):
+        cache.insert((0, i + 1), True)
+    assert len(cache.supersets(())) == 50
+    assert len(cache.supersets((0,))) == 50
+    assert cache.supersets((0, 5)) == [True]
+    assert cache.supersets((0, 5000)) == []
+
+
+def test_threads():
+    cache = CounterexampleCache(max_entries=500)
+    errors = []
+
+    def work(seed):
+        r = random.Random(seed)
+        try:
+            for _ in range(3000):
+                keys = tuple(sorted(r.sample(range(40), r.randrange(1, 5))))
+                if r.random() < 0.5:
+                    cache.insert(keys, r.choice([False, True, {'x': 1}]))
+                else:
+                    cache.subsets(keys)
+                    cache.supersets(keys)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
@@ -0,0 +1,68 @@
+import pytest
+
+import smt.bitvector as bv
+import smt.domain
+from smt.utils import to_signed
+
+
+def _holds(value, concrete, size):
+    return (concrete & value.zeros == 0 and concrete & value.ones == value.ones and
+            value.low <= concrete <= value.high and
+            value.slow <= to_signed(concrete, size) <= value.shigh)
+
+
+def _assignments(g, exprs):
+    # every value of the 8-bit symbol, and random ones for any wider
+    # symbols that extractions brought in
+    output = []
+    for value in range(256):
+        a = g.assignment(exprs)
+        a['a8'] = value
+        output.append(a)
+    return output
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_values_hold(generator, seed):
+    g = generator(seed, names=('a',))
+    for _ in range(100):
+        expr = g.bitvector(8, 4)
+        assignments = _assignments(g, [expr])
+        value = smt.domain._evaluate(expr, None, dict())
+        for a in assignments:
+            assert _holds(value, expr.evaluate(a), 8), (expr.smt2(), value, a)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_truth_holds(generator, seed):
+    g = generator(seed, names=('a',))
+    for _ in range(100):
+        expr = g.boolean(3)
+        assignments = _assignments(g, [expr])
+        known = smt.domain.truth(expr)
+        if known is not None:
+            assert all(expr.evaluate(a) == known for a in assignments), expr.smt2()
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_narrow_holds(generator, seed):
+    # whatever narrow() takes from the roots must hold wherever they do
+    g = generator(seed, names=('a',))
+    for _ in range(20):
+        roots = [g.boolean(2) for _ in range(3)]
+        exprs = [g.boolean(3) for _ in range(5)] + [g.bitvector(8, 3) for _ in range(5)]
+        assignments = _assignments(g, roots + exprs)
+        facts = smt.domain.narrow(None, roots)
+        models = [a for a in assignments if all(r.evaluate(a) for r in roots)]
+        if not models:
+            continue
+
+        assert not facts.contradiction, [r.smt2() for r in roots]
+        for expr in exprs:
+            if isinstance(expr, bv.Expression):
+                value = smt.domain._evaluate(expr, facts, dict())
+                assert all(_holds(value, expr.evaluate(a), 8) for a in models), expr.smt2()
+            else:
+                known = smt.domain.truth(expr, facts)
+                if known is not None:
+                    assert all(expr.evaluate(a) == known for a in models), expr.smt2()
@@ -0,0 +1,57 @@
+import pytest
+
+import smt.bitvector as bv
+import smt.utils
+
+
+def _batch(generator, exprs, count):
+    names = dict()
+    for e in exprs:
+        for symbol in e.symbols():
+            names[symbol.name] = symbol.size
+    assignments = [generator.assignment(exprs) for _ in range(count)]
+    # plain lists of python ints, as documented
+    arrays = dict((name, [a[name] for a in assignments]) for name in names)
+    return assignments, arrays
+
+
+@pytest.mark.parametrize('size', [8, 16, 32, 64, 128])
+def test_batch_matches_evaluate(generator, size):
+    g = generator(size, sizes=(size,))
+    for _ in range(200):
+        expr = g.bitvector(size)
+        if not expr.symbols():
+            continue
+        assignments, arrays = _batch(g, [expr], 16)
+        output = expr.evaluate_batch(arrays)
+        assert [int(v) for v in output] == [expr.evaluate(a) for a in assignments], expr.smt2()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_batch_matches_evaluate_boolean(generator, seed):
+    g = generator(seed, sizes=(8, 16, 64))
+    for _ in range(200):
+        expr = g.boolean()
+        if not expr.symbols():
+            continue
+        assignments, arrays = _batch(g, [expr], 16)
+        output = expr.evaluate_batch(arrays)
+        assert [bool(v) for v in output] == [expr.evaluate(a) for a in assignments], expr.smt2()
+
+
+def test_batch_of_wide_list_is_exact():
+    a = bv.Symbol(64, 'a')
+    values = [13126905008247241882, 5]
+    output = (-a).evaluate_batch({'a': values})
+    assert [int(v) for v in output] == [(-v) % (1 << 64) for v in values]
+
+
+def test_batch_without_numpy(generator, monkeypatch):
+    monkeypatch.setattr(smt.utils, 'numpy', None)
+    g = generator(7, sizes=(64,))
+    for _ in range(50):
+        expr = g.bitvector(64)
+        if not expr.symbols():
+            continue
+        assignments, arrays = _batch(g, [expr], 4)
+        assert list(expr.evaluate_batch(arrays)) == [expr.evaluate(a) for a in assignments]
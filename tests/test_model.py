@@ -0,0 +1,69 @@
+import sys
+import threading
+
+import smt.bitvector as bv
+import smt.boolean as bl
+from smt.model import Model, format_model, parse_model
+
+
+def _model(count):
+    values = dict()
+    for i in range(count):
+        values['v{0}'.format(i)] = bv.Constant(64, (i * 0x9e3779b97f4a7c15) & 0xffffffffffffffff)
+    values['flag'] = bl.Constant(True)
+    return values
+
+
+def test_round_trip():
+    values = _model(20)
+    model = parse_model([format_model(values)])
+    assert sorted(model) == sorted(values)
+    for name, value in values.items():
+        assert model[name].value == value.value
+    # and again, with some of them converted
+    assert parse_model([format_model(model)])['v3'].value == values['v3'].value
+
+
+def test_concurrent_lookups():
+    # switch threads as often as possible, to make races likely
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        _concurrent_lookups()
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def _concurrent_lookups():
+    values = _model(200)
+    text = format_model(values)
+    errors = []
+
+    for _ in range(50):
+        model = parse_model([text])
+        barrier = threading.Barrier(4)
+
+        def read():
+            try:
+                barrier.wait()
+                for name in values:
+                    assert model[name].value == values[name].value
+                assert len(model) == len(values)
+                format_model(model)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert errors == []
+
+
+def test_include():
+    model = Model()
+    model.include(parse_model([format_model(_model(3))]))
+    model['v1'] = bv.Constant(64, 7)
+    assert model['v1'].value == 7
+    assert len(model) == 4
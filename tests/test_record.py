@@ -0,0 +1,68 @@
+import gzip
+
+import smt.bitvector as bv
+import smt.record
+from smt.backend import FakeBackend
+from smt.solver import Solver
+
+
+def test_encode_decode(generator):
+    g = generator(5, sizes=(8, 16))
+    exprs = [g.boolean(4) for _ in range(20)] + [g.bitvector(16, 4) for _ in range(20)]
+    nodes, indices = smt.record.encode(exprs)
+    decoded = smt.record.decode(nodes)
+    assert [decoded[i].fingerprint for i in indices] == [e.fingerprint for e in exprs]
+
+    # a second batch against the same index only adds what is new
+    index = dict()
+    first, _ = smt.record.encode(exprs[:10], index)
+    more, indices = smt.record.encode(exprs, index)
+    decoded = smt.record.decode(first + more)
+    assert len(first) + len(more) == len(index)
+    assert [decoded[i].fingerprint for i in indices] == [e.fingerprint for e in exprs]
+
+
+def _run(path, **options):
+    recorder = smt.record.Recorder(str(path), **options)
+    with Solver.configured(fresh=True, backend=FakeBackend(), store=None, recorder=recorder):
+        x = bv.Symbol(8, 'x')
+        s = Solver()
+        s.add(x > 10)
+        s.check()
+        for i in range(20):
+            s, _ = s.fork()
+            s.add(x * 3 != i)
+            s.check(x == i)
+            s.model()
+        s.minimize(x * 3)
+        s.enumerate(x, 3)
+    recorder.close()
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'log.gz'
+    recorder = _run(path)
+    entries = list(smt.record.read(str(path)))
+    assert len(entries) == recorder.recorded == 43
+    assert entries[-1]['kind'] == 'enumerate'
+    assert len(entries[-1]['groups']) == 21
+
+    cache = Solver.cache
+    report = smt.record.replay(str(path), FakeBackend())
+    assert Solver.cache is cache
+    assert report['queries'] == 43
+    assert report['mismatches'] == []
+
+
+def test_log_is_linear(tmp_path):
+    # each entry down a fork chain only adds the new root
+    path = tmp_path / 'log.gz'
+    _run(path)
+    with gzip.open(str(path), 'rt') as f:
+        sizes = [len(line) for line in f]
+    assert max(sizes[-20:]) < 2 * max(sizes[1:20])
+
+    path = tmp_path / 'smt2.gz'
+    _run(path, smt2=True)
+    assert all(entry['smt2'] for entry in smt.record.read(str(path)))
@@ -0,0 +1,32 @@
+import sys
+
+import smt.bitvector as bv
+from smt.session import Session
+
+
+# stands in for z3: answers sat to every check and echoes the sentinel
+_solver = '''
+import sys
+for line in sys.stdin:
+    line = line.strip()
+    if line == '(check-sat)':
+        print('sat')
+    elif line.startswith('(echo'):
+        print(line[7:-2])
+    sys.stdout.flush()
+'''
+
+
+def test_definitions_are_bounded():
+    session = Session([sys.executable, '-c', _solver])
+    session.max_definitions = 64
+    try:
+        x = bv.Symbol(8, 'x')
+        for i in range(500):
+            shared = x * (i + 2) + i
+            assert session.query([[shared * shared != shared]]).startswith('sat')
+            assert len(session._defined) <= session.max_definitions + 1
+        # the process was reset along the way, and still answers
+        assert session.query([[x != 1]], x == 2).startswith('sat')
+    finally:
+        session.close()
@@ -0,0 +1,40 @@
+import pytest
+
+import smt.simplify
+
+
+def _check(g, original, simplified):
+    for _ in range(32):
+        assignment = g.assignment([original])
+        assert simplified.evaluate(assignment) == original.evaluate(assignment), \
+            (original.smt2(), simplified.smt2())
+
+
+@pytest.mark.parametrize('size', [8, 16])
+def test_simplify_keeps_value(generator, size):
+    g = generator(size, sizes=(size,))
+    smt.simplify.reset_stats()
+    for _ in range(300):
+        expr = g.bitvector(size, 4)
+        _check(g, expr, smt.simplify.simplify(expr))
+        expr = g.boolean(3)
+        _check(g, expr, smt.simplify.simplify(expr))
+    # and the rules were actually exercised
+    assert sum(smt.simplify.stats().values()) > 100
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_simplify_on_construction(generator, seed):
+    # the same expressions built with and without rewriting as they go
+    g = generator(seed, sizes=(8, 16))
+    plain = [g.boolean(4) for _ in range(200)]
+    smt.simplify.set_simplify(True)
+    try:
+        g = generator(seed, sizes=(8, 16))
+        simplified = [g.boolean(4) for _ in range(200)]
+    finally:
+        smt.simplify.set_simplify(False)
+
+    g = generator(seed + 100, sizes=(8, 16))
+    for original, output in zip(plain, simplified):
+        _check(g, original, output)
@@ -0,0 +1,69 @@
+import pytest
+
+import smt.bitvector as bv
+from smt.backend import FakeBackend
+from smt.solver import Solver
+
+
+def test_configured_restores_settings():
+    cache, backend = Solver.cache, Solver.backend
+    with Solver.configured(fresh=True, backend=FakeBackend(), store=None):
+        assert Solver.cache is not cache
+        assert len(Solver.cache) == 0
+        assert Solver.cache.max_entries == cache.max_entries
+        s = Solver()
+        x = bv.Symbol(8, 'x')
+        s.add(x * 3 == 9)
+        # forks see the settings too
+        a, _ = s.fork()
+        assert a.model()['x'].value * 3 % 256 == 9
+    assert Solver.cache is cache
+    assert Solver.backend is backend
+
+
+def test_configured_rejects_unknown_settings():
+    with pytest.raises(AttributeError):
+        with Solver.configured(cahce=None):
+            pass
+
+
+def _chain(s, x, depth):
+    for i in range(depth):
+        s, _ = s.fork()
+        s.add(x != i)
+    return s
+
+
+def test_invalidation_is_local():
+    with Solver.configured(fresh=True, backend=FakeBackend(), store=None):
+        x = bv.Symbol(8, 'x')
+        root = Solver()
+        a, b = root.fork()
+        deep_a = _chain(a, x, 50)
+        deep_b = _chain(b, x, 50)
+        assert deep_a.check() and deep_b.check()
+        kept = deep_b._state()
+
+        # a change to a forked node only touches the Solvers below it
+        a.add(x == 3)
+        assert deep_b._state() is kept
+        assert deep_a._path is None
+        assert not deep_a.check()
+        assert deep_b.check()
+
+        root.add(x == 60)
+        assert deep_b._path is None
+        assert deep_b.check()
+        assert not deep_b.check(x == 61)
+
+
+def test_cache_hits_are_counted_not_timed():
+    with Solver.configured(fresh=True, backend=FakeBackend(), store=None):
+        x = bv.Symbol(8, 'x')
+        s = Solver()
+        s.add(x > 3)
+        assert s.check(x == 9)
+        assert s.check(x == 9)
+        snapshot = s.metrics.snapshot()
+        assert snapshot['counters']['hit.cache'] >= 1
+        assert 'lookup.cache' not in snapshot['histograms']
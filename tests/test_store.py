@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import smt.store
+from smt.store import Store
+
+
+def test_round_trip(tmp_path):
+    store = Store(str(tmp_path / 'results.sqlite'), batch=2)
+    store.put('check', 1, 'sat\n')
+    store.put('check', (1 << 64) - 1, 'unsat\n')
+    store.put('model', 1, 'sat\n()\n')
+    store.close()
+
+    store = Store(str(tmp_path / 'results.sqlite'))
+    assert store.get('check', 1) == 'sat\n'
+    assert store.get('check', (1 << 64) - 1) == 'unsat\n'
+    assert store.get('model', 1) == 'sat\n()\n'
+    assert store.get('model', 2) is None
+    store.close()
+
+
+def test_versioned(tmp_path, monkeypatch):
+    store = Store(str(tmp_path / 'results.sqlite'))
+    store.put('check', 1, 'sat\n')
+    store.close()
+
+    monkeypatch.setattr(smt.store, 'version', smt.store.version + 1)
+    store = Store(str(tmp_path / 'results.sqlite'))
+    assert store.get('check', 1) is None
+    store.close()
+
+
+def test_default_is_private(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    path = smt.store._default_path()
+    assert path.startswith(str(tmp_path))
+
+    store = Store(path)
+    store.put('check', 1, 'sat\n')
+    store.close()
+    assert os.stat(os.path.dirname(path)).st_mode & 0o077 == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='no owners to check')
+def test_refuses_shared_directory(tmp_path):
+    directory = tmp_path / 'smt'
+    directory.mkdir()
+    os.chmod(str(directory), 0o777)
+    with pytest.raises(PermissionError):
+        Store(str(directory / 'results.sqlite')).get('check', 1)
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid') or os.getuid() != 0, reason='needs to chown')
+def test_refuses_another_users_store(tmp_path):
+    path = tmp_path / 'results.sqlite'
+    path.write_bytes(b'')
+    os.chown(str(path), 12345, 12345)
+    with pytest.raises(PermissionError):
+        Store(str(path)).get('check', 1)
@@ -32,13 +32,23 @@ except:
             output &= 0xffffffffffffffff
         return output
 
+try:
+    import numpy
+except:
+    numpy = None
+
 try:
     from termcolor import colored
 except:
     def colored(*args):
         return args[0]
 
+import functools
+import hashlib
+import itertools
 import re
+import threading
+import weakref
 
 
 def carry_bit(size):
@@ -57,6 +67,16 @@ def sign_bit(size):
     return 1 << (size - 1)
 
 
+def to_signed(value, size):
+    """Interpret the unsigned value of bit-size 'size' as two's
+    complement.
+    """
+
+    if value & sign_bit(size):
+        return value - carry_bit(size)
+    return value
+
+
 def mask(size):
     """The basic bitmask to extract the value of bit-size 'size'."""
 
@@ -73,7 +93,345 @@ def mask(size):
 
     raise ValueError(size)
 
-    
+
+def _postorder(expr, function, known=None):
+    """Compute function(e, child_values) for every node e of the DAG
+    under expr, children first, without recursing so deep expressions
+    are fine. Shared subexpressions are only visited once, and each
+    value is dropped as soon as the last node using it has been done.
+
+    If known(e) returns anything other than None, that is used as the
+    value for e and nothing below it is visited.
+    """
+
+    # order the nodes children first, counting the uses of each so
+    # values can be freed early
+    uses = {id(expr): 1}
+    visited = set()
+    order = []
+    stack = [(expr, False)]
+    while stack:
+        e, expanded = stack.pop()
+        if expanded:
+            order.append(e)
+            continue
+        elif id(e) in visited:
+            continue
+
+        visited.add(id(e))
+        stack.append((e, True))
+        if known is not None and known(e) is not None:
+            continue
+        for c in e.children():
+            uses[id(c)] = uses.get(id(c), 0) + 1
+            if id(c) not in visited:
+                stack.append((c, False))
+
+    values = dict()
+    for e in order:
+        value = None
+        if known is not None:
+            value = known(e)
+        if value is None:
+            nodes = e.children()
+            value = function(e, [values[id(c)] for c in nodes])
+            for c in nodes:
+                uses[id(c)] -= 1
+                if uses[id(c)] == 0:
+                    del values[id(c)]
+        values[id(e)] = value
+
+    return values[id(expr)]
+
+
+def render_expression(expr, defined=None):
+    """The fully expanded SMT2 text of expr (see serialise() for text
+    that shares common subterms), reusing any text already cached on
+    the nodes below it. With defined (as for serialise()), subterms
+    below expr that are in it are written as the names they were
+    defined with instead.
+
+    The text is written out front to back in pieces and joined once,
+    as nesting the text of each child inside its parent's would copy
+    it once for every level above it.
+    """
+
+    hole = '\x00'
+    pieces = []
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if isinstance(e, str):
+            pieces.append(e)
+            continue
+        elif defined is not None and e is not expr and id(e) in defined:
+            pieces.append(defined[id(e)][1])
+            continue
+        elif defined is None and e.smt2_cache is not None:
+            pieces.append(e.smt2_cache)
+            continue
+
+        nodes = e.children()
+        if not nodes:
+            if e.smt2_cache is None:
+                e.smt2_cache = e._smt2()
+            pieces.append(e.smt2_cache)
+            continue
+
+        # the text around each child, from formatting with placeholders
+        text = e._format([hole] * len(nodes)).split(hole)
+        stack.append(text[-1])
+        for node, before in reversed(list(zip(nodes, text))):
+            stack.append(node)
+            stack.append(before)
+
+    return ''.join(pieces)
+
+
+def expression_symbols(expr):
+    """The frozenset of symbols used in expr, which is also cached on
+    each node below it on the way.
+    """
+
+    def collect(e, values):
+        if not values:
+            return e.symbols()
+
+        # share the largest child set where nothing is added to it
+        output = max(values, key=len)
+        for value in values:
+            if not value <= output:
+                output = output | value
+        e.symbols_cache = output
+        return output
+
+    return _postorder(expr, collect, lambda e: e.symbols_cache)
+
+
+def node_count(exprs):
+    """How many distinct nodes there are in the DAGs under exprs."""
+
+    seen = set()
+    stack = list(exprs)
+    while stack:
+        e = stack.pop()
+        if id(e) in seen:
+            continue
+        seen.add(id(e))
+        stack.extend(e.children())
+    return len(seen)
+
+
+def evaluate_expression(expr, assignment):
+    """Evaluate expr concretely under assignment, a mapping from symbol
+    names to values.
+    """
+
+    return _postorder(expr, lambda e, values: e._evaluate(assignment, values))
+
+
+def evaluate_expression_batch(expr, assignment):
+    """Evaluate expr once for each index into the equal length arrays
+    of values in assignment, which maps symbols (or their names) to
+    arrays. Without numpy this falls back to evaluating each index in
+    turn and returns a list.
+    """
+
+    arrays = dict()
+    count = 1
+    for symbol, values in assignment.items():
+        arrays[getattr(symbol, 'name', symbol)] = values
+        count = len(values)
+
+    if numpy is None:
+        output = []
+        for i in range(count):
+            values = dict((name, arrays[name][i]) for name in arrays)
+            output.append(evaluate_expression(expr, values))
+        return output
+
+    return _postorder(expr, lambda e, values: e._evaluate_batch(arrays, values, count))
+
+
+_definitions = itertools.count()
+
+
+def serialise(exprs, defined=None):
+    """SMT2 for exprs whose size is linear in the number of distinct
+    nodes in their DAG: every compound subterm used more than once is
+    written out once as a define-fun and then referred to by name.
+    Returns a list of definitions and a term for each of exprs.
+
+    defined maps id() to (expr, name) for subterms already defined by
+    an earlier call, and has the new definitions added to it.
+    """
+
+    if defined is None:
+        defined = dict()
+
+    uses = dict()
+    stack = []
+    for e in exprs:
+        if id(e) in uses:
+            uses[id(e)] += 1
+        else:
+            uses[id(e)] = 1
+            stack.append(e)
+    while stack:
+        e = stack.pop()
+        if id(e) in defined:
+            continue
+        for c in e.children():
+            if id(c) in uses:
+                uses[id(c)] += 1
+            else:
+                uses[id(c)] = 1
+                stack.append(c)
+
+    # define the shared subterms children first
+    definitions = []
+    visited = set()
+    stack = [(e, False) for e in reversed(exprs)]
+    while stack:
+        e, expanded = stack.pop()
+        if expanded:
+            if uses[id(e)] > 1 and e.children():
+                name = '_t{0}'.format(next(_definitions))
+                definitions.append('(define-fun {0} () {1} {2})'.format(
+                    name, e.sort(), render_expression(e, defined)))
+                defined[id(e)] = (e, name)
+            continue
+        elif id(e) in visited or id(e) in defined:
+            continue
+
+        visited.add(id(e))
+        stack.append((e, True))
+        for c in e.children():
+            if id(c) not in visited:
+                stack.append((c, False))
+
+    terms = []
+    for e in exprs:
+        if id(e) in defined:
+            terms.append(defined[id(e)][1])
+        else:
+            terms.append(render_expression(e, defined))
+    return definitions, terms
+
+
+# hash-consing of expressions; off unless set_interning(True) is called.
+_interning = False
+_interned = weakref.WeakValueDictionary()
+_interned_lock = threading.Lock()
+
+# set by smt.simplify.set_simplify() to rewrite nodes as they are built
+_rewrite = None
+
+# slots that hold cached values rather than structure
+_unkeyed = frozenset(['smt2_cache', 'symbols_cache', 'fingerprint', '__weakref__'])
+
+
+def set_interning(enabled):
+    """Turn hash-consing of expressions on or off. While it is on,
+    building an expression structurally identical to one that is still
+    alive returns the existing node, so identical subterms share memory
+    and caches, and can be compared with 'is'.
+    """
+
+    global _interning
+    _interning = enabled
+
+
+def interned_count():
+    return len(_interned)
+
+
+def _intern_key(expr):
+    key = [type(expr)]
+    for slot in type(expr).__slots__:
+        if slot in _unkeyed:
+            continue
+        value = getattr(expr, slot)
+        if isinstance(value, list):
+            value = tuple(id(v) for v in value)
+        elif hasattr(value, 'children'):
+            value = id(value)
+        key.append(value)
+    return tuple(key)
+
+
+# class -> (seed, slots holding structure rather than cached values)
+_structure = dict()
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _string_fingerprint(string):
+    # str hashes are randomised per process, so strings are hashed here
+    digest = hashlib.blake2b(string.encode('utf8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _fingerprint(expr):
+    """A 64-bit structural hash of expr, from its class, its own fields
+    and the fingerprints of its children; the same in every process.
+    """
+
+    cls = type(expr)
+    structure = _structure.get(cls)
+    if structure is None:
+        structure = _structure[cls] = (
+            _string_fingerprint(cls.__module__ + '.' + cls.__name__),
+            tuple(slot for slot in cls.__slots__ if slot not in _unkeyed))
+
+    fields = [structure[0]]
+    for slot in structure[1]:
+        value = getattr(expr, slot)
+        if value.__class__ is str:
+            fields.append(_string_fingerprint(value))
+        elif value.__class__ in (int, bool):
+            # int hashes are taken modulo a 61-bit prime, so wide values
+            # go in as 32-bit pieces to keep them distinct
+            value = int(value)
+            while value > 0xffffffff:
+                fields.append(value & 0xffffffff)
+                value >>= 32
+            fields.append(value)
+
+    for c in expr.children():
+        fields.append(c.fingerprint)
+    return hash(tuple(fields)) & 0xffffffffffffffff
+
+
+class ExpressionType(type):
+    """Metaclass for expressions. Gives each new node its fingerprint,
+    optionally simplifies it, and while interning is on returns an
+    existing identical node rather than the new one. Children are keyed
+    by identity, which is safe since a node keeps its children alive and
+    its entry goes away with it.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        expr = type.__call__(cls, *args, **kwargs)
+        if _rewrite is not None:
+            # the children were built (and so simplified) first
+            output = _rewrite(expr)
+            if output is not expr:
+                return output
+
+        if not _interning:
+            expr.fingerprint = _fingerprint(expr)
+            return expr
+
+        key = _intern_key(expr)
+        with _interned_lock:
+            existing = _interned.get(key)
+            if existing is not None:
+                return existing
+            expr.fingerprint = _fingerprint(expr)
+            _interned[key] = expr
+        return expr
+
+
 def name(o):
     return o.__class__.__module__ + '.' + o.__class__.__name__
 
@@ -100,6 +458,31 @@ class SolverError(Exception):
             return 'Solver error: {0}'.format(self.error)
 
 
+class SolverUnknown(SolverError):
+    """The solver gave up without an answer; reason is 'unknown',
+    'timeout', 'memout' or 'cancelled'.
+    """
+
+    def __init__(self, reason, formula=None):
+        SolverError.__init__(self, reason, formula)
+        self.reason = reason
+
+
+    def __str__(self):
+        return 'Solver gave up: {0}'.format(self.reason)
+
+
+class SessionError(Exception):
+
+
+    def __init__(self, error):
+        self.error = error
+
+
+    def __str__(self):
+        return 'Session error: {0}'.format(self.error)
+
+
 class InvalidExpression(Exception):
     
 